@@ -1,47 +1,128 @@
 import argparse
 import sys
 import asyncio
+from pathlib import Path
 
-from . import scrape, ingest, query, chat
+# Other command modules are imported on dispatch, keeping torch, chromadb and selenium off the startup path
+from . import store
+from .profiling import MODES, Profiler
+
+def _profile_argv(argv):
+    """Expand a bare --profile to --profile=cpu, so positional arguments after it aren't read as its mode."""
+    return [
+        '--profile=cpu' if arg == '--profile' and (i + 1 == len(argv) or argv[i + 1] not in MODES) else arg
+        for i, arg in enumerate(argv)
+    ]
 
 def main():
+    # --profile is accepted before or after the subcommand
+    profile_help = 'Profile the command (default cpu) and write the result to data/profiles'
+    profile_parent = argparse.ArgumentParser(add_help=False)
+    profile_parent.add_argument('--profile', nargs='?', const='cpu', choices=MODES, default=argparse.SUPPRESS, help=profile_help)
+    
     parser = argparse.ArgumentParser(prog="bot")
+    parser.add_argument('--profile', nargs='?', const='cpu', choices=MODES, help=profile_help)
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
-    # Add subparser for scrape
-    subparsers.add_parser("scrape", help="Scrape data from external sources")
+    # Add subparser for scrape with crawl options
+    scrape_parser = subparsers.add_parser("scrape", help="Scrape data from external sources", parents=[profile_parent])
+    scrape_parser.add_argument('--crawl', action='store_true', help='Treat urls.txt entries as seeds and crawl recursively')
+    scrape_parser.add_argument('--max-depth', type=int, help='Maximum link depth from a seed (crawl mode)')
+    scrape_parser.add_argument('--max-pages', type=int, help='Maximum pages to download (crawl mode)')
+    scrape_parser.add_argument('--reset', action='store_true', help='Discard saved crawl state and start over (crawl mode)')
+    
+    # Add subparser for single-pass scrape and ingest
+    sync_parser = subparsers.add_parser("sync", help="Scrape and ingest in one pass, embedding documents as they arrive", parents=[profile_parent])
+    sync_parser.add_argument('--resume', action='store_true', help='Continue an interrupted sync instead of starting a new build')
     
     # Add subparser for ingest
-    subparsers.add_parser("ingest", help="Ingest data into storage")
+    ingest_parser = subparsers.add_parser("ingest", help="Ingest data into storage", parents=[profile_parent])
+    ingest_parser.add_argument('--resume', action='store_true', help='Continue an interrupted build instead of starting over')
+    
+    # Add subparser for store maintenance
+    store_parser = subparsers.add_parser("store", help="Manage the raw document store", parents=[profile_parent])
+    store_parser.add_argument('action', choices=['stats', 'migrate'], help='Show statistics or import legacy data/raw files')
+    store_parser.add_argument('--raw-dir', type=Path, default=store.RAW_DIR, help='Legacy raw directory to import')
+    
+    # Add subparser for HNSW tuning
+    tune_parser = subparsers.add_parser("tune-index", help="Pick the fastest HNSW search_ef that meets a recall target", parents=[profile_parent])
+    tune_parser.add_argument('--target', type=float, help='Recall@k to reach (default from config.yaml)')
+    tune_parser.add_argument('--dry-run', action='store_true', help='Report results without updating config.yaml')
+    
+    # Add subparser for index snapshots
+    snapshot_parser = subparsers.add_parser("snapshot", help="Export or import portable index snapshots", parents=[profile_parent])
+    snapshot_parser.add_argument('action', choices=['export', 'import', 'info'], help='Export the live index, import an archive, or describe one')
+    snapshot_parser.add_argument('path', nargs='?', type=Path, help='Archive to write (export, default data/snapshots/) or read (import/info)')
+    snapshot_parser.add_argument('--force', action='store_true', help='Import even if the snapshot looks incompatible')
+    
+    # Add subparser for model management
+    model_parser = subparsers.add_parser("models", aliases=["model"], help="Manage and benchmark embedding models", parents=[profile_parent])
+    model_parser.add_argument('action', choices=['list', 'prepare', 'bench'], help='List the registry, write a local safetensors snapshot, or benchmark models')
+    model_parser.add_argument('-m', '--model', action='append', help='Registry key (default: embeddings.model; repeatable for bench)')
+    model_parser.add_argument('--dtype', choices=['float32', 'float16', 'bfloat16'], help='Snapshot weight dtype (default from config.yaml)')
+    model_parser.add_argument('--labels', type=Path, default=Path(__file__).parent.parent.parent / "eval.yaml", help='Labeled questions used as bench queries')
+    
+    # Add subparser for retrieval evaluation
+    eval_parser = subparsers.add_parser("eval", help="Sweep chunking/search parameters against labeled questions", parents=[profile_parent])
+    eval_parser.add_argument('--labels', type=Path, default=Path(__file__).parent.parent.parent / "eval.yaml", help='Labeled question file')
+    eval_parser.add_argument('--workers', type=int, help='Candidate indexes built in parallel')
+    eval_parser.add_argument('--max-documents', type=int, help='Limit corpus size (labeled URLs are always included)')
     
     # Add subparser for query with its arguments
-    query_parser = subparsers.add_parser("query", help="Query the stored data")
+    query_parser = subparsers.add_parser("query", help="Query the stored data", parents=[profile_parent])
     query_group = query_parser.add_mutually_exclusive_group()
     query_group.add_argument('-l', '--list', action='store_true', help='List all documents')
     query_group.add_argument('query', nargs='?', help='Search query')
     query_parser.add_argument('-n', '--num-results', type=int, default=5, help='Number of results to show')
     query_parser.add_argument('-v', '--verbose', action='store_true', help='Show full result details')
+    query_parser.add_argument('-s', '--source', action='append', help='Restrict search to a source domain (repeatable)')
     
     # Add subparser for chat with its arguments
-    chat_parser = subparsers.add_parser("chat", help="Chat with the bot")
+    chat_parser = subparsers.add_parser("chat", help="Chat with the bot", parents=[profile_parent])
     chat_parser.add_argument('-v', '--verbose', action='store_true',
                            help='Show source references')
     chat_parser.add_argument('-vv', '--very-verbose', action='store_true',
                            help='Show source chunks and metadata')
 
-    args = parser.parse_args()
-    
-    if args.command == "scrape":
-        asyncio.run(scrape.run_scrape())
-    elif args.command == "ingest":
-        ingest.run_ingest()
-    elif args.command == "query":
-        query.run_query(args)
-    elif args.command == "chat":
-        chat.run_chat(args)
-    else:
-        parser.print_help()
-        sys.exit(1)
+    args = parser.parse_args(_profile_argv(sys.argv[1:]))
+    
+    with Profiler(args.profile, args.command) as profiler:
+        if args.command == "scrape":
+            if args.crawl:
+                from . import crawl
+                asyncio.run(profiler.wrap(crawl.run_crawl(args)))
+            else:
+                from . import scrape
+                asyncio.run(profiler.wrap(scrape.run_scrape()))
+        elif args.command == "sync":
+            from . import sync
+            asyncio.run(profiler.wrap(sync.run_sync(args)))
+        elif args.command == "ingest":
+            from . import ingest
+            ingest.run_ingest(args)
+        elif args.command == "store":
+            store.run_store(args)
+        elif args.command == "tune-index":
+            from . import hnsw
+            hnsw.run_tune_index(args)
+        elif args.command == "snapshot":
+            from . import snapshot
+            snapshot.run_snapshot(args)
+        elif args.command in ("models", "model"):
+            from . import model
+            model.run_model(args)
+        elif args.command == "eval":
+            from . import evaluate
+            evaluate.run_eval(args)
+        elif args.command == "query":
+            from . import query
+            query.run_query(args)
+        elif args.command == "chat":
+            from . import chat
+            chat.run_chat(args)
+        else:
+            parser.print_help()
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -7,6 +7,7 @@ import sys
 from prompt_toolkit import PromptSession
 from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.keys import Keys
+from prompt_toolkit.patch_stdout import patch_stdout
 import sys
 
 logger = logging.getLogger(__name__)
@@ -60,17 +61,24 @@ class ChatCLI:
             """Handle Meta/Alt+Enter for newline."""
             event.current_buffer.insert_text('\n')
     
+    def _status_toolbar(self) -> str:
+        """Index loading status shown under the prompt."""
+        return f" Index: {self.session.status()}"
+    
     def _get_input(self) -> str:
         """Get multi-line input from user using prompt_toolkit."""
         try:
-            # Use custom prompt with key bindings
-            user_input = self.prompt_session.prompt(
-                "\n> ",
-                key_bindings=self.kb,
-                multiline=True,
-                wrap_lines=True,
-                enable_suspend=True,  # Allow Ctrl+C to work
-            )
+            # Use custom prompt with key bindings. Output from the background loader is printed above it
+            with patch_stdout():
+                user_input = self.prompt_session.prompt(
+                    "\n> ",
+                    key_bindings=self.kb,
+                    multiline=True,
+                    wrap_lines=True,
+                    enable_suspend=True,  # Allow Ctrl+C to work
+                    bottom_toolbar=self._status_toolbar,
+                    refresh_interval=0.5  # Keep the loading status current while the user types
+                )
             return user_input.strip()
             
         except KeyboardInterrupt:
@@ -102,6 +110,10 @@ class ChatCLI:
                     self._show_help()
                     continue
                 
+                if user_input.lower() == 'status':
+                    print(f"\nIndex: {self.session.status()}")
+                    continue
+                
                 try:
                     # Get response from Claude with relevant context
                     response = self.session.get_response(user_input)
@@ -121,6 +133,7 @@ class ChatCLI:
         """Show available commands."""
         print("\nAvailable Commands:")
         print("  help     Show this help message")
+        print("  status   Show index loading status")
         print("  exit     Exit the program")
         print("\nInput Controls:")
         print("  Enter         Submit input")
@@ -147,7 +160,10 @@ def run_chat(args=None):
             args = parser.parse_args()
         
         cli = ChatCLI(args.verbose, args.very_verbose)
-        cli.start()
+        try:
+            cli.start()
+        finally:
+            cli.session.close()
     except ValueError as e:
         if "ANTHROPIC_API_KEY" in str(e):
             logger.error(f"Configuration error: {str(e)}")
@@ -1,13 +1,19 @@
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 import anthropic
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
-from tenacity import retry, stop_after_attempt, wait_exponential
-from .query import Querier
 
 logger = logging.getLogger(__name__)
 
+# Status codes worth retrying: rate limits, overload and transient server errors
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
 class ChatSession:
     def __init__(self, config: dict, verbose: bool = False, very_verbose: bool = False):
         self.config = config
@@ -21,20 +27,46 @@ class ChatSession:
         api_key = os.getenv('ANTHROPIC_API_KEY')
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY not found in environment variables")
-            
-        self.client = anthropic.Anthropic(api_key=api_key)
+        
+        # Retries are handled per request below, so disable the SDK's own
+        self.client = anthropic.Anthropic(
+            api_key=api_key,
+            base_url=self.config['llm'].get('base_url') or None,
+            max_retries=0
+        )
         
         # Get model settings
         self.model = self.config['llm']['model']
         self.max_tokens = self.config['llm']['max_tokens_per_request']
         self.temperature = self.config['llm']['temperature']
         
+        # Get latency settings
+        retry_config = self.config['llm'].get('retry', {})
+        self.max_attempts = retry_config.get('max_attempts', 3)
+        self.base_delay = retry_config.get('base_delay', 1)
+        self.max_delay = retry_config.get('max_delay', 10)
+        hedge_config = self.config['llm'].get('hedge', {})
+        self.hedge_enabled = hedge_config.get('enabled', True)
+        self.hedge_percentile = hedge_config.get('percentile', 95)
+        self.hedge_min_samples = hedge_config.get('min_samples', 5)
+        self.deadline = self.config['chat'].get('deadline', 90)
+        
+        # Recent successful LLM latencies, used to decide when to hedge
+        self.latencies = deque(maxlen=hedge_config.get('window', 50))
+        self.llm_pool = ThreadPoolExecutor(max_workers=4)
+        
         # Load prompts
         self.system_prompt = self.config['llm']['prompts']['system']
         self.query_prompt = self.config['llm']['prompts']['query']
         
-        # Initialize document querier
-        self.querier = Querier()
+        # The embedding model and index load in the background so the prompt appears immediately
+        self.querier = None
+        self.load_status = "starting"
+        self.load_error = None
+        self.load_started = time.monotonic()
+        self.load_time = None
+        self.querier_ready = threading.Event()
+        threading.Thread(target=self._load_querier, name="querier-loader", daemon=True).start()
         
         # Chat history
         self.history = []
@@ -42,60 +74,212 @@ class ChatSession:
         
         # Get chunking settings
         self.max_chunks = self.config['chunking'].get('max_chunks', 5)
-        self.min_relevance = self.config['chunking'].get('min_relevance', 0.7)
+        self.min_relevance = self.config['chunking'].get('min_relevance', 0.83)
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    def get_response(self, query: str) -> str:
-        """Get response from Claude using relevant document context."""
+    def _load_querier(self):
+        """Load the embedding model, open the index and run a warm-up search (background thread)."""
         try:
-            # Get relevant documents
-            results = self.querier.search(
-                query, 
-                n_results=self.max_chunks,
-                verbose=self.verbose  # Show all search results
-            )
+            # torch and chromadb are only imported here, off the startup path
+            self.load_status = "loading libraries"
+            from .embeddings import InstructorEmbeddingFunction
+            from .query import Querier
+            
+            self.load_status = "loading embedding model"
+            embedding_function = InstructorEmbeddingFunction()
+            self.load_status = "opening index"
+            querier = Querier(embedding_function=embedding_function)
+            
+            # The first encode and search pay for kernel selection and HNSW loading; do it before the user asks
+            self.load_status = "warming up"
+            querier.search("warm up", n_results=1)
+            
+            self.querier = querier
+            self.load_time = time.monotonic() - self.load_started
+            self.load_status = "ready"
+            logger.info(f"Index ready in {self.load_time:.1f}s")
+        except Exception as e:
+            self.load_error = e
+            self.load_status = "failed"
+            logger.error(f"Failed to load the index: {e}")
+            logger.debug("Full traceback:", exc_info=True)
+        finally:
+            self.querier_ready.set()
+
+    def status(self) -> str:
+        """One-line description of background loading progress."""
+        if self.load_status == "ready":
+            return f"ready (loaded in {self.load_time:.1f}s)"
+        if self.load_status == "failed":
+            return f"failed to load: {self.load_error}"
+        return f"{self.load_status}... {time.monotonic() - self.load_started:.0f}s"
+
+    def close(self):
+        """Release the querier's worker threads and processes, once loading has finished, and the LLM threads."""
+        self.llm_pool.shutdown(wait=False)
+        if self.querier:
+            self.querier.close()
+
+    def wait_until_ready(self):
+        """Block until background loading has finished, raising if it failed."""
+        if not self.querier_ready.is_set():
+            print(f"\nWaiting for the index ({self.status()})")
+            self.querier_ready.wait()
+        if self.load_error:
+            raise RuntimeError(f"Index failed to load: {self.load_error}")
+
+    def _build_context(self, query: str) -> str:
+        """Retrieve relevant chunks and format them as prompt context."""
+        # Get relevant documents
+        results = self.querier.search(
+            query,
+            n_results=self.max_chunks,
+            verbose=self.verbose  # Show all search results
+        )
+        
+        context = ""
+        if not results:
+            logger.warning("No relevant documents found in the vector store")
+            if self.verbose:
+                print("\nWarning: No relevant documentation found in local storage.")
+        else:
+            # Filter results by relevance score
+            results = [r for r in results if r['relevance'] >= self.min_relevance]
             
-            context = ""
             if not results:
-                logger.warning("No relevant documents found in the vector store")
+                logger.warning(f"Found results but none met the minimum relevance threshold of {self.min_relevance}")
+                if self.verbose:
+                    print(f"\nWarning: Found results but none met the minimum relevance threshold of {self.min_relevance}")
+            else:
+                # Build context from filtered results
+                context_parts = []
                 if self.verbose:
-                    print("\nWarning: No relevant documentation found in local storage.")
+                    print("\nUsing chunks for context:")
+                    for i, r in enumerate(results, 1):
+                        print(f"  {i}. {r['url']} (relevance: {r['relevance']:.2%})")
+                
+                for r in results:
+                    source_ref = f"From {r['url']}"
+                    if 'pages' in r:
+                        source_ref += f" (pages {r['pages'][0]}-{r['pages'][1]})"
+                    context_parts.append(f"{source_ref}:\n{r['content']}")
+                
+                context = "\n\n".join(context_parts)
+        
+        return context
+
+    def _hedge_after(self) -> Optional[float]:
+        """Latency after which a hedged request is sent, or None if not hedging yet."""
+        if not self.hedge_enabled or len(self.latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))
+        return ordered[index]
+
+    def _create(self, messages: List[Dict], timeout: float):
+        """Send a single Messages request and record its latency."""
+        start = time.monotonic()
+        response = self.client.with_options(timeout=timeout).messages.create(
+            model=self.model,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            system=self.system_prompt,
+            messages=messages
+        )
+        self.latencies.append(time.monotonic() - start)
+        return response
+
+    def _hedged_create(self, messages: List[Dict], deadline: float):
+        """Send a request, and a second identical one if the first is slower than usual.
+        
+        Whichever succeeds first wins. The loser is left to finish in the
+        background since the SDK call can't be cancelled.
+        """
+        remaining = deadline - time.monotonic()
+        pending = {self.llm_pool.submit(self._create, messages, remaining)}
+        hedge_after = self._hedge_after()
+        
+        if hedge_after is not None and hedge_after < remaining:
+            done, pending = wait(pending, timeout=hedge_after)
+            if not done:
+                logger.info(f"LLM request exceeded p{self.hedge_percentile} latency ({hedge_after:.1f}s), sending hedged request")
+                pending.add(self.llm_pool.submit(self._create, messages, deadline - time.monotonic()))
             else:
-                # Filter results by relevance score
-                results = [r for r in results if r['relevance'] >= self.min_relevance]
+                pending = done
+        
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError("LLM request exceeded the response deadline")
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """Extract the server's requested delay from a failed response, in seconds."""
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        headers = response.headers
+        try:
+            if 'retry-after-ms' in headers:
+                return float(headers['retry-after-ms']) / 1000
+            if 'retry-after' in headers:
+                value = headers['retry-after']
+                try:
+                    return float(value)
+                except ValueError:
+                    return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+        return None
+
+    def _call_llm(self, messages: List[Dict], deadline: float):
+        """Call the LLM with retries on transient errors, within the turn's deadline."""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return self._hedged_create(messages, deadline)
+            except (anthropic.APIConnectionError, anthropic.APIStatusError) as e:
+                status = getattr(e, 'status_code', None)
+                if isinstance(e, anthropic.APIStatusError) and status not in RETRYABLE_STATUS:
+                    raise
+                if attempt == self.max_attempts:
+                    raise
+                
+                delay = self._retry_after(e)
+                if delay is None:
+                    delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+                if time.monotonic() + delay >= deadline:
+                    logger.error(f"Not retrying LLM request: {delay:.1f}s backoff would exceed the response deadline")
+                    raise
                 
-                if not results:
-                    logger.warning(f"Found results but none met the minimum relevance threshold of {self.min_relevance}")
-                    if self.verbose:
-                        print(f"\nWarning: Found results but none met the minimum relevance threshold of {self.min_relevance}")
-                else:
-                    # Build context from filtered results
-                    context_parts = []
-                    if self.verbose:
-                        print("\nUsing chunks for context:")
-                        for i, r in enumerate(results, 1):
-                            print(f"  {i}. {r['url']} (relevance: {r['relevance']:.2%})")
-                    
-                    for r in results:
-                        source_ref = f"From {r['url']}"
-                        context_parts.append(f"{source_ref}:\n{r['content']}")
-                    
-                    context = "\n\n".join(context_parts)
+                logger.warning(f"LLM request failed ({status or type(e).__name__}), retrying in {delay:.1f}s (attempt {attempt}/{self.max_attempts})")
+                time.sleep(delay)
+
+    def get_response(self, query: str) -> str:
+        """Get response from Claude using relevant document context."""
+        try:
+            # Only the first question can block here, and only on loading still outstanding
+            self.wait_until_ready()
+            deadline = time.monotonic() + self.deadline
+            
+            # Retrieval runs once per turn; only the LLM call is retried
+            context = self._build_context(query)
             
             # Format prompt with context
             prompt = self.query_prompt.format(context=context or "No relevant documentation found.", query=query)
             
             # Get response from Claude
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=self.max_tokens,
-                temperature=self.temperature,
-                system=self.system_prompt,
-                messages=[
+            response = self._call_llm(
+                [
                     *[{"role": "user" if i % 2 == 0 else "assistant", "content": msg}
                       for i, msg in enumerate(self.history)],
                     {"role": "user", "content": prompt}
-                ]
+                ],
+                deadline
             )
             
             # Update history
@@ -104,8 +288,8 @@ class ChatSession:
                 self.history = self.history[-self.max_history * 2:]
             
             return response.content[0].text
-            
+        
         except Exception as e:
             logger.error(f"Error in get_response: {str(e)}")
             logger.debug("Full traceback:", exc_info=True)
-            raise
\ No newline at end of file
+            raise
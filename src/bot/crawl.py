@@ -0,0 +1,387 @@
+import asyncio
+import gzip
+import hashlib
+import logging
+import math
+import signal
+import sqlite3
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import yaml
+from bs4 import BeautifulSoup
+
+from .ratelimit import DomainPausedError, RetryableFetchError
+from .scrape import Scraper, load_urls
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+CRAWL_DIR = PROJECT_ROOT / "data/crawl"
+
+class BloomFilter:
+    """Fixed-size Bloom filter over URL strings, persisted as a flat bit array."""
+
+    def __init__(self, capacity: int, error_rate: float, path: Optional[Path] = None):
+        # Standard sizing: m = -n ln(p) / (ln 2)^2, k = m/n ln 2
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.path = path
+
+        if path and path.exists() and path.stat().st_size == (self.num_bits + 7) // 8:
+            self.bits = bytearray(path.read_bytes())
+        else:
+            self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        # Double hashing from a single 128-bit digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def add(self, item: str) -> bool:
+        """Add an item, return True if it was (probably) not seen before."""
+        is_new = False
+        for pos in self._positions(item):
+            mask = 1 << (pos & 7)
+            if not self.bits[pos >> 3] & mask:
+                self.bits[pos >> 3] |= mask
+                is_new = True
+        return is_new
+
+    def save(self):
+        """Persist the bit array atomically."""
+        if not self.path:
+            return
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_bytes(self.bits)
+        tmp_path.replace(self.path)
+
+class Frontier:
+    """On-disk crawl frontier backed by SQLite.
+
+    Entries move from 'pending' to 'in_progress' when claimed and to 'done' or
+    'failed' once fetched. Claimed entries left behind by an interrupted crawl
+    are returned to 'pending' on the next start. Transient failures go back to
+    'pending' with a not_before time, which makes the frontier the retry queue.
+    """
+
+    def __init__(self, path: Path):
+        self.conn = sqlite3.connect(str(path))
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS frontier (
+                url TEXT PRIMARY KEY,
+                depth INTEGER NOT NULL,
+                scope TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                not_before REAL NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS frontier_pending ON frontier(status, depth);
+        """)
+        # Frontiers from before retries were tracked lack the retry columns
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(frontier)")}
+        if 'attempts' not in columns:
+            self.conn.execute("ALTER TABLE frontier ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute("ALTER TABLE frontier ADD COLUMN not_before REAL NOT NULL DEFAULT 0")
+        self.conn.execute("UPDATE frontier SET status = 'pending' WHERE status = 'in_progress'")
+        self.conn.commit()
+
+    def add(self, entries: List[Dict]) -> int:
+        """Add new entries, ignoring URLs already in the frontier. Return number added."""
+        before = self.conn.total_changes
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO frontier (url, depth, scope) VALUES (:url, :depth, :scope)",
+            entries
+        )
+        self.conn.commit()
+        return self.conn.total_changes - before
+
+    def claim(self, limit: int) -> List[Dict]:
+        """Claim up to limit pending entries that are due, shallowest first."""
+        rows = self.conn.execute(
+            """SELECT url, depth, scope, attempts FROM frontier
+               WHERE status = 'pending' AND not_before <= ? ORDER BY depth, rowid LIMIT ?""",
+            (time.time(), limit)
+        ).fetchall()
+        self.conn.executemany(
+            "UPDATE frontier SET status = 'in_progress' WHERE url = ?", [(row[0],) for row in rows]
+        )
+        self.conn.commit()
+        return [{'url': url, 'depth': depth, 'scope': scope, 'attempts': attempts} for url, depth, scope, attempts in rows]
+
+    def defer(self, url: str, delay: float, count_attempt: bool = True):
+        """Return an entry to the queue, to be retried after delay seconds."""
+        self.conn.execute(
+            "UPDATE frontier SET status = 'pending', attempts = attempts + ?, not_before = ? WHERE url = ?",
+            (int(count_attempt), time.time() + delay, url)
+        )
+        self.conn.commit()
+
+    def next_due(self) -> Optional[float]:
+        """Seconds until the earliest deferred entry is due, or None if nothing is pending."""
+        row = self.conn.execute("SELECT MIN(not_before) FROM frontier WHERE status = 'pending'").fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def finish(self, url: str, status: str):
+        """Mark an entry as done or failed."""
+        self.conn.execute("UPDATE frontier SET status = ? WHERE url = ?", (status, url))
+        self.conn.commit()
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM frontier GROUP BY status").fetchall())
+
+    def close(self):
+        self.conn.close()
+
+class Crawler:
+    """Recursive crawler that expands urls.txt seeds through sitemaps and in-page links."""
+
+    def __init__(self, max_depth: int = None, max_pages: int = None, reset: bool = False):
+        # Load config
+        with open(PROJECT_ROOT / "config.yaml") as f:
+            config = yaml.safe_load(f)
+        self.config = config.get('scraping', {}).get('crawl', {}) or {}
+
+        self.max_depth = max_depth if max_depth is not None else self.config.get('max_depth', 2)
+        self.max_pages = max_pages if max_pages is not None else self.config.get('max_pages', 100000)
+        self.scope_mode = self.config.get('scope', 'prefix')
+        self.exclude_patterns = self.config.get('exclude_patterns', [])
+        self.concurrency = self.config.get('concurrency', 16)
+        self.per_domain_concurrency = self.config.get('per_domain_concurrency', 2)
+        self.use_sitemaps = self.config.get('sitemaps', True)
+        self.max_retries = (config.get('scraping', {}).get('rate_control', {}) or {}).get('max_retries', 3)
+
+        # Setup crawl state
+        CRAWL_DIR.mkdir(parents=True, exist_ok=True)
+        if reset:
+            for state_file in CRAWL_DIR.glob("*"):
+                state_file.unlink()
+        self.frontier = Frontier(CRAWL_DIR / "frontier.sqlite")
+        self.seen = BloomFilter(
+            capacity=self.config.get('expected_urls', 1000000),
+            error_rate=self.config.get('false_positive_rate', 0.001),
+            path=CRAWL_DIR / "seen.bloom"
+        )
+
+        self.scraper = Scraper()
+        self.domain_semaphores = {}
+        self.stopping = False
+        self.fetched = 0
+        self.failed = 0
+        self.retried = 0
+
+    def _scope_for(self, url: str) -> str:
+        """Return the URL prefix a seed's descendants must stay within."""
+        parsed = urlparse(url)
+        if self.scope_mode == 'domain':
+            return f"{parsed.scheme}://{parsed.netloc}/"
+        path = parsed.path if parsed.path.endswith('/') else parsed.path.rsplit('/', 1)[0] + '/'
+        return f"{parsed.scheme}://{parsed.netloc}{path}"
+
+    def _in_scope(self, url: str, scope: str) -> bool:
+        if not url.startswith(scope):
+            return False
+        return not any(pattern in url for pattern in self.exclude_patterns)
+
+    def _enqueue(self, urls: Iterable[str], depth: int, scope: str) -> int:
+        """Add unseen in-scope URLs to the frontier."""
+        entries = []
+        for url in urls:
+            url = urldefrag(url)[0]
+            if urlparse(url).scheme not in ('http', 'https') or not self._in_scope(url, scope):
+                continue
+            if self.seen.add(url):
+                entries.append({'url': url, 'depth': depth, 'scope': scope})
+        return self.frontier.add(entries) if entries else 0
+
+    def _extract_links(self, url: str, content: bytes) -> List[str]:
+        """Extract absolute link targets from an HTML page."""
+        soup = BeautifulSoup(content, 'html.parser')
+        return [urljoin(url, a['href']) for a in soup.find_all('a', href=True)]
+
+    async def _load_sitemap(self, url: str, scope: str, remaining: int = 50) -> int:
+        """Enqueue URLs from a sitemap or sitemap index, return number added."""
+        try:
+            result = await self.scraper._fetch_url(url)
+        except RetryableFetchError as e:
+            logger.warning(f"Skipping sitemap {url}: {e}")
+            return 0
+        if not result:
+            return 0
+
+        # Sitemaps are only parsed, never stored
+        content = self.scraper.read_content(result)
+        self.scraper.discard(result)
+        if url.endswith('.gz') or content[:2] == b'\x1f\x8b':
+            content = gzip.decompress(content)
+        try:
+            root = ET.fromstring(content)
+        except ET.ParseError as e:
+            logger.warning(f"Could not parse sitemap {url}: {e}")
+            return 0
+
+        locs = [el.text.strip() for el in root.iter() if el.tag.endswith('loc') and el.text]
+        if root.tag.endswith('sitemapindex'):
+            added = 0
+            for loc in locs[:remaining]:
+                added += await self._load_sitemap(loc, scope, remaining=0)
+            return added
+        return self._enqueue(locs, 1, scope)
+
+    async def seed(self, urls: List[str]):
+        """Add seed URLs and their sitemaps to the frontier."""
+        sitemap_roots = set()
+        for url in urls:
+            scope = self._scope_for(url)
+            self._enqueue([url], 0, scope)
+            if self.use_sitemaps:
+                parsed = urlparse(url)
+                sitemap_roots.add((f"{parsed.scheme}://{parsed.netloc}/sitemap.xml", scope))
+
+        for sitemap_url, scope in sorted(sitemap_roots):
+            if sitemap_url in self.seen:
+                continue
+            self.seen.add(sitemap_url)
+            added = await self._load_sitemap(sitemap_url, scope)
+            if added:
+                print(f"• Sitemap: {sitemap_url} (+{added} URLs)")
+
+    async def _crawl_one(self, entry: Dict):
+        """Fetch one frontier entry, store it and enqueue its links."""
+        url = entry['url']
+        domain = urlparse(url).netloc
+        semaphore = self.domain_semaphores.setdefault(domain, asyncio.Semaphore(self.per_domain_concurrency))
+
+        # Only HTML pages below max depth are read back for links
+        expand = entry['depth'] < self.max_depth
+        content = None
+        
+        async with semaphore:
+            # Already stored pages are expanded from the store instead of refetched
+            stored = self.scraper.store.get_document(url)
+            if stored:
+                if expand and 'html' in stored['content_type']:
+                    content = self.scraper.store.read_blob(stored['hash'])
+                print(f"• Cached: {url}")
+            else:
+                try:
+                    result = await self.scraper._fetch_url(url)
+                except DomainPausedError as e:
+                    # Nothing was sent, so this doesn't use up a retry
+                    self.frontier.defer(url, e.retry_after, count_attempt=False)
+                    print(f"↻ Deferred {e.retry_after:.0f}s: {url} ({e})")
+                    return
+                except RetryableFetchError as e:
+                    if entry['attempts'] >= self.max_retries:
+                        result = None
+                        logger.warning(f"Giving up on {url} after {entry['attempts']} retries: {e}")
+                    else:
+                        # Back to the frontier; other domains keep going meanwhile
+                        delay = self.scraper.retry_delay(entry['attempts'], e.retry_after)
+                        self.frontier.defer(url, delay)
+                        self.retried += 1
+                        print(f"↻ Retrying in {delay:.0f}s: {url} ({e})")
+                        return
+                if not result:
+                    self.failed += 1
+                    self.frontier.finish(url, 'failed')
+                    print(f"✗ Failed: {url}")
+                    return
+                if expand and 'html' in result['content_type']:
+                    content = self.scraper.read_content(result)
+                size_kb = self.scraper._save_content(result)
+                self.fetched += 1
+                print(f"✓ Downloaded: {url} ({size_kb}KB, depth {entry['depth']})")
+
+        if content:
+            try:
+                self._enqueue(self._extract_links(url, content), entry['depth'] + 1, entry['scope'])
+            except Exception as e:
+                logger.warning(f"Could not extract links from {url}: {e}")
+        self.frontier.finish(url, 'done')
+
+    def stop(self):
+        """Stop claiming new URLs; in-flight fetches are allowed to finish."""
+        if not self.stopping:
+            print("\nStopping crawl after in-flight requests finish (run again to resume)...")
+        self.stopping = True
+
+    async def run(self):
+        """Crawl until the frontier is exhausted, max_pages is reached or stop() is called."""
+        tasks = set()
+        processed = 0
+        try:
+            while not self.stopping and self.fetched < self.max_pages:
+                if len(tasks) < self.concurrency:
+                    for entry in self.frontier.claim(self.concurrency - len(tasks)):
+                        tasks.add(asyncio.create_task(self._crawl_one(entry)))
+                if not tasks:
+                    # Only deferred retries are left: sleep until the first is due
+                    wait = self.frontier.next_due()
+                    if wait is None:
+                        break
+                    await asyncio.sleep(min(wait, 5))
+                    continue
+
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                processed += len(done)
+                for task in done:
+                    if task.exception():
+                        logger.error(f"Crawl task failed: {task.exception()}")
+
+                # Periodically persist the seen-set so a crash loses little work
+                if processed % 100 < len(done):
+                    self.seen.save()
+
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            self.seen.save()
+
+        counts = self.frontier.counts()
+        print(f"\nCrawl summary: {self.fetched} downloaded, {self.failed} failed, {self.retried} retries, "
+              f"{counts.get('done', 0)} done, {counts.get('pending', 0) + counts.get('in_progress', 0)} pending")
+        for line in self.scraper.rate_summary():
+            print(f"• Rate control: {line}")
+        if self.scraper.render_summary():
+            print(f"• Selenium render times: {self.scraper.render_summary()}")
+
+    async def close(self):
+        await self.scraper.close()
+        self.frontier.close()
+
+async def run_crawl(args=None):
+    """Entry point for crawl mode: treat urls.txt entries as seeds."""
+    urls = load_urls()
+    if not urls:
+        return
+
+    crawler = Crawler(
+        max_depth=getattr(args, 'max_depth', None),
+        max_pages=getattr(args, 'max_pages', None),
+        reset=getattr(args, 'reset', False)
+    )
+
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGINT, crawler.stop)
+    except NotImplementedError:
+        pass  # Signal handlers aren't available on all platforms
+
+    print(f"\nSeeding crawl with {len(urls)} URLs (max depth {crawler.max_depth})...")
+    try:
+        await crawler.seed(urls)
+        await crawler.run()
+    finally:
+        await crawler.close()
+
+if __name__ == "__main__":
+    asyncio.run(run_crawl())
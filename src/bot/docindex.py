@@ -0,0 +1,95 @@
+import json
+import logging
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import yaml
+
+from .quant import exact_distances
+from .shards import domain_matches, normalize_source
+
+logger = logging.getLogger(__name__)
+
+# Document-level index files live next to each shard's Chroma database
+DOC_DIR_NAME = "documents"
+
+class DocumentIndex:
+    """Document-level vectors over one collection, for coarse-to-fine search.
+
+    Each document is represented by the normalized mean of its chunk
+    embeddings. A query is ranked against these first, so only the chunks
+    of its best few documents need to be scored. There is one vector per
+    document rather than per chunk, so the whole index is held in memory.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / "meta.yaml") as f:
+            self.meta = yaml.safe_load(f)
+        with open(self.path / "documents.json") as f:
+            documents = json.load(f)
+        self.urls = [doc['url'] for doc in documents]
+        self.domains = np.array([doc['domain'] for doc in documents])
+        self.chunks = [doc['chunks'] for doc in documents]
+        self.vectors = np.load(self.path / "vectors.npy")
+
+    @staticmethod
+    def exists(path: Path) -> bool:
+        return (Path(path) / "meta.yaml").exists()
+
+    @classmethod
+    def build(cls, collection, path: Path, space: str, page_size: int = 5000) -> 'DocumentIndex':
+        """Average a collection's chunk embeddings per document and save the result."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        count = collection.count()
+        if not count:
+            raise ValueError("Cannot build a document index for an empty collection")
+
+        # Running sums per URL, so chunks are streamed out of Chroma a page at a time
+        sums = {}
+        documents = {}
+        for offset in range(0, count, page_size):
+            page = collection.get(include=['embeddings', 'metadatas'], limit=page_size, offset=offset)
+            for embedding, meta in zip(np.asarray(page['embeddings'], dtype=np.float32), page['metadatas']):
+                url = meta['url']
+                if url in sums:
+                    sums[url] += embedding
+                    documents[url]['chunks'] += 1
+                else:
+                    sums[url] = embedding.copy()
+                    documents[url] = {'url': url, 'domain': meta.get('domain', ''), 'chunks': 1}
+
+        urls = sorted(sums)
+        vectors = np.stack([sums[url] / documents[url]['chunks'] for url in urls])
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        np.save(path / "vectors.npy", vectors.astype(np.float32))
+        with open(path / "documents.json", 'w') as f:
+            json.dump([documents[url] for url in urls], f)
+        with open(path / "meta.yaml", 'w') as f:
+            yaml.safe_dump({'space': space, 'documents': len(urls), 'chunks': count, 'dim': int(vectors.shape[1])}, f)
+
+        return cls(path)
+
+    def top_documents(self, query: List[float], m: int, sources: List[str] = None) -> List[Tuple[str, float]]:
+        """The m documents closest to the query, as (url, distance) pairs, best first."""
+        distances = exact_distances(np.asarray(query, dtype=np.float32), self.vectors, self.meta['space'])
+        if sources:
+            sources = {normalize_source(source) for source in sources}
+            matches = np.fromiter((domain_matches(domain, sources) for domain in self.domains), dtype=bool, count=len(self.domains))
+            distances = np.where(matches, distances, np.inf)
+        m = min(m, len(distances))
+        nearest = np.argpartition(distances, m - 1)[:m]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [(self.urls[i], float(distances[i])) for i in nearest if np.isfinite(distances[i])]
+
+def join_chunks(texts: List[str]) -> str:
+    """Join consecutive chunks of a document, dropping the words each repeats from the one before."""
+    words = texts[0].split()
+    for text in texts[1:]:
+        following = text.split()
+        overlap = next((k for k in range(min(len(words), len(following)), 0, -1) if words[-k:] == following[:k]), 0)
+        words.extend(following[overlap:])
+    return ' '.join(words)
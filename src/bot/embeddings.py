@@ -3,64 +3,305 @@ from sentence_transformers import SentenceTransformer
 from chromadb.utils import embedding_functions
 import torch
 import logging
+import os
+import queue
+import threading
+import time
+import multiprocessing as mp
+import numpy as np
 import yaml
 from pathlib import Path
 from tqdm.auto import tqdm
+from .profiling import torch_region
 
 logger = logging.getLogger(__name__)
 
+# Local pre-converted model snapshots written by `bot model prepare`
+MODELS_DIR = Path(__file__).parent.parent.parent / "data/models"
+SNAPSHOT_INFO = "snapshot.yaml"
+
+# Used when config.yaml has no embeddings.models registry
+DEFAULT_MODEL = 'instructor-xl'
+DEFAULT_MODELS = {
+    'instructor-xl': {
+        'name': 'hkunlp/instructor-xl',
+        'document_instruction': "Represent this document for retrieval of relevant information about OAuth and SAML security:",
+        'query_instruction': "Represent this document for retrieval of relevant information about OAuth and SAML security:",
+        'dims': 768,
+        'max_length': 512
+    }
+}
+
+def model_spec(config: dict, key: str = None) -> dict:
+    """Look up a model in the embeddings.models registry (the configured model by default)."""
+    embeddings = config.get('embeddings', {}) or {}
+    models = embeddings.get('models') or DEFAULT_MODELS
+    key = key or embeddings.get('model', DEFAULT_MODEL)
+    if key not in models:
+        raise ValueError(f"Unknown embedding model '{key}', expected one of: {', '.join(models)}")
+    spec = {'document_instruction': '', 'query_instruction': '', 'dims': None, 'max_length': None}
+    spec.update(models[key])
+    spec['key'] = key
+    return spec
+
+def with_instruction(instruction: str, texts: List[str]) -> List[str]:
+    """Prepend a model's instruction or prefix to each text."""
+    return [f"{instruction} {text}" for text in texts] if instruction else list(texts)
+
+def resolve_device(device_type: str) -> str:
+    """Map the configured device type to an available torch device."""
+    device_type = device_type.lower()
+    if device_type == 'rocm' and torch.cuda.is_available():
+        tqdm.write("INFO:bot.embeddings:Using ROCm/CUDA device for embeddings")
+        return "cuda"
+    if device_type == 'mps' and hasattr(torch.backends, 'mps') and torch.backends.mps.is_available():
+        tqdm.write("INFO:bot.embeddings:Using Apple Silicon (MPS) for embeddings")
+        return "mps"
+    if device_type == 'cuda' and torch.cuda.is_available():
+        tqdm.write("INFO:bot.embeddings:Using CUDA device for embeddings")
+        return "cuda"
+    if device_type != 'cpu':
+        tqdm.write(f"WARNING:bot.embeddings:Requested device type '{device_type}' not available, falling back to CPU")
+    tqdm.write("INFO:bot.embeddings:Using CPU for embeddings")
+    return "cpu"
+
+def snapshot_dir(model_name: str) -> Path:
+    """Return the local snapshot directory for a hub model name."""
+    return MODELS_DIR / model_name.replace('/', '--')
+
+def load_model(model_name: str, device: str, max_length: int = None) -> SentenceTransformer:
+    """Load a model, preferring a local safetensors snapshot over the hub cache."""
+    start = time.perf_counter()
+    snapshot = snapshot_dir(model_name)
+    
+    if (snapshot / SNAPSHOT_INFO).exists():
+        with open(snapshot / SNAPSHOT_INFO) as f:
+            dtype = yaml.safe_load(f).get('dtype', 'float32')
+        if device == 'cpu' and dtype == 'float16':
+            dtype = 'float32'  # fp16 matmuls are slow or unsupported on CPU
+        
+        # safetensors weights are memory-mapped and materialized directly in the
+        # target dtype, with no hub lookups and no random initialization first
+        model = SentenceTransformer(
+            str(snapshot),
+            device=device,
+            local_files_only=True,
+            model_kwargs={'torch_dtype': getattr(torch, dtype), 'low_cpu_mem_usage': True}
+        )
+        model.to(getattr(torch, dtype))  # Non-transformer modules (e.g. Dense) load as float32
+        source = f"local snapshot ({dtype})"
+    else:
+        # Use sentence-transformers version instead of INSTRUCTOR directly
+        model = SentenceTransformer(model_name)
+        model.to(device)
+        source = "hub cache (run `bot models prepare` for faster startup)"
+    
+    if max_length:
+        model.max_seq_length = max_length
+    tqdm.write(f"INFO:bot.embeddings:Loaded {model_name} from {source} in {time.perf_counter() - start:.2f}s")
+    return model
+
+def _replica_main(replica: int, model_name: str, max_length: int, device: str, cores: List[int], threads: int, requests, results):
+    """Worker process: load one model replica and encode batches until told to stop."""
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    
+    try:
+        model = load_model(model_name, device, max_length)
+    except Exception as e:
+        results.put((None, replica, f"Failed to load replica on {device}: {e}"))
+        return
+    results.put((None, replica, None))  # Ready
+    
+    while True:
+        job = requests.get()
+        if job is None:
+            break
+        job_id, part, texts = job
+        try:
+            results.put((job_id, part, model.encode(texts)))
+        except Exception as e:
+            results.put((job_id, part, f"{type(e).__name__}: {e}"))
+
+class ReplicaPool:
+    """Data-parallel encoder: one model replica per worker process.
+    
+    On CPU each replica is pinned to its own subset of cores with a fixed torch
+    thread count, which scales much better than one model using every core.
+    On GPUs each replica gets its own device.
+    """
+    
+    def __init__(self, model_name: str, max_length: int, devices: List[str], core_sets: List[List[int]], threads: int, min_batch: int):
+        self.min_batch = min_batch
+        self.lock = threading.Lock()
+        self.job_id = 0
+        
+        ctx = mp.get_context('spawn')  # Forking after torch init is unsafe
+        self.results = ctx.Queue()
+        self.requests = []
+        self.workers = []
+        for replica, (device, cores) in enumerate(zip(devices, core_sets)):
+            requests = ctx.Queue()
+            worker = ctx.Process(
+                target=_replica_main,
+                args=(replica, model_name, max_length, device, cores, threads, requests, self.results),
+                daemon=True
+            )
+            worker.start()
+            self.requests.append(requests)
+            self.workers.append(worker)
+        
+        # Wait for every replica to load, failing fast if one dies without reporting (e.g. OOM-killed)
+        loading = set(range(len(self.workers)))
+        while loading:
+            try:
+                _, replica, error = self.results.get(timeout=1)
+            except queue.Empty:
+                dead = [replica for replica in loading if not self.workers[replica].is_alive()]
+                if dead:
+                    worker = self.workers[dead[0]]
+                    self.close()
+                    raise RuntimeError(f"Replica on {devices[dead[0]]} exited with code {worker.exitcode} while loading")
+                continue
+            if error:
+                self.close()
+                raise RuntimeError(error)
+            loading.discard(replica)
+    
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Split texts across replicas and reassemble embeddings in input order."""
+        num_parts = max(1, min(len(self.workers), -(-len(texts) // self.min_batch)))
+        part_size = -(-len(texts) // num_parts)
+        parts = [texts[i:i + part_size] for i in range(0, len(texts), part_size)]
+        
+        with self.lock:
+            self.job_id += 1
+            job_id = self.job_id
+            for part, (requests, part_texts) in enumerate(zip(self.requests, parts)):
+                requests.put((job_id, part, part_texts))
+            
+            # Collect every part of this job, even after a failure, so none are left for the next job
+            outputs = [None] * len(parts)
+            pending = set(range(len(parts)))
+            errors = []
+            while pending:
+                try:
+                    result_job, part, embeddings = self.results.get(timeout=1)
+                except queue.Empty:
+                    dead = [part for part in pending if not self.workers[part].is_alive()]
+                    if dead:
+                        worker = self.workers[dead[0]]
+                        raise RuntimeError(f"Replica process {worker.pid} exited with code {worker.exitcode}")
+                    continue
+                if result_job != job_id:
+                    continue  # Left over from an earlier job that was abandoned
+                pending.discard(part)
+                if isinstance(embeddings, str):
+                    errors.append(embeddings)
+                else:
+                    outputs[part] = embeddings
+            if errors:
+                raise RuntimeError(f"Replica failed: {errors[0]}")
+        
+        return np.concatenate(outputs)
+    
+    def close(self):
+        """Stop all replica processes."""
+        for requests in self.requests:
+            requests.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
 class InstructorEmbeddingFunction(embedding_functions.EmbeddingFunction):
-    """Custom embedding function using Instructor model through sentence-transformers."""
+    """Embedding function for the configured sentence-transformers model.
+    
+    Called by Chroma for documents; queries go through embed_queries() so
+    models with separate query and document prompts get the right one.
+    """
     
-    def __init__(self):
+    def __init__(self, model_key: str = None):
         # Load config
         config_path = Path(__file__).parent.parent.parent / "config.yaml"
         with open(config_path) as f:
             config = yaml.safe_load(f)
         
-        # Get device type from config
-        device_type = config.get('device', {}).get('type', 'cpu').lower()
-        
         # Determine the device
-        if device_type == 'rocm' and torch.cuda.is_available():
-            self.device = "cuda"
-            tqdm.write("INFO:bot.embeddings:Using ROCm/CUDA device for embeddings")
-        elif device_type == 'mps' and hasattr(torch.backends, 'mps') and torch.backends.mps.is_available():
-            self.device = "mps"
-            tqdm.write("INFO:bot.embeddings:Using Apple Silicon (MPS) for embeddings")
-        elif device_type == 'cuda' and torch.cuda.is_available():
-            self.device = "cuda"
-            tqdm.write("INFO:bot.embeddings:Using CUDA device for embeddings")
+        self.device = resolve_device(config.get('device', {}).get('type', 'cpu'))
+        
+        # Look up the model and its prompts in the registry
+        self.spec = model_spec(config, model_key)
+        self.model_name = self.spec['name']
+        self.instruction = self.spec['document_instruction']
+        self.query_instruction = self.spec['query_instruction']
+        
+        # Optionally run several replicas in worker processes instead of one model
+        pool_config = config.get('device', {}).get('pool', {}) or {}
+        self.pool = None
+        if pool_config.get('replicas', 0) > 0:
+            self.pool = self._start_pool(self.model_name, pool_config)
+            self.model = None
         else:
-            if device_type != 'cpu':
-                tqdm.write(f"WARNING:bot.embeddings:Requested device type '{device_type}' not available, falling back to CPU")
-            self.device = "cpu"
-            tqdm.write("INFO:bot.embeddings:Using CPU for embeddings")
-            
-        # Use sentence-transformers version instead of INSTRUCTOR directly
-        self.model = SentenceTransformer('hkunlp/instructor-xl')
-        self.model.to(self.device)
+            self.model = load_model(self.model_name, self.device, self.spec['max_length'])
+            dims = self.model.get_sentence_embedding_dimension()
+            if self.spec['dims'] and dims != self.spec['dims']:
+                tqdm.write(f"WARNING:bot.embeddings:{self.model_name} produces {dims}-dim embeddings, registry says {self.spec['dims']}")
+
+    def _start_pool(self, model_name: str, pool_config: dict) -> ReplicaPool:
+        """Start a replica pool on the configured GPUs or CPU core subsets."""
+        replicas = pool_config['replicas']
+        threads = pool_config.get('threads_per_replica', 4)
+        
+        if self.device == 'cuda':
+            # One replica per GPU
+            replicas = min(replicas, torch.cuda.device_count())
+            devices = [f"cuda:{i}" for i in range(replicas)]
+            core_sets = [[] for _ in devices]
+        else:
+            devices = [self.device] * replicas
+            core_sets = [[] for _ in devices]
+            if pool_config.get('pin_cores', True) and hasattr(os, 'sched_getaffinity'):
+                cores = sorted(os.sched_getaffinity(0))
+                if len(cores) < replicas * threads:
+                    tqdm.write(f"WARNING:bot.embeddings:{replicas} replicas x {threads} threads exceeds {len(cores)} available cores")
+                core_sets = [cores[i * threads:(i + 1) * threads] or cores for i in range(replicas)]
         
-        # Instruction for document embeddings
-        self.instruction = "Represent this document for retrieval of relevant information about OAuth and SAML security:"
+        tqdm.write(f"INFO:bot.embeddings:Starting {len(devices)} embedding replicas on {', '.join(sorted(set(devices)))} ({threads} threads each)")
+        return ReplicaPool(model_name, self.spec['max_length'], devices, core_sets, threads, pool_config.get('min_batch', 32))
+
+    def close(self):
+        """Release worker processes, if any."""
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        if self.pool:
+            embeddings = self.pool.encode(texts)
+        else:
+            embeddings = self.model.encode(texts)
+        return embeddings.tolist()
 
     def __call__(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for a list of texts."""
+        """Generate document embeddings for a list of texts."""
         if not texts:
             return []
-            
-        # Prepare input with instruction
-        texts_with_instruction = [f"{self.instruction} {text}" for text in texts]
-        
-        # Generate embeddings
-        embeddings = self.model.encode(texts_with_instruction)
-        return embeddings.tolist()
+        # Labels and traces the call under `bot --profile=torch`
+        with torch_region("InstructorEmbeddingFunction.__call__"):
+            return self._encode(with_instruction(self.instruction, texts))
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Generate query embeddings for a list of texts."""
+        if not texts:
+            return []
+        with torch_region("InstructorEmbeddingFunction.embed_queries"):
+            return self._encode(with_instruction(self.query_instruction, texts))
 
     def embed_query(self, text: str) -> List[float]:
         """Generate embedding for a single query text."""
         if not text:
             return []
-            
-        # Use __call__ to ensure consistent embedding generation
-        result = self.__call__([text])
-        return result[0]  # Return first (and only) embedding 
\ No newline at end of file
+        return self.embed_queries([text])[0]
@@ -0,0 +1,232 @@
+import argparse
+import csv
+import itertools
+import logging
+import random
+import shutil
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Set
+
+import yaml
+from tqdm.contrib.logging import logging_redirect_tqdm
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+EVAL_DIR = PROJECT_ROOT / "data/eval"
+INDEX_DIR = EVAL_DIR / "indexes"
+
+def load_labels(path: Path) -> List[Dict]:
+    """Load labeled questions: each has a question, relevant URLs and optional chunk snippets."""
+    with open(path) as f:
+        labels = yaml.safe_load(f) or []
+    for label in labels:
+        if 'question' not in label or not label.get('relevant'):
+            raise ValueError(f"Each label needs a 'question' and a non-empty 'relevant' list: {label}")
+        label['contains'] = [snippet.lower() for snippet in label.get('contains', [])]
+    return labels
+
+def dir_size(path: Path) -> int:
+    """Total size in bytes of all files under a directory."""
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+def _build_and_search(name: str, chunk_size: int, chunk_overlap: int, urls: Set[str], labels: List[Dict], depth: int) -> Dict:
+    """Worker: build one candidate index and run every labeled question against it."""
+    from .ingest import Ingester
+    from .query import Querier
+
+    db_dir = INDEX_DIR / name
+    ingester = Ingester(db_dir=db_dir, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    entries = [entry for entry in ingester.store.iter_documents() if entry['url'] in urls]
+
+    try:
+        start = time.perf_counter()
+        ingester.ingest_documents(entries)
+        ingest_time = time.perf_counter() - start
+
+        # Reuse the already-loaded model for searching
+        querier = Querier(db_dir=db_dir, embedding_function=ingester.embedding_function)
+        rankings = []
+        latencies = []
+        for label in labels:
+            start = time.perf_counter()
+            results = querier.search(label['question'], n_results=depth)
+            latencies.append(time.perf_counter() - start)
+            rankings.append([
+                {'url': r['url'], 'relevance': r['relevance'], 'content': r['content'].lower()}
+                for r in results
+            ])
+        querier.close()
+    finally:
+        ingester.close()
+
+    return {
+        'name': name,
+        'chunk_size': chunk_size,
+        'chunk_overlap': chunk_overlap,
+        'ingest_time': ingest_time,
+        'index_size': dir_size(db_dir),
+        'latencies': latencies,
+        'rankings': rankings
+    }
+
+def _is_relevant(hit: Dict, label: Dict) -> bool:
+    if hit['url'] not in label['relevant']:
+        return False
+    return not label['contains'] or any(snippet in hit['content'] for snippet in label['contains'])
+
+def score(hits_per_question: List[List[Dict]], labels: List[Dict]) -> Dict:
+    """Compute mean URL-level recall and MRR over per-question result lists."""
+    recalls = []
+    reciprocal_ranks = []
+    for hits, label in zip(hits_per_question, labels):
+        relevant_hits = [hit for hit in hits if _is_relevant(hit, label)]
+        recalls.append(len({hit['url'] for hit in relevant_hits}) / len(set(label['relevant'])))
+        rank = next((i for i, hit in enumerate(hits, 1) if _is_relevant(hit, label)), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    return {'recall': statistics.mean(recalls), 'mrr': statistics.mean(reciprocal_ranks)}
+
+def pareto_front(rows: List[Dict]) -> None:
+    """Mark rows not dominated on (recall up, MRR up, latency down, index size down)."""
+    def dominates(a, b):
+        at_least = (a['recall'] >= b['recall'] and a['mrr'] >= b['mrr']
+                    and a['p50_ms'] <= b['p50_ms'] and a['index_mb'] <= b['index_mb'])
+        better = (a['recall'] > b['recall'] or a['mrr'] > b['mrr']
+                  or a['p50_ms'] < b['p50_ms'] or a['index_mb'] < b['index_mb'])
+        return at_least and better
+    for row in rows:
+        row['pareto'] = not any(dominates(other, row) for other in rows if other is not row)
+
+def run_eval(args=None):
+    """Entry point for the retrieval evaluation harness."""
+    if args is None:
+        # Handle direct script execution
+        parser = argparse.ArgumentParser(description="Sweep chunking and search parameters against labeled questions")
+        parser.add_argument('--labels', type=Path, default=PROJECT_ROOT / "eval.yaml", help='Labeled question file')
+        parser.add_argument('--workers', type=int, help='Indexes built in parallel')
+        parser.add_argument('--max-documents', type=int, help='Limit corpus size (labeled URLs are always included)')
+        args = parser.parse_args()
+
+    with open(PROJECT_ROOT / "config.yaml") as f:
+        config = yaml.safe_load(f)
+    chunking = config.get('chunking', {})
+    sweep = config.get('eval', {}) or {}
+    grid = {
+        'chunk_size': sweep.get('chunk_size', [chunking.get('chunk_size', 800)]),
+        'chunk_overlap': sweep.get('chunk_overlap', [chunking.get('chunk_overlap', 200)]),
+        'max_chunks': sweep.get('max_chunks', [chunking.get('max_chunks', 15)]),
+        'min_relevance': sweep.get('min_relevance', [chunking.get('min_relevance', 0.83)]),
+        'n_results': sweep.get('n_results', [5, 10, 20])
+    }
+    workers = args.workers or sweep.get('workers', 2)
+    max_documents = args.max_documents or sweep.get('max_documents')
+
+    labels = load_labels(args.labels)
+    if not labels:
+        logger.error(f"No labeled questions found in {args.labels}")
+        return
+
+    # Corpus: every labeled URL plus a fixed random sample of the rest
+    from .store import DocumentStore
+    store = DocumentStore()
+    all_urls = sorted(store.urls())
+    store.close()
+    labeled = {url for label in labels for url in label['relevant']}
+    missing = labeled - set(all_urls)
+    if missing:
+        logger.warning(f"{len(missing)} labeled URLs are not in the document store: {sorted(missing)[:5]}")
+    others = [url for url in all_urls if url not in labeled]
+    if max_documents:
+        others = random.Random(0).sample(others, max(0, min(len(others), max_documents - len(labeled))))
+    urls = (labeled - missing) | set(others)
+
+    index_params = [
+        (chunk_size, chunk_overlap)
+        for chunk_size, chunk_overlap in itertools.product(grid['chunk_size'], grid['chunk_overlap'])
+        if chunk_overlap < chunk_size
+    ]
+    depth = max(grid['max_chunks'] + grid['n_results'])
+
+    # Candidate indexes are rebuilt every run; result tables are kept
+    if INDEX_DIR.exists():
+        shutil.rmtree(INDEX_DIR)
+    INDEX_DIR.mkdir(parents=True)
+
+    print(f"\nBuilding {len(index_params)} candidate indexes over {len(urls)} documents with {workers} workers...")
+    indexes = []
+    with logging_redirect_tqdm(), ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_build_and_search, f"cs{chunk_size}-ov{chunk_overlap}", chunk_size, chunk_overlap, urls, labels, depth)
+            for chunk_size, chunk_overlap in index_params
+        ]
+        for future in as_completed(futures):
+            try:
+                index = future.result()
+                indexes.append(index)
+                print(f"✓ Built {index['name']} in {index['ingest_time']:.1f}s")
+            except Exception as e:
+                logger.error(f"Failed to build candidate index: {e}")
+
+    # Search parameters are cheap to sweep from each index's deepest ranking
+    rows = []
+    for index in indexes:
+        latencies = sorted(index['latencies'])
+        recall_at_k = {
+            k: score([hits[:k] for hits in index['rankings']], labels)['recall']
+            for k in grid['n_results']
+        }
+        for max_chunks, min_relevance in itertools.product(grid['max_chunks'], grid['min_relevance']):
+            context = [
+                [hit for hit in hits[:max_chunks] if hit['relevance'] >= min_relevance]
+                for hits in index['rankings']
+            ]
+            rows.append({
+                'chunk_size': index['chunk_size'],
+                'chunk_overlap': index['chunk_overlap'],
+                'max_chunks': max_chunks,
+                'min_relevance': min_relevance,
+                **score(context, labels),
+                'context_chunks': statistics.mean(len(hits) for hits in context),
+                **{f"recall@{k}": value for k, value in recall_at_k.items()},
+                'index_mb': index['index_size'] / 1024 / 1024,
+                'ingest_s': index['ingest_time'],
+                'p50_ms': latencies[len(latencies) // 2] * 1000,
+                'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+            })
+
+    if not rows:
+        print("No candidate indexes were built.")
+        return
+
+    pareto_front(rows)
+    rows.sort(key=lambda row: (-row['pareto'], -row['recall'], -row['mrr'], row['p50_ms']))
+
+    # Print table
+    k_columns = [f"recall@{k}" for k in grid['n_results']]
+    print(f"\n=== Retrieval Evaluation ({len(labels)} questions) ===")
+    print("  * = Pareto-optimal on recall, MRR, p50 latency and index size")
+    header = f"  {'size':>5} {'ovl':>4} {'max':>4} {'minrel':>6} {'recall':>6} {'MRR':>5} {'ctx':>5} " + \
+        ' '.join(f"{c:>9}" for c in k_columns) + f" {'MB':>7} {'ingest':>7} {'p50ms':>6} {'p95ms':>6}"
+    print(header)
+    for row in rows:
+        print(
+            f"{'*' if row['pareto'] else ' '} {row['chunk_size']:>5} {row['chunk_overlap']:>4} "
+            f"{row['max_chunks']:>4} {row['min_relevance']:>6.2f} {row['recall']:>6.2f} {row['mrr']:>5.2f} "
+            f"{row['context_chunks']:>5.1f} " + ' '.join(f"{row[c]:>9.2f}" for c in k_columns) +
+            f" {row['index_mb']:>7.1f} {row['ingest_s']:>6.0f}s {row['p50_ms']:>6.0f} {row['p95_ms']:>6.0f}"
+        )
+
+    # Save full results
+    results_file = EVAL_DIR / f"results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    with open(results_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"\nFull results written to {results_file}")
+
+if __name__ == "__main__":
+    run_eval()
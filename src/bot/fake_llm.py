@@ -0,0 +1,73 @@
+"""Local fake of the Anthropic Messages endpoint for exercising retries and hedging.
+
+Run it, then point the chat at it with `llm.base_url: http://127.0.0.1:8765`
+in config.yaml (any ANTHROPIC_API_KEY value works):
+
+    python -m bot.fake_llm --latency 2 --jitter 3 --error-rate 0.3 --error-status 529
+"""
+import argparse
+import asyncio
+import logging
+import random
+import uuid
+
+from aiohttp import web
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def make_app(latency: float, jitter: float, error_rate: float, error_status: int, retry_after: float) -> web.Application:
+    """Build an app serving POST /v1/messages with injected latency and errors."""
+    stats = {'requests': 0, 'errors': 0}
+
+    async def messages(request: web.Request) -> web.Response:
+        body = await request.json()
+        stats['requests'] += 1
+        request_number = stats['requests']
+
+        delay = latency + random.uniform(0, jitter)
+        await asyncio.sleep(delay)
+
+        if random.random() < error_rate:
+            stats['errors'] += 1
+            logger.info(f"#{request_number}: {error_status} after {delay:.2f}s")
+            headers = {'retry-after': str(retry_after)} if retry_after else {}
+            return web.json_response(
+                {'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'Injected failure'}},
+                status=error_status,
+                headers=headers
+            )
+
+        question = body['messages'][-1]['content']
+        logger.info(f"#{request_number}: 200 after {delay:.2f}s")
+        return web.json_response({
+            'id': f"msg_{uuid.uuid4().hex[:24]}",
+            'type': 'message',
+            'role': 'assistant',
+            'model': body.get('model', 'fake'),
+            'content': [{'type': 'text', 'text': f"[fake response #{request_number} after {delay:.2f}s] {question[-200:]}"}],
+            'stop_reason': 'end_turn',
+            'stop_sequence': None,
+            'usage': {'input_tokens': len(question) // 4, 'output_tokens': 20}
+        })
+
+    app = web.Application()
+    app.router.add_post('/v1/messages', messages)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Anthropic Messages endpoint")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5, help='Base response latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra uniform random latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=529, help='HTTP status for injected failures')
+    parser.add_argument('--retry-after', type=float, default=0, help='Retry-After seconds sent with failures (0 = none)')
+    args = parser.parse_args()
+
+    app = make_app(args.latency, args.jitter, args.error_rate, args.error_status, args.retry_after)
+    web.run_app(app, host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
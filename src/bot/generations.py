@@ -0,0 +1,203 @@
+import logging
+import os
+import platform
+import re
+import shutil
+import sqlite3
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Names inside the index root (data/chromadb by default)
+CURRENT_FILE = "CURRENT"
+STAGING_DIR = "staging"
+CHECKPOINT_FILE = "checkpoint.sqlite"
+BUILD_INFO = "build.yaml"
+GENERATION_PATTERN = re.compile(r"^gen-(\d{6})$")
+
+CHECKPOINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    hash TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    shard TEXT NOT NULL,
+    status TEXT NOT NULL,
+    chunks INTEGER
+);
+CREATE TABLE IF NOT EXISTS shards (
+    shard TEXT PRIMARY KEY,
+    status TEXT NOT NULL
+);
+"""
+
+# Libraries whose versions decide whether an index can be read elsewhere
+TRACKED_PACKAGES = ['chromadb', 'chroma-hnswlib', 'sentence-transformers', 'torch', 'numpy']
+
+def library_versions() -> Dict[str, Optional[str]]:
+    """Installed versions of the libraries an index depends on."""
+    versions = {'python': platform.python_version()}
+    for package in TRACKED_PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+class IndexGenerations:
+    """Blue/green layout for the vector database.
+
+    Every ingest builds into `staging/` while the live index keeps serving.
+    A finished build is renamed to the next `gen-NNNNNN/` directory and the
+    `CURRENT` file is atomically replaced to point at it. Older generations
+    are pruned, keeping `keep` of them so open queriers can finish switching.
+    """
+
+    def __init__(self, root: Path, keep: int = 2):
+        self.root = Path(root)
+        self.keep = max(keep, 1)
+
+    @property
+    def staging_dir(self) -> Path:
+        return self.root / STAGING_DIR
+
+    @property
+    def current_file(self) -> Path:
+        return self.root / CURRENT_FILE
+
+    def current_name(self) -> Optional[str]:
+        """Name of the live generation, or None if nothing has been promoted."""
+        try:
+            return self.current_file.read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def current(self) -> Optional[Path]:
+        """Directory of the live index."""
+        name = self.current_name()
+        if name:
+            return self.root / name
+        # Databases built before generations were introduced live in the root itself
+        if (self.root / "chroma.sqlite3").exists():
+            return self.root
+        return None
+
+    def generations(self) -> List[str]:
+        """Promoted generation names, oldest first."""
+        if not self.root.exists():
+            return []
+        return sorted(p.name for p in self.root.iterdir() if p.is_dir() and GENERATION_PATTERN.match(p.name))
+
+    def has_staging(self) -> bool:
+        return (self.staging_dir / CHECKPOINT_FILE).exists()
+
+    def start_staging(self, resume: bool = False) -> Path:
+        """Prepare the staging directory, keeping a previous partial build when resuming."""
+        if resume and self.has_staging():
+            logger.info(f"Resuming staged build in {self.staging_dir}")
+        else:
+            if resume:
+                logger.warning("No staged build to resume, starting a new one")
+            if self.staging_dir.exists():
+                shutil.rmtree(self.staging_dir)
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        return self.staging_dir
+
+    def promote(self, source: Path = None) -> str:
+        """Turn a finished build (staging by default) into the live generation, return its name."""
+        existing = self.generations()
+        number = int(GENERATION_PATTERN.match(existing[-1]).group(1)) + 1 if existing else 1
+        name = f"gen-{number:06d}"
+
+        os.rename(source or self.staging_dir, self.root / name)
+
+        # Write the pointer next to the real one and rename over it, so readers never see a partial file
+        pointer = self.root / f"{CURRENT_FILE}.tmp"
+        with open(pointer, 'w') as f:
+            f.write(name + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer, self.current_file)
+
+        self.prune()
+        return name
+
+    def prune(self):
+        """Delete all but the newest `keep` generations."""
+        current = self.current_name()
+        for name in self.generations()[:-self.keep]:
+            if name == current:
+                continue
+            logger.info(f"Removing old index generation {name}")
+            shutil.rmtree(self.root / name, ignore_errors=True)
+
+class IngestCheckpoint:
+    """Per-document progress of a staged build, stored next to the staged index.
+
+    A document is marked `started` before its first chunk is written and
+    `done` once all of them are, so a resumed build knows which partial
+    documents to clear and which to skip. Shards are marked done once their
+    derived indexes are built. Worker processes share the file through
+    SQLite's own locking. The file is promoted along with the index and
+    serves as its chunk manifest.
+    """
+
+    def __init__(self, staging_dir: Path):
+        self.conn = sqlite3.connect(str(Path(staging_dir) / CHECKPOINT_FILE), timeout=60)
+        self.conn.executescript(CHECKPOINT_SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def summary(self) -> Dict:
+        """Document and chunk totals of finished documents."""
+        documents, chunks = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(chunks), 0) FROM documents WHERE status = 'done'"
+        ).fetchone()
+        return {'documents': documents, 'chunks': chunks}
+
+    def done_hashes(self, shard: str = None) -> Set[str]:
+        """Hashes of finished documents in a shard (all shards by default)."""
+        if shard is None:
+            rows = self.conn.execute("SELECT hash FROM documents WHERE status = 'done'")
+        else:
+            rows = self.conn.execute("SELECT hash FROM documents WHERE shard = ? AND status = 'done'", (shard,))
+        return {row[0] for row in rows}
+
+    def shards(self) -> Set[str]:
+        """Shards that have received any documents."""
+        return {row[0] for row in self.conn.execute("SELECT DISTINCT shard FROM documents")}
+
+    def started_urls(self, shard: str) -> List[str]:
+        """URLs whose ingest began but never finished."""
+        rows = self.conn.execute("SELECT url FROM documents WHERE shard = ? AND status = 'started'", (shard,))
+        return [row[0] for row in rows]
+
+    def mark_started(self, entry: Dict, shard: str):
+        self.conn.execute(
+            """INSERT INTO documents (hash, url, shard, status) VALUES (?, ?, ?, 'started')
+               ON CONFLICT(hash) DO UPDATE SET url = excluded.url, shard = excluded.shard, status = 'started'""",
+            (entry['hash'], entry['url'], shard)
+        )
+        self.conn.commit()
+
+    def forget(self, entry: Dict):
+        """Drop a document whose ingest failed, so a later build starts it afresh."""
+        self.conn.execute("DELETE FROM documents WHERE hash = ?", (entry['hash'],))
+        self.conn.commit()
+
+    def mark_done(self, entry: Dict, chunks: int):
+        self.conn.execute("UPDATE documents SET status = 'done', chunks = ? WHERE hash = ?", (chunks, entry['hash']))
+        self.conn.commit()
+
+    def shard_done(self, shard: str) -> bool:
+        row = self.conn.execute("SELECT status FROM shards WHERE shard = ?", (shard,)).fetchone()
+        return bool(row) and row[0] == 'done'
+
+    def mark_shard_done(self, shard: str):
+        self.conn.execute(
+            "INSERT INTO shards (shard, status) VALUES (?, 'done') ON CONFLICT(shard) DO UPDATE SET status = 'done'",
+            (shard,)
+        )
+        self.conn.commit()
@@ -0,0 +1,200 @@
+import argparse
+import logging
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import chromadb
+import numpy as np
+import yaml
+from chromadb.config import Settings
+
+from .generations import IndexGenerations
+from .quant import exact_distances
+from .shards import COLLECTION_NAME, ShardRouter
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+CONFIG_PATH = PROJECT_ROOT / "config.yaml"
+DB_DIR = PROJECT_ROOT / "data/chromadb"
+TUNING_FILE = "tuning.yaml"
+
+SPACES = ('cosine', 'l2', 'ip')
+
+# Chroma's own defaults, used when config.yaml leaves a parameter out
+DEFAULTS = {'space': 'l2', 'M': 16, 'construction_ef': 100, 'search_ef': 10}
+
+def index_params(config: Dict) -> Dict:
+    """HNSW parameters from the `index` section of config.yaml."""
+    index_config = config.get('index', {}) or {}
+    params = {key: index_config.get(key) or default for key, default in DEFAULTS.items()}
+    if params['space'] not in SPACES:
+        raise ValueError(f"Unknown index space '{params['space']}', expected one of {', '.join(SPACES)}")
+    return params
+
+def collection_metadata(params: Dict) -> Dict:
+    """Collection metadata that makes Chroma build its HNSW index with the given parameters."""
+    return {
+        'hnsw:space': params['space'],
+        'hnsw:M': params['M'],
+        'hnsw:construction_ef': params['construction_ef'],
+        'hnsw:search_ef': params['search_ef']
+    }
+
+def to_relevance(distance: float, space: str) -> float:
+    """Convert a Chroma distance to cosine similarity.
+
+    Chroma reports 1 - cos for cosine, 1 - dot for ip and squared euclidean
+    distance for l2. On the unit-length embeddings the model produces these
+    all map to the same similarity score.
+    """
+    if space == 'l2':
+        return 1 - distance / 2
+    return 1 - distance
+
+def open_collections(db_dir: Path) -> Dict:
+    """Open every shard's collection in an index directory, without an embedding function."""
+    manifest = ShardRouter.read_manifest(db_dir)
+    router = ShardRouter({'sharding': {'mode': manifest['mode'] if manifest else 'none'}})
+    collections = {}
+    for shard in (manifest['shards'] if manifest else [COLLECTION_NAME]):
+        client = chromadb.PersistentClient(path=str(router.shard_path(db_dir, shard)), settings=Settings(anonymized_telemetry=False))
+        collections[shard] = client.get_collection(name=COLLECTION_NAME, embedding_function=None)
+    return collections
+
+def _sample_vectors(collections: List, max_vectors: int, page_size: int = 5000) -> np.ndarray:
+    """Read up to max_vectors stored embeddings, spread evenly over the shards."""
+    total = sum(collection.count() for collection in collections)
+    vectors = []
+    for collection in collections:
+        take = min(collection.count(), round(max_vectors * collection.count() / total))
+        for offset in range(0, take, page_size):
+            page = collection.get(include=['embeddings'], limit=min(page_size, take - offset), offset=offset)
+            vectors.append(np.asarray(page['embeddings'], dtype=np.float32))
+    return np.concatenate(vectors)
+
+def ground_truth(vectors: np.ndarray, queries: np.ndarray, space: str, k: int) -> List[set]:
+    """Exact k nearest neighbours of each query vector, excluding the query itself."""
+    truth = []
+    for query_index in queries:
+        nearest = np.argsort(exact_distances(vectors[query_index], vectors, space))[:k + 1]
+        truth.append({int(i) for i in nearest if i != query_index})
+    return truth
+
+def measure(vectors: np.ndarray, queries: np.ndarray, truth: List[set], params: Dict, k: int, batch_size: int = 1000) -> Dict:
+    """Build a scratch HNSW index with the given parameters, return its recall@k and query latency."""
+    client = chromadb.EphemeralClient(settings=Settings(anonymized_telemetry=False))
+    name = f"tune-{params['M']}-{params['construction_ef']}-{params['search_ef']}"
+    collection = client.create_collection(name=name, metadata=collection_metadata(params), embedding_function=None)
+    try:
+        ids = [str(i) for i in range(len(vectors))]
+        for start in range(0, len(vectors), batch_size):
+            collection.add(ids=ids[start:start + batch_size], embeddings=vectors[start:start + batch_size].tolist())
+
+        recalls = []
+        latencies = []
+        for query_index, expected in zip(queries, truth):
+            # The query is itself in the index, so ask for one extra hit and drop it
+            start = time.perf_counter()
+            found = collection.query(query_embeddings=[vectors[query_index].tolist()], n_results=k + 1)['ids'][0]
+            latencies.append(time.perf_counter() - start)
+
+            approximate = {int(i) for i in found if int(i) != query_index}
+            recalls.append(len(expected & approximate) / len(expected))
+    finally:
+        client.delete_collection(name)
+
+    return {
+        'search_ef': params['search_ef'],
+        'recall': float(np.mean(recalls)),
+        'latency_ms': float(np.median(latencies) * 1000),
+        'p95_ms': float(np.percentile(latencies, 95) * 1000)
+    }
+
+def choose(results: List[Dict], target: float) -> Tuple[Dict, bool]:
+    """Fastest result meeting the recall target, or the most accurate one if none does."""
+    passing = [r for r in results if r['recall'] >= target]
+    if passing:
+        return min(passing, key=lambda r: r['latency_ms']), True
+    return max(results, key=lambda r: r['recall']), False
+
+def save_search_ef(search_ef: int, config_path: Path = CONFIG_PATH):
+    """Set index.search_ef in config.yaml, keeping the file's comments and layout."""
+    text = config_path.read_text()
+    section = re.search(r'^index:.*?(?=^\S|\Z)', text, re.MULTILINE | re.DOTALL)
+    if not section:
+        raise ValueError("config.yaml has no index section")
+    body, count = re.subn(r'^(  search_ef:\s*)[^\s#]*', rf'\g<1>{search_ef}', section.group(0), count=1, flags=re.MULTILINE)
+    if not count:
+        body = section.group(0).rstrip('\n') + f"\n  search_ef: {search_ef}\n\n"
+    config_path.write_text(text[:section.start()] + body + text[section.end():])
+
+def run_tune_index(args=None):
+    """Entry point for HNSW search parameter tuning."""
+    if args is None:
+        # Handle direct script execution
+        parser = argparse.ArgumentParser(description="Tune HNSW search_ef against a recall target")
+        parser.add_argument('--target', type=float, help='Recall@k to reach (default from config.yaml)')
+        parser.add_argument('--dry-run', action='store_true', help="Report results without updating config.yaml")
+        args = parser.parse_args()
+
+    with open(CONFIG_PATH) as f:
+        config = yaml.safe_load(f)
+    params = index_params(config)
+    tuning = (config.get('index', {}) or {}).get('tuning', {}) or {}
+    target = args.target or tuning.get('recall_target', 0.95)
+    k = tuning.get('k', 10)
+    candidates = sorted(tuning.get('search_ef', [10, 20, 40, 80, 160, 320]))
+
+    generations = IndexGenerations(DB_DIR)
+    db_dir = generations.current()
+    if db_dir is None:
+        print("No index found. Run ingest first.")
+        return
+
+    # Sample the live index's own vectors, in the space it was built with
+    collections = list(open_collections(db_dir).values())
+    params['space'] = (collections[0].metadata or {}).get('hnsw:space', DEFAULTS['space'])
+
+    vectors = _sample_vectors(collections, tuning.get('max_vectors', 50000))
+    rng = np.random.default_rng(0)
+    queries = rng.choice(len(vectors), min(tuning.get('sample_queries', 200), len(vectors)), replace=False)
+    print(f"\nTuning search_ef on {len(vectors)} vectors ({params['space']}, M={params['M']}, "
+          f"construction_ef={params['construction_ef']}) with {len(queries)} queries, target recall@{k} {target:.0%}")
+
+    truth = ground_truth(vectors, queries, params['space'], k)
+    results = []
+    for search_ef in candidates:
+        result = measure(vectors, queries, truth, dict(params, search_ef=search_ef), k)
+        results.append(result)
+        print(f"  search_ef {search_ef:>4}: recall@{k} {result['recall']:.1%}, "
+              f"median {result['latency_ms']:.2f}ms, p95 {result['p95_ms']:.2f}ms")
+
+    best, met = choose(results, target)
+    if met:
+        print(f"\n✓ search_ef {best['search_ef']} is the fastest setting reaching {target:.0%} recall@{k}")
+    else:
+        print(f"\nNo candidate reached {target:.0%} recall@{k}. Using the most accurate, search_ef {best['search_ef']}. "
+              f"Consider raising M or construction_ef")
+
+    with open(db_dir / TUNING_FILE, 'w') as f:
+        yaml.safe_dump({
+            'tuned_at': datetime.now().isoformat(),
+            'recall_target': target,
+            'k': k,
+            'vectors': len(vectors),
+            'params': dict(params, search_ef=best['search_ef']),
+            'results': results
+        }, f, sort_keys=False)
+
+    if args.dry_run:
+        return
+    save_search_ef(best['search_ef'])
+    print(f"Saved index.search_ef: {best['search_ef']} to config.yaml. Chroma fixes HNSW parameters when an index is built, "
+          f"so it applies from the next ingest")
+
+if __name__ == "__main__":
+    run_tune_index()
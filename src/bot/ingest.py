@@ -1,23 +1,30 @@
 import logging
 from pathlib import Path
 import json
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
 import nltk
 from tqdm.auto import tqdm
 import chromadb
 from chromadb.config import Settings
-from .embeddings import InstructorEmbeddingFunction
+from .embeddings import InstructorEmbeddingFunction, model_spec
 import yaml
 import argparse
 from datetime import datetime
 from .processor import DocumentProcessor
+from .store import DocumentStore
+from .shards import COLLECTION_NAME, ShardRouter, url_domain
+from .quant import QUANT_DIR_NAME, QuantizedIndex
+from .docindex import DOC_DIR_NAME, DocumentIndex
+from .generations import BUILD_INFO, IndexGenerations, IngestCheckpoint, library_versions
+from .hnsw import collection_metadata, index_params
 from tqdm.contrib.logging import logging_redirect_tqdm
-import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing as mp
 
 logger = logging.getLogger(__name__)
 
 class Ingester:
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, resume=False, db_dir: Path = None, chunk_size: int = None, chunk_overlap: int = None):
         # Reduce noise from external libraries unless in debug mode
         if not debug:
             logging.getLogger('unstructured').setLevel(logging.WARNING)
@@ -27,158 +34,392 @@ class Ingester:
         with open(Path(__file__).parent.parent.parent / "config.yaml") as f:
             self.config = yaml.safe_load(f)
         
-        # Setup paths
+        # Setup paths. The live index is never touched: builds go to a staging directory
         project_root = Path(__file__).parent.parent.parent
-        self.raw_dir = project_root / "data/raw"
-        self.db_dir = project_root / "data/chromadb"
-        
-        # Delete existing ChromaDB directory if it exists
-        if self.db_dir.exists():
-            logger.info("Removing existing ChromaDB directory...")
-            try:
-                shutil.rmtree(self.db_dir)
-                logger.info("Successfully removed existing ChromaDB directory")
-            except Exception as e:
-                logger.error(f"Error removing ChromaDB directory: {e}")
-                raise RuntimeError("Could not clear existing ChromaDB directory")
+        self.index_root = Path(db_dir) if db_dir else project_root / "data/chromadb"
+        self.generations = IndexGenerations(self.index_root, self.config.get('index', {}).get('keep_generations', 2))
+        self.db_dir = self.generations.staging_dir
+        self.tmp_dir = project_root / "data/tmp"
+        self.resume = resume
         
         # Create directories if they don't exist
-        self.raw_dir.mkdir(parents=True, exist_ok=True)
-        self.db_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
         
         # Initialize components
+        self.store = DocumentStore()
         self.processor = DocumentProcessor()
-        self.embedding_function = InstructorEmbeddingFunction()
-        
-        # Initialize ChromaDB
-        self.chroma_client = chromadb.PersistentClient(
-            path=str(self.db_dir),
-            settings=Settings(anonymized_telemetry=False)
-        )
+        self._embedding_function = None  # Loaded on first use; parallel builds load it in the workers only
+        self.router = ShardRouter(self.config)
+        self.ingest_workers = self.config.get('sharding', {}).get('ingest_workers', 1)
+        self.index_params = index_params(self.config)
         
         # Get chunking settings
-        self.chunk_size = self.config.get('chunking', {}).get('chunk_size', 500)
-        self.chunk_overlap = self.config.get('chunking', {}).get('chunk_overlap', 100)
+        self.chunk_size = chunk_size or self.config.get('chunking', {}).get('chunk_size', 500)
+        self.chunk_overlap = chunk_overlap if chunk_overlap is not None else self.config.get('chunking', {}).get('chunk_overlap', 100)
+        self.add_batch = self.config.get('chunking', {}).get('add_batch', 64)
+
+    @property
+    def embedding_function(self) -> InstructorEmbeddingFunction:
+        if self._embedding_function is None:
+            self._embedding_function = InstructorEmbeddingFunction()
+        return self._embedding_function
+
+    def close(self):
+        """Shut down the embedding function's replica pool, if it started one."""
+        if self._embedding_function is not None:
+            self._embedding_function.close()
 
     def chunk_text(self, text: str) -> List[str]:
         """Split text into overlapping chunks."""
-        sentences = nltk.sent_tokenize(text)
-        chunks = []
+        sentences = ((sentence, None) for sentence in nltk.sent_tokenize(text))
+        return [chunk for chunk, _, _ in self._chunk_sentences(sentences)]
+
+    def chunk_pages(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[str, int, int]]:
+        """Stream (page_number, text) pairs into overlapping chunks.
+        
+        Yields (chunk, first_page, last_page) as soon as each chunk is complete,
+        so only the current chunk's sentences are held in memory.
+        """
+        sentences = (
+            (sentence, page_number)
+            for page_number, text in pages
+            for sentence in nltk.sent_tokenize(text)
+        )
+        return self._chunk_sentences(sentences)
+
+    def _chunk_sentences(self, sentences: Iterable[Tuple[str, Optional[int]]]) -> Iterator[Tuple[str, Optional[int], Optional[int]]]:
+        """Group (sentence, page) pairs into overlapping chunks of about chunk_size words."""
         current_chunk = []
         current_size = 0
         
-        for sentence in sentences:
+        def emit():
+            return (
+                ' '.join(s for s, _ in current_chunk),
+                current_chunk[0][1],
+                current_chunk[-1][1]
+            )
+        
+        for sentence, page in sentences:
             sentence_size = len(sentence.split())
             if current_size + sentence_size > self.chunk_size:
                 if current_chunk:
-                    chunks.append(' '.join(current_chunk))
+                    yield emit()
                     # Add overlap
                     overlap_size = 0
                     overlap_chunk = []
-                    for s in reversed(current_chunk):
+                    for s, p in reversed(current_chunk):
                         s_size = len(s.split())
                         if overlap_size + s_size > self.chunk_overlap:
                             break
-                        overlap_chunk.insert(0, s)
+                        overlap_chunk.insert(0, (s, p))
                         overlap_size += s_size
                     current_chunk = overlap_chunk
                     current_size = overlap_size
-                current_chunk.append(sentence)
+                current_chunk.append((sentence, page))
                 current_size += sentence_size
             else:
-                current_chunk.append(sentence)
+                current_chunk.append((sentence, page))
                 current_size += sentence_size
         
         if current_chunk:
-            chunks.append(' '.join(current_chunk))
+            yield emit()
+
+    def ingest_document(self, collection, entry: Dict) -> int:
+        """Process a single stored document into the collection, return number of chunks."""
+        url = entry['url']
+        
+        # PDFs are streamed from disk page by page
+        doc_type = self.processor._get_doc_type(url, entry['content_type'])
+        if doc_type == 'pdf':
+            return self._ingest_pdf(collection, entry)
+        
+        # Process document
+        doc = self.processor.process_document(
+            content=self.store.read_blob(entry['hash']),
+            url=url,
+            content_type=entry['content_type']
+        )
+        
+        if not doc:
+            logger.warning(f"Document processor returned None for {url}")
+            return 0
+        
+        # Create chunks
+        chunks = self.chunk_text(doc['content'])
         
-        return chunks
+        if not chunks:
+            return 0
+        
+        # Add to database in one call, so the whole document is embedded as one batch
+        metadatas = [
+            {
+                'url': doc['url'],
+                'domain': url_domain(doc['url']),
+                'type': doc['type'],
+                'chunk_index': i,
+                'total_chunks': len(chunks),
+                'processed_at': datetime.now().isoformat()
+            }
+            for i in range(len(chunks))
+        ]
+        collection.add(
+            documents=chunks,
+            metadatas=metadatas,
+            ids=[f"{doc['url']}_{i}" for i in range(len(chunks))]
+        )
+        
+        return len(chunks)
 
-    def ingest_documents(self):
-        """Process raw documents into vector database."""
-        raw_files = list(self.raw_dir.glob("*.raw"))
-        if not raw_files:
-            logger.error("No raw files found to process")
-            return
+    def _ingest_pdf(self, collection, entry: Dict) -> int:
+        """Stream a PDF page by page into the collection, return number of chunks."""
+        url = entry['url']
+        
+        # Decompress to a temporary file so pages can be memory-mapped
+        pdf_file = self.tmp_dir / f"{entry['hash']}.pdf"
+        self.store.export_blob(entry['hash'], pdf_file)
+        
+        ids = []
+        metadatas = []
+        window = []
+        
+        def flush():
+            # Chunks are embedded a window at a time, so long PDFs are batched without being held in memory
+            start = len(ids) - len(window)
+            collection.add(documents=window, metadatas=metadatas[start:], ids=ids[start:])
+            window.clear()
+        
+        try:
+            pages = self.processor.iter_pdf_pages(pdf_file)
+            for i, (chunk, first_page, last_page) in enumerate(self.chunk_pages(pages)):
+                ids.append(f"{url}_{i}")
+                metadatas.append({
+                    'url': url,
+                    'domain': url_domain(url),
+                    'type': 'pdf',
+                    'chunk_index': i,
+                    'total_chunks': 0,  # Filled in once the whole document is chunked
+                    'page_start': first_page,
+                    'page_end': last_page,
+                    'processed_at': datetime.now().isoformat()
+                })
+                window.append(chunk)
+                if len(window) >= self.add_batch:
+                    flush()
+            if window:
+                flush()
+        finally:
+            pdf_file.unlink(missing_ok=True)
         
-        print(f"\nProcessing {len(raw_files)} documents...")
+        if not ids:
+            raise ValueError("No text could be extracted")
         
-        # Create/get collection
-        collection = self.chroma_client.get_or_create_collection(
-            name="documents",
-            embedding_function=self.embedding_function
+        for chunk_metadata in metadatas:
+            chunk_metadata['total_chunks'] = len(ids)
+        collection.update(ids=ids, metadatas=metadatas)
+        return len(ids)
+
+    def open_collection(self, shard: str):
+        """Create/get the collection for a shard."""
+        chroma_client = chromadb.PersistentClient(
+            path=str(self.router.shard_path(self.db_dir, shard)),
+            settings=Settings(anonymized_telemetry=False)
         )
+        return chroma_client.get_or_create_collection(
+            name=COLLECTION_NAME,
+            embedding_function=self.embedding_function,
+            metadata=collection_metadata(self.index_params)
+        )
+
+    def write_build_info(self):
+        """Record what the staged index was built with, so snapshots can be checked on import."""
+        spec = model_spec(self.config)  # Read from the registry, so the model needn't be loaded here
+        info = {
+            'built_at': datetime.now().isoformat(),
+            'embedding_key': spec['key'],
+            'embedding_model': spec['name'],
+            'document_instruction': spec['document_instruction'],
+            'query_instruction': spec['query_instruction'],
+            'chunk_size': self.chunk_size,
+            'chunk_overlap': self.chunk_overlap,
+            'sharding': self.router.mode,
+            'quantization': (self.config.get('quantization', {}) or {}).get('mode', 'none'),
+            'index': self.index_params,
+            'versions': library_versions()
+        }
+        with open(self.db_dir / BUILD_INFO, 'w') as f:
+            yaml.safe_dump(info, f, sort_keys=False)
+
+    def build_quantized_index(self, shard: str, collection):
+        """Build the compressed search index for a shard, if enabled."""
+        quant_config = self.config.get('quantization', {}) or {}
+        mode = quant_config.get('mode', 'none')
+        if mode == 'none' or not collection.count():
+            return
         
-        # Use tqdm's logging handler
-        with logging_redirect_tqdm():
-            progress_bar = tqdm(raw_files, position=0, leave=True)
-            for raw_file in progress_bar:
+        quant_dir = self.router.shard_path(self.db_dir, shard) / QUANT_DIR_NAME
+        space = (collection.metadata or {}).get('hnsw:space', 'l2')
+        index = QuantizedIndex.build(collection, quant_dir, mode, space, quant_config)
+        logger.info(f"✓ Built {mode} index for {shard}: {index.codes.nbytes / 1024 / 1024:.1f}MB codes for {len(index.ids)} chunks")
+
+    def build_document_index(self, shard: str, collection):
+        """Build the per-document mean vectors used by two-level search."""
+        if not collection.count():
+            return
+        
+        doc_dir = self.router.shard_path(self.db_dir, shard) / DOC_DIR_NAME
+        space = (collection.metadata or {}).get('hnsw:space', 'l2')
+        index = DocumentIndex.build(collection, doc_dir, space)
+        logger.info(f"✓ Built document index for {shard}: {len(index.urls)} documents")
+
+    def open_staged_shard(self, shard: str, checkpoint: IngestCheckpoint):
+        """Open a shard's staged collection, clearing documents an interrupted build left half-written."""
+        collection = self.open_collection(shard)
+        for url in checkpoint.started_urls(shard):
+            logger.info(f"Clearing partial chunks for {url}")
+            collection.delete(where={'url': url})
+        return collection
+
+    def ingest_entry(self, collection, entry: Dict, shard: str, checkpoint: IngestCheckpoint) -> int:
+        """Ingest one stored document, recording progress in the checkpoint, return number of chunks."""
+        checkpoint.mark_started(entry, shard)
+        try:
+            num_chunks = self.ingest_document(collection, entry)
+        except Exception:
+            # A document that failed midway (e.g. a PDF after some windows were written) leaves no chunks behind
+            collection.delete(where={'url': entry['url']})
+            checkpoint.forget(entry)
+            raise
+        checkpoint.mark_done(entry, num_chunks)
+        return num_chunks
+
+    def finish_shard(self, shard: str, collection, checkpoint: IngestCheckpoint):
+        """Build a shard's derived indexes once all its documents are in, and mark it complete."""
+        partial = checkpoint.started_urls(shard)
+        if partial:
+            raise RuntimeError(f"Shard {shard} has {len(partial)} partially ingested documents, e.g. {partial[0]}. Re-run with --resume")
+        self.build_quantized_index(shard, collection)
+        self.build_document_index(shard, collection)
+        checkpoint.mark_shard_done(shard)
+
+    def ingest_shard(self, shard: str, entries: List[Dict], position: int = 0) -> int:
+        """Ingest a shard's documents into its staged collection, return number of documents processed."""
+        checkpoint = IngestCheckpoint(self.db_dir)
+        try:
+            if checkpoint.shard_done(shard):
+                logger.info(f"• Skipped shard {shard} (already built)")
+                return 0
+            
+            # Skip documents finished by an interrupted build
+            collection = self.open_staged_shard(shard, checkpoint)
+            done = checkpoint.done_hashes(shard)
+            if done:
+                logger.info(f"[{shard}] Resuming: {len(done)} documents already ingested")
+            pending = [entry for entry in entries if entry['hash'] not in done]
+            processed = 0
+            
+            progress_bar = tqdm(pending, position=position, leave=True, desc=shard)
+            for entry in progress_bar:
+                url = entry['url']
                 try:
-                    progress_bar.set_description(f"Processing {raw_file.name}")
-                    logger.debug(f"Processing: {raw_file}")
-                    
-                    # Get metadata from corresponding .json file
-                    meta_file = raw_file.with_suffix('.json')
-                    if not meta_file.exists():
-                        logger.warning(f"No metadata file found for {raw_file}")
-                        continue
-                    
-                    # Read content and metadata
-                    with open(raw_file, 'r', encoding='utf-8', errors='ignore') as f:
-                        raw_content = f.read()
-                    
-                    with open(meta_file, 'r', encoding='utf-8') as f:
-                        try:
-                            metadata = yaml.safe_load(f)
-                        except yaml.YAMLError as e:
-                            logger.error(f"Failed to parse metadata file {meta_file}: {e}")
-                            continue
-                    
-                    # Process document
-                    doc = self.processor.process_document(
-                        content=raw_content.encode('utf-8'),
-                        url=metadata['url'],
-                        content_type=metadata.get('content_type')
-                    )
-                    
-                    if not doc:
-                        logger.warning(f"Document processor returned None for {raw_file}")
-                        continue
-                    
-                    # Create chunks
-                    chunks = self.chunk_text(doc['content'])
+                    progress_bar.set_description(f"[{shard}] Processing {url}")
+                    logger.debug(f"Processing: {url} ({entry['hash'][:12]})")
                     
-                    # Add to database
-                    for i, chunk in enumerate(chunks):
-                        chunk_metadata = {
-                            'url': doc['url'],
-                            'type': doc['type'],
-                            'chunk_index': i,
-                            'total_chunks': len(chunks),
-                            'processed_at': datetime.now().isoformat()
-                        }
-                        
-                        collection.add(
-                            documents=[chunk],
-                            metadatas=[chunk_metadata],
-                            ids=[f"{doc['url']}_{i}"]
-                        )
-                    
-                    logger.info(f"✓ Processed: {raw_file.name}")
+                    num_chunks = self.ingest_entry(collection, entry, shard, checkpoint)
+                    if num_chunks:
+                        processed += 1
+                        logger.info(f"✓ Processed: {url} ({num_chunks} chunks)")
                     
                 except Exception as e:
-                    logger.error(f"Error processing {raw_file}: {str(e)}")
+                    logger.error(f"Error processing {url}: {str(e)}")
                     logger.debug("Full traceback:", exc_info=True)
-                    progress_bar.set_description(f"Error on {raw_file.name}")
+                    progress_bar.set_description(f"[{shard}] Error on {url}")
+            
+            self.finish_shard(shard, collection, checkpoint)
+            return processed
+        finally:
+            checkpoint.close()
 
-def run_ingest(debug=False):
+    def ingest_documents(self, entries: List[Dict] = None):
+        """Build stored documents (all of them by default) into a new index generation."""
+        if entries is None:
+            entries = list(self.store.iter_documents())
+        if not entries:
+            logger.error("No stored documents found to process")
+            return
+        
+        # Identical content fetched under several URLs is only embedded once
+        seen_hashes = set()
+        shards = {}
+        for entry in entries:
+            if entry['hash'] in seen_hashes:
+                logger.info(f"• Skipped: {entry['url']} (duplicate content)")
+                continue
+            seen_hashes.add(entry['hash'])
+            shards.setdefault(self.router.shard_for(entry['url']), []).append(entry)
+        
+        print(f"\nProcessing {len(entries)} documents into {len(shards)} shard(s)...")
+        
+        self.generations.start_staging(self.resume)
+        self.write_build_info()
+        if self.router.enabled:
+            self.router.write_manifest(self.db_dir, list(shards))
+        
+        failed = []
+        # Use tqdm's logging handler
+        with logging_redirect_tqdm():
+            if self.ingest_workers > 1 and len(shards) > 1:
+                # Each worker process loads its own model and writes its own shards. Spawned, not
+                # forked, so workers never inherit torch or CUDA state from this process
+                with ProcessPoolExecutor(max_workers=min(self.ingest_workers, len(shards)), mp_context=mp.get_context('spawn')) as pool:
+                    options = {'db_dir': self.index_root, 'chunk_size': self.chunk_size, 'chunk_overlap': self.chunk_overlap}
+                    futures = {
+                        pool.submit(_ingest_shard_worker, shard, shard_entries, position, options): shard
+                        for position, (shard, shard_entries) in enumerate(shards.items())
+                    }
+                    for future in as_completed(futures):
+                        try:
+                            processed = future.result()
+                            logger.info(f"✓ Shard {futures[future]}: {processed} documents")
+                        except Exception as e:
+                            logger.error(f"Shard {futures[future]} failed: {e}")
+                            failed.append(futures[future])
+            else:
+                for shard, shard_entries in shards.items():
+                    self.ingest_shard(shard, shard_entries)
+        
+        # A partial index is never promoted; the staged build can be continued with --resume
+        if failed:
+            raise RuntimeError(f"Shards failed: {', '.join(sorted(failed))}. Re-run ingest with --resume to continue")
+        
+        generation = self.generations.promote()
+        print(f"✓ Index generation {generation} is now live")
+
+def _ingest_shard_worker(shard: str, entries: List[Dict], position: int, options: Dict) -> int:
+    """Build one shard in a worker process."""
+    ingester = Ingester(**options)
+    try:
+        return ingester.ingest_shard(shard, entries, position)
+    finally:
+        ingester.close()
+
+def run_ingest(args=None):
     """Entry point for ingestion."""
+    if args is None:
+        # Handle direct script execution
+        parser = argparse.ArgumentParser(description="Ingest stored documents into the vector database")
+        parser.add_argument('--resume', action='store_true', help='Continue an interrupted build instead of starting over')
+        parser.add_argument('--debug', action='store_true', help='Show library logging')
+        args = parser.parse_args()
+    
     print("Starting document ingestion...")
     
     # Wrap everything in the logging redirect
     with logging_redirect_tqdm():
-        ingester = Ingester(debug=debug)
-        ingester.ingest_documents()
+        ingester = Ingester(debug=getattr(args, 'debug', False), resume=args.resume)
+        try:
+            ingester.ingest_documents()
+        finally:
+            ingester.close()
 
 if __name__ == "__main__":
     run_ingest() 
\ No newline at end of file
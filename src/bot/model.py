@@ -0,0 +1,208 @@
+import argparse
+import logging
+import multiprocessing as mp
+import random
+import resource
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch
+import yaml
+import sentence_transformers
+from sentence_transformers import SentenceTransformer
+
+from .embeddings import SNAPSHOT_INFO, load_model, model_spec, resolve_device, snapshot_dir, with_instruction
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+DTYPES = ('float32', 'float16', 'bfloat16')
+
+def prepare_snapshot(model_name: str, dtype: str) -> Path:
+    """Convert a hub model to a local safetensors snapshot in the given dtype."""
+    snapshot = snapshot_dir(model_name)
+    tmp_dir = snapshot.with_name(snapshot.name + '.tmp')
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    
+    print(f"Loading {model_name} from the hub cache...")
+    model = SentenceTransformer(model_name, device='cpu')
+    model.to(getattr(torch, dtype))
+    
+    print(f"Writing {dtype} safetensors snapshot...")
+    model.save(str(tmp_dir), safe_serialization=True)
+    with open(tmp_dir / SNAPSHOT_INFO, 'w') as f:
+        yaml.safe_dump({
+            'model': model_name,
+            'dtype': dtype,
+            'created_at': datetime.now().isoformat(),
+            'sentence_transformers': sentence_transformers.__version__,
+            'torch': torch.__version__
+        }, f)
+    
+    # Swap the finished snapshot into place
+    if snapshot.exists():
+        shutil.rmtree(snapshot)
+    tmp_dir.rename(snapshot)
+    return snapshot
+
+def _bench_model(spec: Dict, device_type: str, documents: List[str], queries: List[str], batch_size: int) -> Dict:
+    """Worker process: load one model, embed the sample corpus and queries, report speed and memory."""
+    device = resolve_device(device_type)
+    
+    start = time.perf_counter()
+    model = load_model(spec['name'], device, spec['max_length'])
+    load_time = time.perf_counter() - start
+    
+    documents = with_instruction(spec['document_instruction'], documents)
+    model.encode(documents[:batch_size], batch_size=batch_size)  # Warm up
+    start = time.perf_counter()
+    document_embeddings = model.encode(documents, batch_size=batch_size, normalize_embeddings=True)
+    document_time = time.perf_counter() - start
+    
+    # Queries are embedded one at a time, as in chat
+    query_embeddings = []
+    latencies = []
+    for query in with_instruction(spec['query_instruction'], queries):
+        start = time.perf_counter()
+        query_embeddings.append(model.encode([query], normalize_embeddings=True)[0])
+        latencies.append(time.perf_counter() - start)
+    
+    return {
+        'model': spec['key'],
+        'name': spec['name'],
+        'device': device,
+        'dims': int(document_embeddings.shape[1]),
+        'load_time': load_time,
+        'documents_per_sec': len(documents) / document_time,
+        'query_ms': float(np.median(latencies) * 1000),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'gpu_mb': torch.cuda.max_memory_allocated() / 1024 / 1024 if device == 'cuda' else None,
+        'documents': document_embeddings,
+        'queries': np.asarray(query_embeddings)
+    }
+
+def top_k(query_embeddings: np.ndarray, document_embeddings: np.ndarray, k: int) -> List[set]:
+    """Indexes of each query's k most similar documents (embeddings are normalized)."""
+    scores = query_embeddings @ document_embeddings.T
+    return [set(np.argsort(-row)[:k]) for row in scores]
+
+def sample_corpus(num_documents: int, num_queries: int, labels_path: Path) -> Tuple[List[str], List[str]]:
+    """Fixed random sample of indexed chunks, plus labeled questions (or chunk openings) as queries."""
+    from .generations import IndexGenerations
+    from .hnsw import open_collections
+    
+    db_dir = IndexGenerations(PROJECT_ROOT / "data/chromadb").current()
+    if db_dir is None:
+        raise RuntimeError("No index found, run ingest first")
+    collections = open_collections(db_dir)
+    ids = sorted((shard, chunk_id) for shard, collection in collections.items() for chunk_id in collection.get(include=[])['ids'])
+    rng = random.Random(0)
+    picked = rng.sample(ids, min(len(ids), num_documents + num_queries))
+    
+    texts = []
+    for shard, collection in collections.items():
+        shard_ids = [chunk_id for s, chunk_id in picked if s == shard]
+        if shard_ids:
+            found = collection.get(ids=shard_ids, include=['documents'])
+            by_id = dict(zip(found['ids'], found['documents']))
+            texts.extend(by_id[chunk_id] for chunk_id in shard_ids)
+    documents = texts[:num_documents]
+    
+    if labels_path.exists():
+        from .evaluate import load_labels
+        queries = [label['question'] for label in load_labels(labels_path)][:num_queries]
+    else:
+        # Without labeled questions, the opening words of other chunks stand in for queries
+        queries = [' '.join(text.split()[:30]) for text in texts[num_documents:]]
+    return documents, queries
+
+def run_bench(config: Dict, keys: List[str], labels_path: Path):
+    """Benchmark registry models side by side on a sample of the indexed corpus."""
+    bench = config.get('embeddings', {}).get('bench', {}) or {}
+    current = model_spec(config)
+    keys = keys or bench.get('candidates') or [current['key']]
+    if current['key'] not in keys:
+        keys = [current['key']] + keys  # Agreement is measured against the current model
+    specs = [model_spec(config, key) for key in keys]
+    k = bench.get('k', 10)
+    batch_size = bench.get('batch_size', 32)
+    device_type = config.get('device', {}).get('type', 'cpu')
+    
+    documents, queries = sample_corpus(bench.get('sample_documents', 500), bench.get('sample_queries', 50), labels_path)
+    print(f"\nBenchmarking {len(specs)} models on {len(documents)} chunks and {len(queries)} queries...")
+    
+    results = []
+    for spec in specs:
+        print(f"  {spec['key']} ({spec['name']})...")
+        # A fresh process per model keeps load time and peak memory honest
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn')) as pool:
+                results.append(pool.submit(_bench_model, spec, device_type, documents, queries, batch_size).result())
+        except Exception as e:
+            logger.error(f"Benchmark of {spec['key']} failed: {e}")
+    
+    reference = next((r for r in results if r['model'] == current['key']), None)
+    if reference:
+        expected = top_k(reference['queries'], reference['documents'], k)
+    
+    print(f"\n{'model':<20} {'dims':>5} {'load s':>7} {'docs/s':>8} {'query ms':>9} {'RSS MB':>8} {'GPU MB':>8} {f'agree@{k}':>9}")
+    for r in results:
+        agreement = ''
+        if reference:
+            found = top_k(r['queries'], r['documents'], k)
+            agreement = f"{np.mean([len(a & b) / k for a, b in zip(expected, found)]):.1%}"
+        gpu = f"{r['gpu_mb']:.0f}" if r['gpu_mb'] is not None else '-'
+        marker = ' *' if r['model'] == current['key'] else ''
+        print(f"{r['model'] + marker:<20} {r['dims']:>5} {r['load_time']:>7.2f} {r['documents_per_sec']:>8.1f} "
+              f"{r['query_ms']:>9.1f} {r['peak_rss_mb']:>8.0f} {gpu:>8} {agreement:>9}")
+    print(f"\n* current model (embeddings.model). agree@{k}: overlap of each model's top {k} chunks with the current model's")
+
+def run_model(args=None):
+    """Entry point for embedding model management."""
+    with open(PROJECT_ROOT / "config.yaml") as f:
+        config = yaml.safe_load(f)
+    default_dtype = config.get('embeddings', {}).get('snapshot_dtype', 'float16')
+    
+    if args is None:
+        # Handle direct script execution
+        parser = argparse.ArgumentParser(description="Manage embedding models")
+        parser.add_argument('action', choices=['list', 'prepare', 'bench'], help='Model action')
+        parser.add_argument('-m', '--model', action='append', help='Registry key (repeatable for bench)')
+        parser.add_argument('--dtype', choices=DTYPES, help='Snapshot weight dtype')
+        parser.add_argument('--labels', type=Path, default=PROJECT_ROOT / "eval.yaml", help='Labeled questions used as bench queries')
+        args = parser.parse_args()
+    
+    if args.action == 'list':
+        current = model_spec(config)['key']
+        models = config.get('embeddings', {}).get('models') or {current: model_spec(config)}
+        print("\n=== Embedding Models ===")
+        for key in models:
+            spec = model_spec(config, key)
+            prepared = " [snapshot]" if (snapshot_dir(spec['name']) / SNAPSHOT_INFO).exists() else ""
+            marker = " (current)" if key == current else ""
+            print(f"• {key}{marker}: {spec['name']}, {spec['dims']} dims, max length {spec['max_length']}{prepared}")
+    
+    elif args.action == 'prepare':
+        dtype = args.dtype or default_dtype
+        spec = model_spec(config, args.model[0] if args.model else None)
+        snapshot = prepare_snapshot(spec['name'], dtype)
+        size_mb = sum(f.stat().st_size for f in snapshot.rglob('*') if f.is_file()) / 1024 / 1024
+        print(f"✓ Snapshot written to {snapshot} ({size_mb:.0f}MB)")
+        
+        # Report the cold start the embedding function will now see
+        start = time.perf_counter()
+        load_model(spec['name'], 'cpu')
+        print(f"✓ Snapshot load time: {time.perf_counter() - start:.2f}s")
+    
+    elif args.action == 'bench':
+        run_bench(config, args.model, getattr(args, 'labels', PROJECT_ROOT / "eval.yaml"))
+
+if __name__ == "__main__":
+    run_model()
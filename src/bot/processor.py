@@ -1,15 +1,61 @@
 import logging
 import os
+import io
+import mmap
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterator, List, Tuple
 import nltk
+import yaml
 from bs4 import BeautifulSoup
+from pypdf import PdfReader
 from unstructured.partition.text import partition_text
 from unstructured.partition.html import partition_html
 from unstructured.documents.elements import Title, NarrativeText
 
 logger = logging.getLogger(__name__)
 
+# Per-process PDF state for page extraction workers
+_pdf_file = None
+_pdf_mmap = None
+_pdf_reader = None
+
+def _init_pdf_worker(path: str):
+    """Open a memory-mapped PDF once per worker process."""
+    global _pdf_file, _pdf_mmap, _pdf_reader
+    _pdf_file = open(path, 'rb')
+    _pdf_mmap = mmap.mmap(_pdf_file.fileno(), 0, access=mmap.ACCESS_READ)
+    _pdf_reader = PdfReader(_pdf_mmap)
+
+def _extract_pdf_pages(start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract clean text for pages [start, end) of the worker's PDF."""
+    return [(i + 1, _page_text(_pdf_reader, i)) for i in range(start, end)]
+
+def _page_text(reader: PdfReader, index: int) -> str:
+    """Extract and clean the text of a single PDF page."""
+    try:
+        text = reader.pages[index].extract_text() or ''
+    except Exception as e:
+        logger.warning(f"Failed to extract text from page {index + 1}: {e}")
+        return ''
+    if not text.strip():
+        return ''
+    return _process_elements(partition_text(text=text))
+
+def _process_elements(elements) -> str:
+    """Convert document elements to clean text."""
+    processed = []
+    
+    for element in elements:
+        if isinstance(element, (Title, NarrativeText)):
+            text = str(element).strip()
+            if text:
+                processed.append(text)
+    
+    return '\n\n'.join(processed)
+
 class DocumentProcessor:
     """Process raw documents into clean text."""
     
@@ -25,6 +71,14 @@ class DocumentProcessor:
             nltk.data.find('tokenizers/punkt')
         except LookupError:
             nltk.download('punkt', download_dir=nltk_data_dir if venv_dir else None)
+        
+        # Load PDF settings
+        with open(Path(__file__).parent.parent.parent / "config.yaml") as f:
+            config = yaml.safe_load(f)
+        pdf_config = config.get('pdf', {})
+        self.pdf_workers = pdf_config.get('workers', os.cpu_count() or 1)
+        self.pdf_pages_per_task = pdf_config.get('pages_per_task', 8)
+        self.pdf_parallel_threshold = pdf_config.get('parallel_threshold', 16)
     
     def process_document(self, content: bytes, url: str, content_type: str = None) -> Dict:
         """Process document content into clean text."""
@@ -33,15 +87,22 @@ class DocumentProcessor:
             doc_type = self._get_doc_type(url, content_type)
             
             # Convert bytes to text based on type
-            if doc_type == 'html':
-                text = content.decode('utf-8', errors='ignore')
-                elements = partition_html(text=text)
+            if doc_type == 'pdf':
+                # In-memory fallback; use iter_pdf_pages() for large files on disk
+                reader = PdfReader(io.BytesIO(content))
+                processed_text = '\n\n'.join(
+                    text for text in (_page_text(reader, i) for i in range(len(reader.pages))) if text
+                )
             else:
-                text = content.decode('utf-8', errors='ignore')
-                elements = partition_text(text=text)
-            
-            # Extract and clean text
-            processed_text = self._process_elements(elements)
+                if doc_type == 'html':
+                    text = content.decode('utf-8', errors='ignore')
+                    elements = partition_html(text=text)
+                else:
+                    text = content.decode('utf-8', errors='ignore')
+                    elements = partition_text(text=text)
+                
+                # Extract and clean text
+                processed_text = self._process_elements(elements)
             
             if not processed_text.strip():
                 raise ValueError("No text could be extracted")
@@ -56,6 +117,46 @@ class DocumentProcessor:
             logger.error(f"Error processing document {url}: {e}")
             return None
     
+    def iter_pdf_pages(self, path: Path) -> Iterator[Tuple[int, str]]:
+        """Yield (page_number, text) for each page of a PDF file, in page order.
+        
+        The file is memory-mapped rather than read into memory. Large PDFs are
+        split into page ranges that are extracted by a pool of worker processes,
+        with only a bounded number of ranges in flight at any time.
+        """
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            reader = PdfReader(mm)
+            num_pages = len(reader.pages)
+            
+            # Small PDFs aren't worth the process startup cost
+            if num_pages < self.pdf_parallel_threshold or self.pdf_workers <= 1:
+                for i in range(num_pages):
+                    yield i + 1, _page_text(reader, i)
+                return
+        
+        logger.debug(f"Extracting {num_pages} pages from {path} with {self.pdf_workers} workers")
+        ranges = iter([
+            (start, min(start + self.pdf_pages_per_task, num_pages))
+            for start in range(0, num_pages, self.pdf_pages_per_task)
+        ])
+        
+        with ProcessPoolExecutor(
+            max_workers=self.pdf_workers,
+            initializer=_init_pdf_worker,
+            initargs=(str(path),)
+        ) as pool:
+            # Keep a bounded window of page ranges in flight
+            pending = deque(
+                pool.submit(_extract_pdf_pages, start, end)
+                for start, end in islice(ranges, self.pdf_workers * 2)
+            )
+            while pending:
+                pages = pending.popleft().result()
+                next_range = next(ranges, None)
+                if next_range:
+                    pending.append(pool.submit(_extract_pdf_pages, *next_range))
+                yield from pages
+    
     def _get_doc_type(self, url: str, content_type: str = None) -> str:
         """Determine document type from URL and content-type."""
         if content_type:
@@ -81,12 +182,4 @@ class DocumentProcessor:
     
     def _process_elements(self, elements) -> str:
         """Convert document elements to clean text."""
-        processed = []
-        
-        for element in elements:
-            if isinstance(element, (Title, NarrativeText)):
-                text = str(element).strip()
-                if text:
-                    processed.append(text)
-        
-        return '\n\n'.join(processed) 
\ No newline at end of file
+        return _process_elements(elements)
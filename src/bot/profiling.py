@@ -0,0 +1,295 @@
+import asyncio
+import cProfile
+import logging
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = Path(__file__).parent.parent.parent / "data/profiles"
+
+MODES = ('cpu', 'torch', 'asyncio')
+
+# How many hotspots are printed when the command exits
+TOP_N = 15
+
+# Embedding calls traced by --profile=torch, so long commands keep a bounded trace
+TORCH_CALLS = 20
+
+# The Profiler of a running --profile=torch command, started and stopped by torch_region()
+_torch_profiler = None
+
+@contextmanager
+def torch_region(name: str):
+    """Label an embedding call in --profile=torch traces.
+
+    The trace starts with the first labeled call and stops once TORCH_CALLS
+    of them have finished. Outside torch mode this only adds the label,
+    which is a no-op when no torch profiler is running.
+    """
+    import torch
+    profiler = _torch_profiler
+    if profiler:
+        profiler._torch_region_started()
+    try:
+        with torch.profiler.record_function(name):
+            yield
+    finally:
+        if profiler:
+            profiler._torch_region_finished()
+
+class StackSampler:
+    """Samples every thread's Python stack at a fixed interval.
+
+    Samples are aggregated as folded stacks ("thread;outer;...;inner count"),
+    the input format of flamegraph.pl, speedscope and inferno. Unlike
+    cProfile, this sees worker threads too and adds little overhead.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def write_folded(self, path: Path):
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+class _TimedCoroutine:
+    """Wraps a coroutine to time each step it runs on the event loop."""
+
+    def __init__(self, coro, record: Dict):
+        self.coro = coro
+        self.record = record
+
+    def _step(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.record['busy'] += elapsed
+            self.record['steps'] += 1
+            self.record['max_step'] = max(self.record['max_step'], elapsed)
+
+    def send(self, value):
+        return self._step(self.coro.send, value)
+
+    def throw(self, *args):
+        return self._step(self.coro.throw, *args)
+
+    def close(self):
+        return self.coro.close()
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+class TaskTimer:
+    """Per-coroutine event loop timing for async commands.
+
+    Busy time is spent running a task's own code, which blocks the loop.
+    Wall time runs from creation to completion and includes waiting on I/O.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def _record(self, name: str) -> Dict:
+        record = {'name': name, 'created': time.perf_counter(), 'wall': None, 'busy': 0.0, 'steps': 0, 'max_step': 0.0}
+        self.records.append(record)
+        return record
+
+    def _task_factory(self, loop, coro, **kwargs):
+        record = self._record(getattr(coro, '__qualname__', type(coro).__name__))
+        task = asyncio.Task(_TimedCoroutine(coro, record), loop=loop, **kwargs)
+        task.add_done_callback(lambda _: record.update(wall=time.perf_counter() - record['created']))
+        return task
+
+    async def run(self, coro):
+        """Run a command's main coroutine with every task it creates timed."""
+        asyncio.get_running_loop().set_task_factory(self._task_factory)
+        record = self._record(getattr(coro, '__qualname__', type(coro).__name__))
+        try:
+            return await _TimedCoroutine(coro, record)
+        finally:
+            record['wall'] = time.perf_counter() - record['created']
+
+    def summary(self) -> List[Dict]:
+        """Totals per coroutine name, busiest first."""
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['name'], {'name': record['name'], 'tasks': 0, 'busy': 0.0, 'wall': 0.0, 'max_step': 0.0})
+            total['tasks'] += 1
+            total['busy'] += record['busy']
+            total['wall'] += record['wall'] or 0.0
+            total['max_step'] = max(total['max_step'], record['max_step'])
+        return sorted(totals.values(), key=lambda total: total['busy'], reverse=True)
+
+class Profiler:
+    """Profiles one `bot` command, selected with the global --profile flag.
+
+    cpu:     cProfile of the main thread (.prof, for pstats/snakeviz) plus
+             sampled stacks of all threads (.folded, for flamegraphs).
+    torch:   torch.profiler trace of every operator over the first
+             TORCH_CALLS embedding calls, with those calls labeled (.json for
+             Perfetto/chrome://tracing, .folded stacks).
+    asyncio: per-coroutine busy and wall times for async commands (.yaml)
+             plus sampled stacks (.folded).
+
+    Output goes to data/profiles/<command>-<time>.*, and the top hotspots
+    are printed when the command exits, even on error or Ctrl+C.
+    """
+
+    def __init__(self, mode: str, command: str):
+        self.mode = mode
+        self.command = command or 'bot'
+        self.task_timer = None
+
+    def __enter__(self) -> 'Profiler':
+        if not self.mode:
+            return self
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        self.base = PROFILE_DIR / f"{self.command}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        self.start = time.perf_counter()
+
+        if self.mode == 'torch':
+            import torch
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            self.sort_by = 'self_cpu_time_total'
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+                self.sort_by = 'self_cuda_time_total'
+            self.torch_profiler = torch.profiler.profile(activities=activities, record_shapes=True, with_stack=True)
+            self.torch_lock = threading.Lock()
+            self.torch_running = False
+            self.torch_calls = 0
+            global _torch_profiler
+            _torch_profiler = self
+            return self
+
+        self.sampler = StackSampler()
+        self.sampler.start()
+        if self.mode == 'cpu':
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        else:
+            self.task_timer = TaskTimer()
+        return self
+
+    def _torch_region_started(self):
+        with self.torch_lock:
+            if not self.torch_running and not self.torch_calls:
+                self.torch_profiler.start()
+                self.torch_running = True
+
+    def _torch_region_finished(self):
+        with self.torch_lock:
+            self.torch_calls += 1
+            if self.torch_running and self.torch_calls >= TORCH_CALLS:
+                self.torch_profiler.stop()
+                self.torch_running = False
+
+    def wrap(self, coro):
+        """Instrument an async command's main coroutine when profiling asyncio."""
+        if self.task_timer:
+            return self.task_timer.run(coro)
+        return coro
+
+    def __exit__(self, *exc_info):
+        if not self.mode:
+            return False
+        elapsed = time.perf_counter() - self.start
+        try:
+            if self.mode == 'torch':
+                self._finish_torch()
+            else:
+                self.sampler.stop()
+                if self.mode == 'cpu':
+                    self.cprofile.disable()
+                    self._finish_cpu()
+                else:
+                    self._finish_asyncio()
+            print(f"\n✓ Profile of {elapsed:.1f}s written to {self.base.parent}/{self.base.name}.*")
+        except Exception as e:
+            logger.error(f"Could not write profile: {e}")
+        return False
+
+    def _finish_cpu(self):
+        self.cprofile.dump_stats(f"{self.base}.prof")
+        self.sampler.write_folded(Path(f"{self.base}.folded"))
+
+        stats = pstats.Stats(self.cprofile)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_N]
+        print(f"\n=== Top {TOP_N} functions by own time (main thread) ===")
+        print(f"{'own s':>8} {'total s':>8} {'calls':>9}  function")
+        for (filename, line, name), (_, calls, own, total, _) in rows:
+            print(f"{own:>8.3f} {total:>8.3f} {calls:>9}  {name} ({Path(filename).name}:{line})")
+
+    def _finish_torch(self):
+        global _torch_profiler
+        _torch_profiler = None
+        with self.torch_lock:
+            if self.torch_running:
+                self.torch_profiler.stop()
+                self.torch_running = False
+        if not self.torch_calls:
+            print("\nNo embeddings were computed; --profile=torch applies to ingest, sync, query and chat")
+            return
+        profiler = self.torch_profiler
+        print(f"\nTraced the first {min(self.torch_calls, TORCH_CALLS)} of {self.torch_calls} embedding calls")
+        profiler.export_chrome_trace(f"{self.base}.json")
+        profiler.export_stacks(f"{self.base}.folded", self.sort_by)
+        print(f"\n=== Top {TOP_N} torch operators ===")
+        print(profiler.key_averages().table(sort_by=self.sort_by, row_limit=TOP_N))
+
+    def _finish_asyncio(self):
+        self.sampler.write_folded(Path(f"{self.base}.folded"))
+        if not self.task_timer.records:
+            print("\nNo asyncio tasks were run; --profile=asyncio applies to scrape, sync and crawl")
+            return
+        summary = self.task_timer.summary()
+        with open(f"{self.base}.yaml", 'w') as f:
+            yaml.safe_dump({'command': self.command, 'coroutines': summary}, f, sort_keys=False)
+
+        print(f"\n=== Top {TOP_N} coroutines by event loop time ===")
+        print(f"{'busy s':>8} {'wall s':>9} {'max step ms':>12} {'tasks':>6}  coroutine")
+        for total in summary[:TOP_N]:
+            print(f"{total['busy']:>8.3f} {total['wall']:>9.1f} {total['max_step'] * 1000:>12.1f} {total['tasks']:>6}  {total['name']}")
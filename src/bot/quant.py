@@ -0,0 +1,237 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# Quantized index files live next to each shard's Chroma database
+QUANT_DIR_NAME = "quant"
+
+def exact_distances(query: np.ndarray, vectors: np.ndarray, space: str) -> np.ndarray:
+    """Distances matching Chroma's conventions for the given HNSW space."""
+    if space == 'l2':
+        diff = vectors - query
+        return np.einsum('ij,ij->i', diff, diff)  # Chroma reports squared L2
+    dots = vectors @ query
+    if space == 'cosine':
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+        return 1 - dots / np.maximum(norms, 1e-12)
+    return 1 - dots  # ip
+
+def _sq_distances(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Pairwise squared L2 distances without materializing point-centroid differences."""
+    return (
+        (points ** 2).sum(axis=1)[:, None]
+        - 2 * points @ centroids.T
+        + (centroids ** 2).sum(axis=1)[None, :]
+    )
+
+def _kmeans(data: np.ndarray, k: int, iterations: int = 15, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd's k-means, returns (k, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _sq_distances(data, centroids).argmin(axis=1)
+        for c in range(k):
+            members = data[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+    return centroids
+
+class Int8Quantizer:
+    """Per-dimension scalar quantization to one byte per component."""
+
+    def __init__(self, low: np.ndarray = None, scale: np.ndarray = None):
+        self.low = low
+        self.scale = scale
+
+    def train(self, sample: np.ndarray):
+        self.low = sample.min(axis=0)
+        self.scale = np.maximum(sample.max(axis=0) - self.low, 1e-12) / 255
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.round((vectors - self.low) / self.scale), 0, 255).astype(np.uint8)
+
+    def scores(self, query: np.ndarray, codes: np.ndarray, block: int = 65536) -> np.ndarray:
+        """Approximate dot products: q . (low + scale * code)."""
+        weights = (query * self.scale).astype(np.float32)
+        offset = float(query @ self.low)
+        # Widen codes a block at a time so the scan never holds a float copy of the index
+        return np.concatenate([
+            codes[start:start + block].astype(np.float32) @ weights + offset
+            for start in range(0, len(codes), block)
+        ])
+
+    def save(self, path: Path):
+        np.savez(path, low=self.low, scale=self.scale)
+
+    @classmethod
+    def load(cls, path: Path) -> 'Int8Quantizer':
+        params = np.load(path)
+        return cls(params['low'], params['scale'])
+
+class PQQuantizer:
+    """Product quantization: one byte per subvector, scored with lookup tables."""
+
+    def __init__(self, num_subvectors: int, codebooks: np.ndarray = None):
+        self.num_subvectors = num_subvectors
+        self.codebooks = codebooks  # (num_subvectors, 256, sub_dim)
+
+    def train(self, sample: np.ndarray):
+        dim = sample.shape[1]
+        if dim % self.num_subvectors:
+            raise ValueError(f"pq_subvectors ({self.num_subvectors}) must divide the embedding dimension ({dim})")
+        sub_dim = dim // self.num_subvectors
+        codebooks = np.zeros((self.num_subvectors, 256, sub_dim), dtype=np.float32)
+        for m in range(self.num_subvectors):
+            centroids = _kmeans(sample[:, m * sub_dim:(m + 1) * sub_dim], 256, seed=m)
+            codebooks[m, :len(centroids)] = centroids
+        self.codebooks = codebooks
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        sub_dim = self.codebooks.shape[2]
+        codes = np.empty((len(vectors), self.num_subvectors), dtype=np.uint8)
+        for m in range(self.num_subvectors):
+            sub = vectors[:, m * sub_dim:(m + 1) * sub_dim]
+            codes[:, m] = _sq_distances(sub, self.codebooks[m]).argmin(axis=1)
+        return codes
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Asymmetric dot products via per-subvector lookup tables."""
+        sub_dim = self.codebooks.shape[2]
+        tables = np.einsum('mkd,md->mk', self.codebooks, query.reshape(self.num_subvectors, sub_dim)).astype(np.float32)
+        # Summed one subvector at a time, so the scan never holds an (N, num_subvectors) float copy of the index
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for m in range(self.num_subvectors):
+            scores += tables[m, codes[:, m]]
+        return scores
+
+    def save(self, path: Path):
+        np.savez(path, codebooks=self.codebooks)
+
+    @classmethod
+    def load(cls, path: Path) -> 'PQQuantizer':
+        codebooks = np.load(path)['codebooks']
+        return cls(codebooks.shape[0], codebooks)
+
+class QuantizedIndex:
+    """Compressed search index over one collection's embeddings.
+
+    Compressed codes are held in memory and scanned for every query. The
+    full-precision vectors stay on disk in a memory-mapped file and are only
+    read for the small candidate set that gets rescored exactly. Approximate
+    scores are dot products, which rank like every space for the normalized
+    embeddings the model produces.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / "meta.yaml") as f:
+            self.meta = yaml.safe_load(f)
+        with open(self.path / "ids.json") as f:
+            self.ids = json.load(f)
+        self.codes = np.load(self.path / "codes.npy")
+        self.vectors = np.load(self.path / "vectors.npy", mmap_mode='r')
+        if self.meta['mode'] == 'pq':
+            self.quantizer = PQQuantizer.load(self.path / "quantizer.npz")
+        else:
+            self.quantizer = Int8Quantizer.load(self.path / "quantizer.npz")
+
+    @staticmethod
+    def exists(path: Path) -> bool:
+        return (Path(path) / "meta.yaml").exists()
+
+    @classmethod
+    def build(cls, collection, path: Path, mode: str, space: str, config: Dict, page_size: int = 5000) -> 'QuantizedIndex':
+        """Export a collection's embeddings and build a compressed index from them."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        count = collection.count()
+        if not count:
+            raise ValueError("Cannot quantize an empty collection")
+
+        # Stream embeddings out of Chroma into an on-disk float32 matrix
+        ids = []
+        vectors = None
+        for offset in range(0, count, page_size):
+            page = collection.get(include=['embeddings'], limit=page_size, offset=offset)
+            embeddings = np.asarray(page['embeddings'], dtype=np.float32)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(
+                    path / "vectors.npy", mode='w+', dtype=np.float32, shape=(count, embeddings.shape[1])
+                )
+            vectors[offset:offset + len(embeddings)] = embeddings
+            ids.extend(page['ids'])
+        vectors.flush()
+
+        # Train on a sample, then encode in blocks
+        rng = np.random.default_rng(0)
+        sample_size = min(count, config.get('train_size', 20000))
+        sample = np.asarray(vectors[np.sort(rng.choice(count, sample_size, replace=False))])
+        if mode == 'pq':
+            quantizer = PQQuantizer(config.get('pq_subvectors', 96))
+        else:
+            quantizer = Int8Quantizer()
+        quantizer.train(sample)
+
+        codes = np.concatenate([
+            quantizer.encode(np.asarray(vectors[start:start + page_size]))
+            for start in range(0, count, page_size)
+        ])
+        np.save(path / "codes.npy", codes)
+        quantizer.save(path / "quantizer.npz")
+        with open(path / "ids.json", 'w') as f:
+            json.dump(ids, f)
+        with open(path / "meta.yaml", 'w') as f:
+            yaml.safe_dump({'mode': mode, 'space': space, 'count': count, 'dim': int(vectors.shape[1])}, f)
+
+        return cls(path)
+
+    def search(self, query: List[float], n_results: int, candidates: int) -> List[Tuple[str, float]]:
+        """Scan compressed codes, rescore the best candidates exactly, return (id, distance) pairs."""
+        ranked = self._rescored(np.asarray(query, dtype=np.float32), n_results, candidates)
+        return [(self.ids[position], distance) for position, distance in ranked]
+
+    def _rescored(self, query: np.ndarray, n_results: int, candidates: int) -> List[Tuple[int, float]]:
+        """Exact (position, distance) pairs for the top approximate candidates."""
+        positions = np.sort(self.candidates(query, candidates))  # Sorted for sequential memmap reads
+        distances = exact_distances(query, np.asarray(self.vectors[positions]), self.meta['space'])
+        order = np.argsort(distances)[:n_results]
+        return [(int(positions[i]), float(distances[i])) for i in order]
+
+    def candidates(self, query: np.ndarray, candidates: int) -> np.ndarray:
+        """Row positions of the top candidates by approximate similarity."""
+        scores = self.quantizer.scores(query, self.codes)
+        candidates = min(candidates, len(scores))
+        return np.argpartition(-scores, candidates - 1)[:candidates]
+
+    def stats(self, sample_queries: int = 50, k: int = 10, candidates: int = 100) -> Dict:
+        """Measure compression ratio and recall@k against exact search, using stored vectors as queries."""
+        count, dim = self.vectors.shape
+        rng = np.random.default_rng(0)
+        queries = np.asarray(self.vectors[rng.choice(count, min(sample_queries, count), replace=False)])
+
+        recall_codes = []
+        recall_rescored = []
+        for query in queries:
+            exact = set(np.argsort(exact_distances(query, np.asarray(self.vectors), self.meta['space']))[:k])
+            approximate = self.candidates(query, k)
+            rescored = {position for position, _ in self._rescored(query, k, candidates)}
+            recall_codes.append(len(exact & set(approximate)) / len(exact))
+            recall_rescored.append(len(exact & rescored) / len(exact))
+
+        return {
+            'mode': self.meta['mode'],
+            'vectors': count,
+            'float_bytes': count * dim * 4,
+            'code_bytes': self.codes.nbytes,
+            'compression': count * dim * 4 / self.codes.nbytes,
+            'recall_codes': float(np.mean(recall_codes)),
+            'recall_rescored': float(np.mean(recall_rescored)),
+            'k': k
+        }
@@ -1,5 +1,7 @@
 import logging
 import argparse
+import asyncio
+from collections import Counter
 from pathlib import Path
 import chromadb
 from chromadb.config import Settings
@@ -7,44 +9,333 @@ from .embeddings import InstructorEmbeddingFunction
 import yaml
 from typing import List, Dict
 from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .shards import COLLECTION_NAME, ShardRouter, domain_matches, normalize_source
+import numpy as np
+from .quant import QUANT_DIR_NAME, QuantizedIndex, exact_distances
+from .docindex import DOC_DIR_NAME, DocumentIndex, join_chunks
+from .generations import BUILD_INFO, IndexGenerations
+from .hnsw import to_relevance
 
 logger = logging.getLogger(__name__)
 
+class MicroBatcher:
+    """Coalesce concurrent searches into batches.
+    
+    Requests are collected until max_batch are waiting or max_wait has passed
+    since the first one arrived, then searched together on a single worker
+    thread. While one batch runs, the next one keeps filling up.
+    """
+    
+    def __init__(self, search_batch, max_wait: float, max_batch: int):
+        self.search_batch = search_batch
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.pending = []
+        self.flush_handle = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.histogram = Counter()
+    
+    async def submit(self, query: str, n_results: int, sources: List[str]) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((query, n_results, sources, future))
+        
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+    
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            self.histogram[len(batch)] += 1
+            logger.debug(f"Searching micro-batch of {len(batch)} queries")
+            asyncio.get_running_loop().create_task(self._run(batch))
+    
+    async def _run(self, batch: List[tuple]):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self.executor,
+                self.search_batch,
+                [query for query, _, _, _ in batch],
+                [n_results for _, n_results, _, _ in batch],
+                [sources for _, _, sources, _ in batch]
+            )
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (*_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+    
+    @staticmethod
+    def empty_stats() -> Dict:
+        return {'batches': 0, 'queries': 0, 'mean_batch_size': 0.0, 'histogram': {}}
+    
+    def stats(self) -> Dict:
+        batches = sum(self.histogram.values())
+        if not batches:
+            return self.empty_stats()
+        queries = sum(size * count for size, count in self.histogram.items())
+        return {
+            'batches': batches,
+            'queries': queries,
+            'mean_batch_size': queries / batches,
+            'histogram': dict(sorted(self.histogram.items()))
+        }
+
+def _release_client(client):
+    """Stop a Chroma client and drop it from Chroma's per-path client cache, which would otherwise keep it alive."""
+    try:
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient._identifer_to_system.pop(client._identifier, None)
+        client._system.stop()
+    except Exception as e:
+        logger.debug(f"Could not release Chroma client: {e}")
+
+class SearchGeneration:
+    """One opened index generation: its Chroma clients, collections, derived indexes and search threads.
+    
+    Nothing in it changes after opening. Every search holds the generation it
+    started with until it is done, so a switch to a newer generation can't
+    change the shards or threads under it. A retired generation is closed
+    once its last search has released it.
+    """
+    
+    def __init__(self, db_dir: Path, router: ShardRouter, clients: List, collections: Dict, quant_indexes: Dict,
+                 doc_indexes: Dict, space: str, search_workers: int):
+        self.db_dir = db_dir
+        self.router = router
+        self.clients = clients
+        self.collections = collections
+        self.quant_indexes = quant_indexes
+        self.doc_indexes = doc_indexes
+        self.space = space
+        self.search_pool = ThreadPoolExecutor(max_workers=min(len(collections), search_workers))
+        self.domains = None  # Filled in by the first source-filtered search
+        self.lock = threading.Lock()
+        self.users = 0
+        self.retired = False
+    
+    def acquire(self) -> 'SearchGeneration':
+        with self.lock:
+            self.users += 1
+        return self
+    
+    def release(self):
+        with self.lock:
+            self.users -= 1
+            idle = self.retired and not self.users
+        if idle:
+            self.close()
+    
+    def retire(self):
+        """Close the generation as soon as no search is using it."""
+        with self.lock:
+            self.retired = True
+            idle = not self.users
+        if idle:
+            self.close()
+    
+    def close(self):
+        self.search_pool.shutdown(wait=True)
+        for client in self.clients:
+            _release_client(client)
+
 class Querier:
-    def __init__(self):
+    def __init__(self, db_dir: Path = None, embedding_function: InstructorEmbeddingFunction = None):
         # Load config
         with open(Path(__file__).parent.parent.parent / "config.yaml") as f:
             self.config = yaml.safe_load(f)
         
         # Setup paths
-        self.db_dir = Path(__file__).parent.parent.parent / "data/chromadb"
+        index_root = Path(db_dir) if db_dir else Path(__file__).parent.parent.parent / "data/chromadb"
+        self.generations = IndexGenerations(index_root)
+        
+        # Search settings
+        quant_config = self.config.get('quantization', {}) or {}
+        self.rescore_candidates = quant_config.get('rescore_candidates', 100)
+        two_level = self.config.get('query', {}).get('two_level', {}) or {}
+        self.top_documents = two_level.get('top_documents', 20)
+        self.neighbors = two_level.get('neighbors', 0)
         
         # Initialize components
-        self.embedding_function = InstructorEmbeddingFunction()
+        self.embedding_function = embedding_function or InstructorEmbeddingFunction()
+        self.batcher = None
+        self.reload_lock = threading.Lock()
+        self.generation_lock = threading.Lock()
+        self.current_mtime = self._current_mtime()
+        db_dir = self.generations.current()
+        if db_dir is None:
+            raise RuntimeError(f"No index found in {self.generations.root}, run ingest first")
+        self.generation = self._open_generation(db_dir)
+
+    def _open_generation(self, db_dir: Path) -> SearchGeneration:
+        """Open every shard of an index generation."""
+        # Queries must be embedded by the model the index was built with
+        if (db_dir / BUILD_INFO).exists():
+            with open(db_dir / BUILD_INFO) as f:
+                built_with = yaml.safe_load(f).get('embedding_model')
+            if built_with and built_with != self.embedding_function.model_name:
+                logger.warning(f"Index was built with {built_with} but queries use {self.embedding_function.model_name}, re-run ingest")
         
-        # Initialize ChromaDB
-        self.chroma_client = chromadb.PersistentClient(
-            path=str(self.db_dir),
-            settings=Settings(anonymized_telemetry=False)
-        )
+        # Use the sharding layout the index was built with
+        manifest = ShardRouter.read_manifest(db_dir)
+        sharding = dict(self.config.get('sharding', {}) or {})
+        sharding['mode'] = manifest['mode'] if manifest else 'none'
+        router = ShardRouter({'sharding': sharding})
+        shards = manifest['shards'] if manifest else [COLLECTION_NAME]
         
-        # Get collection
-        self.collection = self.chroma_client.get_collection(
-            name="documents",
-            embedding_function=self.embedding_function
-        )
+        # Initialize ChromaDB, one client per shard
+        clients = []
+        collections = {}
+        for shard in shards:
+            chroma_client = chromadb.PersistentClient(
+                path=str(router.shard_path(db_dir, shard)),
+                settings=Settings(anonymized_telemetry=False)
+            )
+            clients.append(chroma_client)
+            collections[shard] = chroma_client.get_collection(
+                name=COLLECTION_NAME,
+                embedding_function=self.embedding_function
+            )
+        
+        # Distances are converted to relevance according to the index's metric
+        space = (next(iter(collections.values())).metadata or {}).get('hnsw:space', 'l2')
+        
+        # Load compressed search indexes, if enabled
+        quant_indexes = {}
+        if (self.config.get('quantization', {}) or {}).get('mode', 'none') != 'none':
+            for shard in shards:
+                quant_dir = router.shard_path(db_dir, shard) / QUANT_DIR_NAME
+                if QuantizedIndex.exists(quant_dir):
+                    quant_indexes[shard] = QuantizedIndex(quant_dir)
+                else:
+                    logger.warning(f"No quantized index for shard {shard}, re-run ingest to build one")
+        
+        # Load document-level indexes for two-level search, if enabled
+        doc_indexes = {}
+        if (self.config.get('query', {}).get('two_level', {}) or {}).get('enabled'):
+            for shard in shards:
+                doc_dir = router.shard_path(db_dir, shard) / DOC_DIR_NAME
+                if DocumentIndex.exists(doc_dir):
+                    doc_indexes[shard] = DocumentIndex(doc_dir)
+                else:
+                    logger.warning(f"No document index for shard {shard}, re-run ingest to build one")
+            if len(doc_indexes) < len(shards):
+                doc_indexes = {}  # Searching some shards coarsely and others fully would skew the merge
+        
+        search_workers = self.config.get('sharding', {}).get('search_workers', 8)
+        return SearchGeneration(db_dir, router, clients, collections, quant_indexes, doc_indexes, space, search_workers)
+
+    def close(self):
+        """Close the index once searches in flight are done, and stop the embedding function's replica pool."""
+        with self.generation_lock:
+            generation = self.generation
+        generation.retire()
+        self.embedding_function.close()
+
+    def _current_mtime(self):
+        try:
+            return self.generations.current_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def refresh(self) -> bool:
+        """Reopen the index if ingest has promoted a new generation, return whether it changed."""
+        if self._current_mtime() == self.current_mtime:
+            return False
+        with self.reload_lock:
+            mtime = self._current_mtime()
+            if mtime == self.current_mtime:
+                return False
+            db_dir = self.generations.current()
+            if db_dir is None or db_dir == self.generation.db_dir:
+                self.current_mtime = mtime
+                return False
+            generation = self._open_generation(db_dir)
+            self.current_mtime = mtime
+            
+            # Searches in flight finish against the old generation, which is closed after the last one
+            with self.generation_lock:
+                previous, self.generation = self.generation, generation
+            previous.retire()
+            logger.info(f"Switched to index generation {db_dir.name}")
+            return True
+
+    def _acquire_generation(self) -> SearchGeneration:
+        """The live generation, held until release() so it stays open for a whole search."""
+        with self.generation_lock:
+            return self.generation.acquire()
+
+    def _all_metadatas(self, generation: SearchGeneration) -> List[Dict]:
+        """Get chunk metadata from every shard."""
+        metadatas = []
+        for collection in generation.collections.values():
+            metadatas.extend(collection.get(include=['metadatas'])['metadatas'])
+        return metadatas
+
+    def _domains(self, generation: SearchGeneration) -> set:
+        """Every document domain in a generation, read once per generation."""
+        if generation.domains is None:
+            domains = set()
+            page_size = 5000
+            for collection in generation.collections.values():
+                for offset in range(0, collection.count(), page_size):
+                    page = collection.get(include=['metadatas'], limit=page_size, offset=offset)
+                    domains.update(meta.get('domain', '') for meta in page['metadatas'])
+            generation.domains = domains
+        return generation.domains
+
+    def _quantized_query(self, generation: SearchGeneration, shard: str, query_embeddings: List[List[float]], n_results: int, sources: List[str] = None) -> Dict:
+        """Search a shard's compressed index and rescore at full precision, in Chroma's result format."""
+        results = {'documents': [], 'metadatas': [], 'distances': []}
+        for query_embedding in query_embeddings:
+            # Source filtering happens after rescoring, so keep the whole candidate set
+            pairs = generation.quant_indexes[shard].search(
+                query_embedding,
+                self.rescore_candidates if sources else n_results,
+                self.rescore_candidates
+            )
+            documents, metadatas, distances = [], [], []
+            if pairs:
+                found = generation.collections[shard].get(ids=[chunk_id for chunk_id, _ in pairs], include=['documents', 'metadatas'])
+                by_id = dict(zip(found['ids'], zip(found['documents'], found['metadatas'])))
+                for chunk_id, distance in pairs:
+                    if chunk_id not in by_id:
+                        continue
+                    doc, meta = by_id[chunk_id]
+                    if sources and not domain_matches(meta.get('domain', ''), sources):
+                        continue
+                    documents.append(doc)
+                    metadatas.append(meta)
+                    distances.append(distance)
+            results['documents'].append(documents[:n_results])
+            results['metadatas'].append(metadatas[:n_results])
+            results['distances'].append(distances[:n_results])
+        return results
 
     def show_stats(self) -> None:
         """Display database statistics and information."""
+        generation = self._acquire_generation()
         try:
-            results = self.collection.get()
-            urls = {meta['url'] for meta in results['metadatas']}
-            chunks = len(results['metadatas'])
+            metadatas = self._all_metadatas(generation)
+            urls = {meta['url'] for meta in metadatas}
+            chunks = len(metadatas)
             
             # Get date ranges
             dates = [
                 datetime.fromisoformat(meta['processed_at'])
-                for meta in results['metadatas']
+                for meta in metadatas
                 if 'processed_at' in meta
             ]
             
@@ -52,6 +343,23 @@ class Querier:
             print(f"Total Documents: {len(urls)}")
             print(f"Total Chunks: {chunks}")
             print(f"Average Chunks per Document: {chunks/len(urls):.1f}")
+            if generation.router.enabled:
+                print(f"Shards ({generation.router.mode}): {len(generation.collections)}")
+                for shard, collection in sorted(generation.collections.items()):
+                    print(f"  {shard}: {collection.count()} chunks")
+            
+            for shard, index in sorted(generation.quant_indexes.items()):
+                stats = index.stats(candidates=self.rescore_candidates)
+                print(f"\nCompressed Search Index ({shard}, {stats['mode']}):")
+                print(f"  Vectors: {stats['vectors']}")
+                print(f"  In-memory codes: {stats['code_bytes'] / 1024 / 1024:.1f}MB "
+                      f"(vs {stats['float_bytes'] / 1024 / 1024:.1f}MB float32, {stats['compression']:.1f}x smaller)")
+                print(f"  Recall@{stats['k']} vs exact search: {stats['recall_codes']:.1%} from codes alone, "
+                      f"{stats['recall_rescored']:.1%} after rescoring {self.rescore_candidates} candidates")
+            
+            for shard, index in sorted(generation.doc_indexes.items()):
+                print(f"\nDocument Index ({shard}): {len(index.urls)} documents, "
+                      f"{index.vectors.nbytes / 1024 / 1024:.1f}MB, top {self.top_documents} searched per query")
             
             if dates:
                 print(f"\nDate Range:")
@@ -60,18 +368,20 @@ class Querier:
             
             print("\nDocument List:")
             for url in sorted(urls):
-                doc_chunks = sum(1 for meta in results['metadatas'] if meta['url'] == url)
+                doc_chunks = sum(1 for meta in metadatas if meta['url'] == url)
                 print(f"• {url} ({doc_chunks} chunks)")
                 
         except Exception as e:
             logger.error(f"Error getting database stats: {e}")
             print("No documents found or error accessing database.")
+        finally:
+            generation.release()
 
     def list_documents(self) -> None:
         """List all documents in the database."""
+        generation = self._acquire_generation()
         try:
-            results = self.collection.get()
-            urls = {meta['url'] for meta in results['metadatas']}
+            urls = {meta['url'] for meta in self._all_metadatas(generation)}
             
             print(f"\nFound {len(urls)} unique documents:")
             for url in sorted(urls):
@@ -80,30 +390,160 @@ class Querier:
         except Exception as e:
             logger.error(f"Error listing documents: {e}")
             print("No documents found or error accessing database.")
+        finally:
+            generation.release()
 
-    def search(self, query: str, n_results: int = 5, verbose: bool = False) -> List[Dict]:
-        """Search for relevant documents."""
-        # Search in vector store
-        raw_results = self.collection.query(
-            query_texts=[query],  # Pass as list of strings
-            n_results=n_results
-        )
+    def _two_level_search(self, generation: SearchGeneration, query_embeddings: List[List[float]], n_results: int, shards: List[str], sources: List[str] = None) -> List[List[tuple]]:
+        """Rank documents by their mean vector first, then score only the best documents' chunks."""
+        # Coarse: the closest documents across all searched shards
+        picked = []
+        for query_embedding in query_embeddings:
+            ranked = sorted(
+                (distance, shard, url)
+                for shard in shards
+                for url, distance in generation.doc_indexes[shard].top_documents(query_embedding, self.top_documents, sources)
+            )
+            picked.append([(shard, url) for _, shard, url in ranked[:self.top_documents]])
+        
+        # Fetch every picked document's chunks once per batch, one call per shard
+        wanted = {}
+        for documents in picked:
+            for shard, url in documents:
+                wanted.setdefault(shard, set()).add(url)
         
-        # Format results with metadata
+        def fetch_shard(shard):
+            return generation.collections[shard].get(
+                where={'url': {'$in': sorted(wanted[shard])}},
+                include=['documents', 'metadatas', 'embeddings']
+            )
+        
+        chunks = {}  # url -> ([(chunk_index, doc, meta)] in document order, embeddings)
+        for found in generation.search_pool.map(fetch_shard, list(wanted)):
+            by_url = {}
+            for doc, meta, embedding in zip(found['documents'], found['metadatas'], found['embeddings']):
+                by_url.setdefault(meta['url'], []).append((meta['chunk_index'], doc, meta, embedding))
+            for url, rows in by_url.items():
+                rows.sort(key=lambda row: row[0])
+                chunks[url] = ([row[:3] for row in rows], np.asarray([row[3] for row in rows], dtype=np.float32))
+        
+        # Fine: exact distances over the picked documents' chunks only
+        hits = []
+        for query_embedding, documents in zip(query_embeddings, picked):
+            documents = [chunks[url] for _, url in documents if url in chunks]
+            if not documents:
+                hits.append([])
+                continue
+            rows = [row for document_rows, _ in documents for row in document_rows]
+            distances = exact_distances(
+                np.asarray(query_embedding, dtype=np.float32),
+                np.concatenate([embeddings for _, embeddings in documents]),
+                generation.space
+            )
+            ranked = [(rows[i], float(distances[i])) for i in np.argsort(distances)]
+            hits.append(self._with_neighbors(ranked, chunks, n_results))
+        return hits
+
+    def _with_neighbors(self, ranked: List[tuple], chunks: Dict, n_results: int) -> List[tuple]:
+        """Turn ranked chunks into hits, merging each with its neighboring chunks if configured."""
+        hits = []
+        covered = set()
+        for (index, doc, meta), distance in ranked:
+            if (meta['url'], index) in covered:
+                continue  # Already part of a better hit's context
+            if self.neighbors:
+                window = [row for row in chunks[meta['url']][0] if abs(row[0] - index) <= self.neighbors]
+                covered.update((meta['url'], row[0]) for row in window)
+                doc = join_chunks([row[1] for row in window])
+                meta = dict(meta, context_start=window[0][0], context_end=window[-1][0])
+                if 'page_start' in meta:
+                    meta.update(page_start=window[0][2]['page_start'], page_end=window[-1][2]['page_end'])
+            hits.append((doc, meta, distance))
+            if len(hits) == n_results:
+                break
+        return hits
+
+    def _search_embeddings(self, generation: SearchGeneration, query_embeddings: List[List[float]], n_results: int, sources: List[str] = None) -> List[List[tuple]]:
+        """Fan embedded queries out across a generation's shards, return merged (doc, meta, distance) hits per query."""
+        shards = generation.router.shards_for_sources(sources, list(generation.collections))
+        if generation.doc_indexes:
+            return self._two_level_search(generation, query_embeddings, n_results, shards, sources)
+        where = None
+        if sources:
+            # Chroma can only match exact values, so subdomains are expanded to the domains actually indexed
+            domains = sorted(domain for domain in self._domains(generation) if domain_matches(domain, sources))
+            if not domains:
+                return [[] for _ in query_embeddings]
+            where = {'domain': {'$in': domains}}
+        
+        def query_shard(shard):
+            if shard in generation.quant_indexes:
+                return self._quantized_query(generation, shard, query_embeddings, n_results, sources)
+            return generation.collections[shard].query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where
+            )
+        
+        # Merge per-shard top-k by distance
+        hits = [[] for _ in query_embeddings]
+        for shard_results in generation.search_pool.map(query_shard, shards):
+            for i, query_hits in enumerate(hits):
+                query_hits.extend(zip(
+                    shard_results['documents'][i],
+                    shard_results['metadatas'][i],
+                    shard_results['distances'][i]
+                ))
+        for query_hits in hits:
+            query_hits.sort(key=lambda hit: hit[2])
+        return hits
+
+    def _format_hits(self, hits: List[tuple], n_results: int, space: str) -> List[Dict]:
+        """Format the top hits with metadata."""
         results = []
-        for doc, meta, dist in zip(
-            raw_results['documents'][0],
-            raw_results['metadatas'][0],
-            raw_results['distances'][0]
-        ):
+        for doc, meta, dist in hits[:n_results]:
             result = {
                 'url': meta['url'],
                 'chunk_index': meta['chunk_index'],
                 'total_chunks': meta['total_chunks'],
-                'relevance': 1 - dist,  # Convert distance to similarity score
+                'relevance': to_relevance(dist, space),
                 'content': doc
             }
+            if 'page_start' in meta:
+                result['pages'] = (meta['page_start'], meta['page_end'])
+            if 'context_start' in meta:
+                result['context'] = (meta['context_start'], meta['context_end'])
             results.append(result)
+        return results
+
+    def search_batch(self, queries: List[str], n_results: List[int], sources: List[List[str]]) -> List[List[Dict]]:
+        """Search several queries with one embedding pass and one multi-query search per shard."""
+        self.refresh()
+        query_embeddings = self.embedding_function.embed_queries(queries)
+        
+        # Queries with the same source filter can share one multi-query search
+        groups = {}
+        for i, query_sources in enumerate(sources):
+            groups.setdefault(tuple(sorted({normalize_source(source) for source in query_sources or []})), []).append(i)
+        
+        results = [None] * len(queries)
+        generation = self._acquire_generation()
+        try:
+            for group_sources, indexes in groups.items():
+                group_hits = self._search_embeddings(
+                    generation,
+                    [query_embeddings[i] for i in indexes],
+                    max(n_results[i] for i in indexes),
+                    list(group_sources) or None
+                )
+                for i, hits in zip(indexes, group_hits):
+                    results[i] = self._format_hits(hits, n_results[i], generation.space)
+        finally:
+            generation.release()
+        return results
+
+    def search(self, query: str, n_results: int = 5, verbose: bool = False, sources: List[str] = None) -> List[Dict]:
+        """Search for relevant documents, optionally restricted to source domains."""
+        results = self.search_batch([query], [n_results], [sources])[0]
         
         # Show results table if verbose mode is on
         if verbose:
@@ -111,11 +551,30 @@ class Querier:
             for i, result in enumerate(results, 1):
                 print(f"Result {i} (Relevance: {result['relevance']:.2%})")
                 print(f"Source: {result['url']}")
+                if 'pages' in result:
+                    print(f"Pages: {result['pages'][0]}-{result['pages'][1]}")
+                if 'context' in result:
+                    print(f"Chunks: {result['context'][0]}-{result['context'][1]} of {result['total_chunks']}")
                 print(f"Content: {result['content'][:200]}...")  # Show first 200 chars
                 print("\n" + "-" * 80)
         
         return results
 
+    async def asearch(self, query: str, n_results: int = 5, sources: List[str] = None) -> List[Dict]:
+        """Search asynchronously; concurrent calls are coalesced into micro-batches."""
+        if self.batcher is None:
+            batching = self.config.get('query', {}).get('batching', {}) or {}
+            self.batcher = MicroBatcher(
+                self.search_batch,
+                max_wait=batching.get('max_wait_ms', 5) / 1000,
+                max_batch=batching.get('max_batch', 32)
+            )
+        return await self.batcher.submit(query, n_results, sources)
+
+    def batch_stats(self) -> Dict:
+        """Batch-size histogram for asearch() calls so far."""
+        return self.batcher.stats() if self.batcher else MicroBatcher.empty_stats()
+
 def run_query(args=None):
     """Entry point for query functionality."""
     if args is None:
@@ -126,16 +585,20 @@ def run_query(args=None):
         group.add_argument('query', nargs='?', help='Search query')
         parser.add_argument('-n', '--num-results', type=int, default=5, help='Number of results to show')
         parser.add_argument('-v', '--verbose', action='store_true', help='Show full result details')
+        parser.add_argument('-s', '--source', action='append', help='Restrict search to a source domain (repeatable)')
         args = parser.parse_args()
     
     querier = Querier()
     
-    if args.list:
-        querier.list_documents()
-    elif hasattr(args, 'query') and args.query:
-        querier.search(args.query, args.num_results, args.verbose)
-    else:
-        querier.show_stats()
+    try:
+        if args.list:
+            querier.list_documents()
+        elif hasattr(args, 'query') and args.query:
+            querier.search(args.query, args.num_results, args.verbose, sources=args.source)
+        else:
+            querier.show_stats()
+    finally:
+        querier.close()
 
 if __name__ == "__main__":
     run_query() 
\ No newline at end of file
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Statuses that mean "slow down" rather than "this URL is broken"
+THROTTLE_STATUS = {429, 503}
+
+class RetryableFetchError(Exception):
+    """A fetch failed for a reason that may go away: throttling, a 5xx, a timeout or an open circuit."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class DomainPausedError(RetryableFetchError):
+    """No request was sent because the domain's circuit is open or it asked for a long pause.
+
+    Callers re-queue the URL for `retry_after` seconds without counting an attempt.
+    """
+
+class DomainDownError(Exception):
+    """The domain failed its half-open trials and is not contacted again this run."""
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (seconds or HTTP date) into seconds from now."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+class DomainController:
+    """Adaptive request pacing and circuit breaking for one domain.
+
+    Request starts are spaced `delay` seconds apart. The request rate grows
+    additively while responses are healthy and is cut multiplicatively on
+    429/503, which also pause the domain for the server's Retry-After. After
+    `failure_threshold` consecutive errors the circuit opens and requests
+    fail fast for `open_seconds`, then a single trial request is let through.
+    After `max_trials` failed trials the domain is given up on for the run,
+    so its queued URLs fail at once instead of waiting out further circuits.
+    """
+
+    def __init__(self, domain: str, delay: float, config: Dict):
+        self.domain = domain
+        self.min_delay = config.get('min_delay', 0.5)
+        self.max_delay = config.get('max_delay', 60)
+        self.increase = config.get('increase', 0.05)
+        self.decrease = config.get('decrease', 0.5)
+        self.failure_threshold = config.get('failure_threshold', 5)
+        self.base_open_seconds = config.get('open_seconds', 300)
+        self.max_trials = config.get('max_trials', 1)
+        self.max_inline_wait = config.get('max_inline_wait', 10)
+
+        self.delay = min(max(delay, self.min_delay), self.max_delay)
+        self.lock = asyncio.Lock()
+        self.last_start = 0.0
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+        self.open_seconds = self.base_open_seconds
+        self.failed_trials = 0
+        self.trial_in_flight = False
+        self.failed_trials = 0
+        self.down = False
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0, 'circuit_opens': 0}
+
+    @property
+    def is_open(self) -> bool:
+        return self.open_until > 0
+
+    async def acquire(self) -> bool:
+        """Wait for this domain's next request slot, or raise if it should not be contacted now.
+
+        Returns True if the request is the half-open trial, which must be
+        followed by a record_* call or end_trial().
+        """
+        async with self.lock:
+            if self.down:
+                raise DomainDownError(f"{self.domain} is down (failed {self.failed_trials} trial requests)")
+            now = time.monotonic()
+            trial = False
+            if self.is_open:
+                if now < self.open_until or self.trial_in_flight:
+                    raise DomainPausedError(f"circuit open for {self.domain}", max(self.open_until - now, 1.0))
+                self.trial_in_flight = trial = True  # Half-open: let one request probe the host
+
+            try:
+                # Long Retry-After pauses are handed back to the caller's retry queue
+                blocked = self.blocked_until - now
+                if blocked > self.max_inline_wait:
+                    raise DomainPausedError(f"{self.domain} asked us to wait {blocked:.0f}s", blocked)
+
+                wait = max(self.last_start + self.delay, self.blocked_until) - now
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            except BaseException:
+                # No request was sent, so the trial slot goes to the next caller
+                if trial:
+                    self.trial_in_flight = False
+                raise
+            self.last_start = time.monotonic()
+            self.stats['requests'] += 1
+            return trial
+
+    def record_success(self):
+        """The server answered normally: speed up and close the circuit."""
+        rate = 1 / self.delay + self.increase
+        self.delay = max(self.min_delay, 1 / rate)
+        self.failures = 0
+        if self.is_open:
+            logger.info(f"Circuit for {self.domain} closed")
+        self.open_until = 0.0
+        self.open_seconds = self.base_open_seconds
+        self.trial_in_flight = False
+
+    def record_throttle(self, retry_after: Optional[float]):
+        """The server asked us to slow down (429/503)."""
+        self.stats['throttled'] += 1
+        self.delay = min(self.max_delay, self.delay / self.decrease)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        logger.info(f"Throttled by {self.domain}, delay now {self.delay:.1f}s"
+                    + (f", pausing {retry_after:.0f}s" if retry_after else ""))
+        self.trial_in_flight = False
+
+    def record_error(self):
+        """The request failed outright (connection error, timeout, 5xx)."""
+        self.stats['errors'] += 1
+        self.failures += 1
+        if self.trial_in_flight or self.failures >= self.failure_threshold:
+            if self.trial_in_flight:
+                self.failed_trials += 1
+                if self.failed_trials >= self.max_trials:
+                    self.down = True
+                    logger.warning(f"Giving up on {self.domain} after {self.failed_trials} failed trial requests")
+                self.open_seconds = min(self.open_seconds * 2, 3600)
+            self.open_until = time.monotonic() + self.open_seconds
+            self.trial_in_flight = False
+            self.stats['circuit_opens'] += 1
+            logger.warning(f"Circuit for {self.domain} opened for {self.open_seconds:.0f}s after {self.failures} consecutive failures")
+
+    def end_trial(self):
+        """End the half-open trial; if it recorded no outcome, count that as an error."""
+        if self.trial_in_flight:
+            self.record_error()
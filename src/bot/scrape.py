@@ -1,9 +1,13 @@
 import asyncio
+import hashlib
+import heapq
 import logging
-import re
+import random
+import time
+import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Set
+from typing import Dict, List, Optional, Set
 from urllib.parse import urlparse
 import os
 
@@ -12,19 +16,36 @@ import yaml
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 from webdriver_manager.chrome import ChromeDriverManager
 from webdriver_manager.core.os_manager import ChromeType
 
+from .ratelimit import THROTTLE_STATUS, DomainController, DomainDownError, DomainPausedError, RetryableFetchError, parse_retry_after
+from .store import DocumentStore
+
 # Setup paths
 MODULE_DIR = Path(__file__).parent
 PROJECT_ROOT = MODULE_DIR.parent.parent
-DATA_DIR = PROJECT_ROOT / "data/raw"
-DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Injected into every page before its own scripts run
+MUTATION_COUNTER_JS = """
+window.__mutations = 0;
+new MutationObserver(function(records) { window.__mutations += records.length; })
+    .observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+"""
+
+# Page state that must stop changing before a page counts as ready
+READINESS_JS = """
+return [document.readyState, window.__mutations || 0, performance.getEntriesByType('resource').length];
+"""
+
 class Scraper:
     def __init__(self):
         # Load config
@@ -34,7 +55,8 @@ class Scraper:
         
         # Get settings
         self.js_sites = self.config.get('js_sites', {})
-        self.domain_delays = {}
+        self.controllers = {}
+        self.rate_config = self.config.get('rate_control', {}) or {}
         
         self.headers = self.config.get('headers', {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
@@ -51,13 +73,28 @@ class Scraper:
             total=timeout_config['scrape']
         )
         
+        # Download limits
+        download_config = self.config.get('downloads', {})
+        self.chunk_size = download_config.get('chunk_kb', 64) * 1024
+        self.allowed_types = download_config.get('allowed_types', ['text/', 'application/pdf'])
+        self.size_caps = download_config.get('max_size_mb', {'default': 50})
+        self.download_dir = PROJECT_ROOT / "data/tmp/downloads"
+        self.download_dir.mkdir(parents=True, exist_ok=True)
+        self.session = None
+        
+        # Raw document store
+        self.store = DocumentStore()
+        
+        self.render_times = []
         if self.js_sites:
+            self.selenium_lock = asyncio.Lock()
             self._setup_selenium()
     
     def _setup_selenium(self):
         """Initialize Selenium WebDriver."""
         options = Options()
-        selenium_args = self.config.get('selenium', {}).get('args', [
+        selenium_config = self.config.get('selenium', {}) or {}
+        selenium_args = selenium_config.get('args', [
             "--headless", "--no-sandbox", "--disable-dev-shm-usage"
         ])
         
@@ -66,6 +103,13 @@ class Scraper:
             logger.info(f"  {arg}")
             options.add_argument(arg)
         
+        # Return from get() at DOMContentLoaded; readiness is detected by _wait_until_ready
+        options.page_load_strategy = 'eager'
+        
+        blocked = selenium_config.get('block_resources', [])
+        if blocked:
+            options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+        
         try:
             manager = ChromeDriverManager(chrome_type=ChromeType.CHROMIUM)
             driver_path = manager.install()
@@ -74,6 +118,13 @@ class Scraper:
             self.driver = webdriver.Chrome(service=service, options=options)
             logger.info("Chromium driver initialized successfully")
             
+            # Count DOM mutations on every page so readiness can wait for the DOM to settle
+            self.driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': MUTATION_COUNTER_JS})
+            if blocked:
+                self.driver.execute_cdp_cmd('Network.enable', {})
+                self.driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked})
+                logger.info(f"Blocking {len(blocked)} resource patterns in Selenium")
+            
         except Exception as e:
             logger.error(f"Failed to initialize Chromium driver: {str(e)}")
             logger.error(f"Error type: {type(e).__name__}")
@@ -88,35 +139,94 @@ class Scraper:
 
     def get_cached_urls(self) -> Set[str]:
         """Get set of URLs that have already been downloaded."""
-        cached = set()
-        for json_file in DATA_DIR.glob("*.json"):
-            try:
-                with open(json_file) as f:
-                    metadata = yaml.safe_load(f)
-                    if metadata and 'url' in metadata:
-                        cached.add(metadata['url'])
-            except Exception as e:
-                logger.warning(f"Error reading {json_file}: {e}")
-        return cached
+        return self.store.urls()
 
-    async def _wait_for_rate_limit(self, url: str):
-        """Wait based on domain rate limiting from config."""
+    def _controller(self, url: str) -> DomainController:
+        """Return the rate controller for a URL's domain, created with its configured delay."""
         domain = urlparse(url).netloc
-        delays = self.config.get('delay', {})
+        if domain not in self.controllers:
+            delays = self.config.get('delay', {})
+            
+            # Get delay for this domain, fallback to default_delay
+            if isinstance(delays, dict):
+                delay = delays.get(domain, self.config.get('default_delay', 0))
+            else:
+                # If delay is a number, use it as default delay
+                delay = delays if isinstance(delays, (int, float)) else 0
+            self.controllers[domain] = DomainController(domain, delay, self.rate_config)
+        return self.controllers[domain]
+
+    def retry_delay(self, attempt: int, retry_after: float = None) -> float:
+        """Seconds to wait before retrying a transient failure."""
+        backoff = self.rate_config.get('retry_base_delay', 10) * 2 ** attempt
+        return max(retry_after or 0, backoff * random.uniform(0.8, 1.2))
+
+    def rate_summary(self) -> List[str]:
+        """One line per domain that was throttled or failing."""
+        lines = []
+        for domain, controller in sorted(self.controllers.items()):
+            stats = controller.stats
+            if stats['throttled'] or stats['errors']:
+                state = "down" if controller.down else "circuit open" if controller.is_open else f"delay {controller.delay:.1f}s"
+                lines.append(f"{domain}: {stats['requests']} requests, {stats['throttled']} throttled, "
+                             f"{stats['errors']} errors, {stats['circuit_opens']} circuit opens ({state})")
+        return lines
+
+    def _site_config(self, domain: str) -> Dict:
+        """Per-site Selenium settings from js_sites: nothing, a CSS selector, or a dict."""
+        site = self.js_sites.get(domain)
+        if isinstance(site, str):
+            return {'selector': site}
+        return site or {}
+
+    def _wait_until_ready(self, site: Dict) -> str:
+        """Block until the loaded page is ready, return what decided it.
         
-        # Get delay for this domain, fallback to default_delay
-        if isinstance(delays, dict):
-            delay = delays.get(domain, self.config.get('default_delay', 0))
-        else:
-            # If delay is a number, use it as default delay
-            delay = delays if isinstance(delays, (int, float)) else 0
+        With a per-site selector, waits for that element. Otherwise polls until
+        the DOM has stopped changing and no new resources have been requested
+        for quiet_ms, which covers both DOM stability and network idle.
+        """
+        selenium_config = self.config.get('selenium', {}) or {}
+        max_wait = site.get('timeout', selenium_config.get('max_wait', 15))
+        
+        if site.get('selector'):
+            try:
+                WebDriverWait(self.driver, max_wait).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, site['selector']))
+                )
+                return f"selector {site['selector']}"
+            except TimeoutException:
+                return f"timeout waiting for {site['selector']}"
         
-        if delay > 0 and domain in self.domain_delays:
-            time_since_last = datetime.now().timestamp() - self.domain_delays[domain]
-            if time_since_last < delay:
-                await asyncio.sleep(delay - time_since_last)
+        quiet = selenium_config.get('quiet_ms', 500) / 1000
+        poll = selenium_config.get('poll_ms', 100) / 1000
+        deadline = time.monotonic() + max_wait
+        last_state = None
+        stable_since = time.monotonic()
+        while time.monotonic() < deadline:
+            state = self.driver.execute_script(READINESS_JS)
+            if state != last_state:
+                last_state = state
+                stable_since = time.monotonic()
+            elif state[0] != 'loading' and time.monotonic() - stable_since >= quiet:
+                return "DOM and network idle"
+            time.sleep(poll)
+        return "max wait"
+
+    def _render(self, url: str, site: Dict) -> Optional[str]:
+        """Load a page in the shared browser and return its HTML once ready (runs in a thread)."""
+        timeout = self.config.get('timeouts', {}).get('scrape', 30)
+        self.driver.set_page_load_timeout(timeout)
+        self.driver.set_script_timeout(timeout)
+        
+        start = time.perf_counter()
+        self.driver.get(url)
+        reason = self._wait_until_ready(site)
+        elapsed = time.perf_counter() - start
         
-        self.domain_delays[domain] = datetime.now().timestamp()
+        self.render_times.append(elapsed)
+        logger.info(f"Rendered {url} in {elapsed:.2f}s ({reason})")
+        return self.driver.page_source
 
     async def _fetch_with_selenium(self, url: str) -> bytes:
         """Fetch URL using Selenium for JavaScript-heavy sites."""
@@ -125,91 +235,206 @@ class Scraper:
             return None
             
         logger.info(f"Using Selenium for {url}")
-        try:
-            # Configure Chrome to wait for network idle
-            self.driver.set_page_load_timeout(30)  # 30 second timeout
-            self.driver.set_script_timeout(30)
-            
-            # Load the page and wait for network to be idle
-            self.driver.get(url)
-            self.driver.execute_script("return window.performance.timing.loadEventEnd")
-            
-            # Additional small wait for any final rendering
-            await asyncio.sleep(2)
-            
-            page_source = self.driver.page_source
-            if page_source:
-                return page_source.encode()
-            
-        except Exception as e:
-            logger.error(f"Selenium error for {url}: {e}")
+        # One browser is shared, so only one page can be loaded at a time
+        async with self.selenium_lock:
+            try:
+                # Load and wait off the event loop
+                page_source = await asyncio.to_thread(self._render, url, self._site_config(domain))
+                if page_source:
+                    return page_source.encode()
+                
+            except Exception as e:
+                logger.error(f"Selenium error for {url}: {e}")
             
         return None
 
+    def render_summary(self) -> Optional[str]:
+        """Render time statistics for Selenium pages, if any were rendered."""
+        if not self.render_times:
+            return None
+        times = sorted(self.render_times)
+        return (f"{len(times)} pages, median {times[len(times) // 2]:.2f}s, "
+                f"p95 {times[min(len(times) - 1, int(len(times) * 0.95))]:.2f}s, total {sum(times):.1f}s")
+
     async def _fetch_url(self, url: str) -> Dict:
-        """Fetch a single URL using appropriate method."""
-        await self._wait_for_rate_limit(url)
+        """Fetch a single URL using appropriate method.
         
+        Returns None for permanent failures and for domains that are down.
+        Raises RetryableFetchError for throttling, server errors, timeouts and
+        open circuits, so callers can queue the URL for a later retry.
+        """
+        controller = self._controller(url)
+        try:
+            trial = await controller.acquire()
+        except DomainDownError as e:
+            logger.info(f"Skipping {url}: {e}")
+            return None
+        try:
+            return await self._fetch_with_controller(url, controller)
+        finally:
+            # A half-open trial that ended without a verdict (bad URL, redirect loop, cancellation) must not block the domain
+            if trial:
+                controller.end_trial()
+
+    async def _fetch_with_controller(self, url: str, controller: DomainController) -> Dict:
+        """Fetch a URL whose request slot has been acquired, reporting the outcome to its controller."""
         # Try Selenium first for configured sites
         if any(site in url for site in self.js_sites):
             content = await self._fetch_with_selenium(url)
             if content:
-                return {
-                    'url': url,
-                    'content': content,
-                    'content_type': 'text/html',
-                    'timestamp': datetime.now().isoformat()
-                }
+                controller.record_success()
+                return self._write_download(url, content, 'text/html')
         
         # Otherwise use regular HTTP request
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers, timeout=self.timeout) as response:
-                    response.raise_for_status()
-                    content = await response.read()
-                    return {
-                        'url': url,
-                        'content': content,
-                        'content_type': response.headers.get('content-type', ''),
-                        'timestamp': datetime.now().isoformat()
-                    }
+            session = self._get_session()
+            async with session.get(url, headers=self.headers, timeout=self.timeout) as response:
+                if response.status in THROTTLE_STATUS:
+                    retry_after = parse_retry_after(response.headers.get('retry-after'))
+                    controller.record_throttle(retry_after)
+                    raise RetryableFetchError(f"HTTP {response.status}", retry_after)
+                if response.status >= 500:
+                    controller.record_error()
+                    raise RetryableFetchError(f"HTTP {response.status}")
+                controller.record_success()
+                response.raise_for_status()
+                return await self._download(url, response)
+        except RetryableFetchError:
+            raise
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            controller.record_error()
+            raise RetryableFetchError(f"{type(e).__name__}: {e}") from e
         except Exception as e:
             logger.error(f"Failed to fetch {url}: {e}")
             return None
 
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Return a shared HTTP session, created on first use inside the event loop."""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def close(self):
+        """Close the shared HTTP session."""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    @staticmethod
+    def _match_type(content_type: str, patterns) -> str:
+        """Return the longest pattern that prefixes the MIME type, or None."""
+        mime = content_type.split(';')[0].strip().lower()
+        matches = [p for p in patterns if p != 'default' and mime.startswith(p)]
+        return max(matches, key=len) if matches else None
+
+    def _check_content_type(self, content_type: str) -> int:
+        """Reject disallowed content types, return the size cap in bytes for allowed ones."""
+        if content_type and not self._match_type(content_type, self.allowed_types):
+            raise ValueError(f"Disallowed content type '{content_type}'")
+        pattern = self._match_type(content_type, self.size_caps) if content_type else None
+        return int(self.size_caps.get(pattern, self.size_caps.get('default', 50)) * 1024 * 1024)
+
+    async def _download(self, url: str, response: aiohttp.ClientResponse) -> Dict:
+        """Stream a response body to a temp file while hashing it.
+        
+        The body is never held in memory. Downloads that exceed the content
+        type's size cap are aborted, and only completed files are renamed from
+        .part to .download, so partial downloads can't reach the store.
+        """
+        content_type = response.headers.get('content-type', '')
+        max_size = self._check_content_type(content_type)
+        if response.content_length and response.content_length > max_size:
+            raise ValueError(f"Content-Length {response.content_length} exceeds {max_size} byte cap for '{content_type}'")
+        
+        part_file = self.download_dir / f"{uuid.uuid4().hex}.part"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(part_file, 'wb') as f:
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise ValueError(f"Body exceeds {max_size} byte cap for '{content_type}'")
+                    digest.update(chunk)
+                    f.write(chunk)
+            download_file = part_file.with_suffix('.download')
+            os.replace(part_file, download_file)
+        except BaseException:
+            part_file.unlink(missing_ok=True)
+            raise
+        
+        return {
+            'url': url,
+            'path': download_file,
+            'hash': digest.hexdigest(),
+            'size': size,
+            'content_type': content_type,
+            'timestamp': datetime.now().isoformat()
+        }
+
+    def _write_download(self, url: str, content: bytes, content_type: str) -> Dict:
+        """Write already-fetched content (e.g. from Selenium) as a completed download."""
+        part_file = self.download_dir / f"{uuid.uuid4().hex}.part"
+        part_file.write_bytes(content)
+        download_file = part_file.with_suffix('.download')
+        os.replace(part_file, download_file)
+        return {
+            'url': url,
+            'path': download_file,
+            'hash': hashlib.sha256(content).hexdigest(),
+            'size': len(content),
+            'content_type': content_type,
+            'timestamp': datetime.now().isoformat()
+        }
+
+    @staticmethod
+    def read_content(result: Dict) -> bytes:
+        """Read a completed download into memory (for link and sitemap parsing)."""
+        return result['path'].read_bytes()
+
+    @staticmethod
+    def discard(result: Dict):
+        """Delete a completed download that won't be stored."""
+        if result:
+            result['path'].unlink(missing_ok=True)
+
     def _save_content(self, result: Dict) -> str:
         """Save downloaded content and metadata, return size in KB."""
         if not result:
             return "0"
+        
+        try:
+            _, is_new = self.store.put_file(
+                result['url'],
+                result['path'],
+                result['hash'],
+                result.get('content_type', ''),
+                result['timestamp']
+            )
+        finally:
+            self.discard(result)
+        if not is_new:
+            logger.info(f"Content of {result['url']} already stored, linked to existing blob")
             
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        safe_url = re.sub(r'[^\w\-_]', '_', result['url'])
-        base_name = f"{safe_url}_{timestamp}"
-        
-        # Save content
-        content_file = DATA_DIR / f"{base_name}.raw"
-        with open(content_file, 'wb') as f:
-            f.write(result['content'])
-            
-        # Save metadata
-        metadata = {k: v for k, v in result.items() if k != 'content'}
-        with open(DATA_DIR / f"{base_name}.json", 'w') as f:
-            yaml.dump(metadata, f)
-            
-        return f"{content_file.stat().st_size / 1024:.1f}"
+        return f"{result['size'] / 1024:.1f}"
 
-async def run_scrape():
-    """Main function to run the scraper."""
-    # Load URLs
+def load_urls() -> List[str]:
+    """Load URLs from urls.txt, skipping blank lines and comments."""
     try:
         with open(PROJECT_ROOT / "urls.txt") as f:
             urls = [line.strip() for line in f if line.strip() and not line.startswith('#')]
     except FileNotFoundError:
         logger.error("urls.txt not found")
-        return
+        return []
     
     if not urls:
         logger.error("No URLs found in urls.txt")
+    return urls
+
+async def run_scrape():
+    """Main function to run the scraper."""
+    # Load URLs
+    urls = load_urls()
+    if not urls:
         return
     
     # Initialize scraper
@@ -217,19 +442,51 @@ async def run_scrape():
     cached_urls = scraper.get_cached_urls()
     
     print(f"\nProcessing {len(urls)} URLs...")
+    max_retries = scraper.rate_config.get('max_retries', 3)
     
-    # Process URLs
-    for url in urls:
+    # Retry queue of (due time, order, attempt, url); first attempts are due immediately
+    queue = []
+    for order, url in enumerate(urls):
         if url in cached_urls:
             print(f"• Cached: {url}")
             continue
-            
-        result = await scraper._fetch_url(url)
+        heapq.heappush(queue, (0.0, order, 0, url))
+    
+    # Process URLs
+    while queue:
+        due, order, attempt, url = heapq.heappop(queue)
+        wait = due - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        
+        try:
+            result = await scraper._fetch_url(url)
+        except DomainPausedError as e:
+            # Nothing was sent, so this doesn't use up a retry
+            heapq.heappush(queue, (time.monotonic() + e.retry_after, order, attempt, url))
+            print(f"↻ Deferred {e.retry_after:.0f}s: {url} ({e})")
+            continue
+        except RetryableFetchError as e:
+            if attempt >= max_retries:
+                print(f"✗ Failed: {url} ({e}, gave up after {attempt} retries)")
+                continue
+            delay = scraper.retry_delay(attempt, e.retry_after)
+            heapq.heappush(queue, (time.monotonic() + delay, order, attempt + 1, url))
+            print(f"↻ Retrying in {delay:.0f}s: {url} ({e})")
+            continue
+        
         if result:
             size_kb = scraper._save_content(result)
             print(f"✓ Downloaded: {url} ({size_kb}KB)")
         else:
             print(f"✗ Failed: {url}")
+    
+    for line in scraper.rate_summary():
+        print(f"• Rate control: {line}")
+    if scraper.render_summary():
+        print(f"• Selenium render times: {scraper.render_summary()}")
+    
+    await scraper.close()
 
 if __name__ == "__main__":
     asyncio.run(run_scrape())
\ No newline at end of file
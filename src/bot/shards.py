@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# Name of the collection inside every shard's database
+COLLECTION_NAME = "documents"
+
+# Written by ingest so queriers know which shards exist
+SHARD_MANIFEST = "shards.yaml"
+
+def url_domain(url: str) -> str:
+    """Return the host part of a URL without a leading www."""
+    domain = urlparse(url).netloc.lower()
+    return domain[4:] if domain.startswith('www.') else domain
+
+def normalize_source(source: str) -> str:
+    """Return a source filter (a domain or URL) as a domain, the way url_domain() reports documents."""
+    source = source.strip()
+    return url_domain(source if '//' in source else f"//{source}")
+
+def domain_matches(domain: str, sources: Iterable[str]) -> bool:
+    """Whether a domain is one of the sources or a subdomain of one."""
+    return any(domain == source or domain.endswith('.' + source) for source in sources)
+
+class ShardRouter:
+    """Map documents to shards according to the `sharding` section of config.yaml.
+
+    Modes:
+        none:   everything lives in a single database (the default)
+        domain: one shard per source domain
+        hash:   num_shards shards, assigned by a hash of the URL
+        groups: named source groups, each a list of domains
+    """
+
+    def __init__(self, config: dict):
+        sharding = config.get('sharding', {}) or {}
+        self.mode = sharding.get('mode', 'none')
+        self.num_shards = sharding.get('num_shards', 4)
+        self.groups = sharding.get('groups', {}) or {}
+        self.default_group = sharding.get('default_group', 'other')
+
+        if self.mode not in ('none', 'domain', 'hash', 'groups'):
+            raise ValueError(f"Unknown sharding mode '{self.mode}'")
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'none'
+
+    def shard_for(self, url: str) -> str:
+        """Return the name of the shard a document belongs to."""
+        if self.mode == 'domain':
+            return re.sub(r'[^\w\-.]', '_', url_domain(url)) or self.default_group
+        if self.mode == 'hash':
+            digest = hashlib.sha1(url.encode('utf-8')).digest()
+            return f"shard-{int.from_bytes(digest[:4], 'big') % self.num_shards:02d}"
+        if self.mode == 'groups':
+            domain = url_domain(url)
+            for name, domains in self.groups.items():
+                if domain_matches(domain, domains or []):
+                    return name
+            return self.default_group
+        return COLLECTION_NAME
+
+    def shards_for_sources(self, sources: List[str], shards: List[str]) -> List[str]:
+        """Narrow the shard list to those that can contain the given source domains or their subdomains."""
+        if not sources or self.mode in ('none', 'hash'):
+            return shards
+        sources = [normalize_source(source) for source in sources]
+        targets = {self.shard_for(f"https://{source}/") for source in sources}
+        if self.mode == 'domain':
+            # Each subdomain has a shard of its own
+            targets.update(shard for shard in shards if domain_matches(shard, targets))
+        else:
+            # Groups that list a subdomain of a source take that subdomain's documents
+            targets.update(
+                name for name, domains in self.groups.items()
+                if any(domain_matches(normalize_source(d), sources) for d in domains or [])
+            )
+        return [shard for shard in shards if shard in targets]
+
+    def shard_path(self, db_dir: Path, shard: str) -> Path:
+        """Return the database directory for a shard."""
+        return db_dir if not self.enabled else db_dir / shard
+
+    def write_manifest(self, db_dir: Path, shards: List[str]):
+        """Record the sharding mode and shard names next to the databases."""
+        with open(db_dir / SHARD_MANIFEST, 'w') as f:
+            yaml.safe_dump({'mode': self.mode, 'shards': sorted(shards)}, f)
+
+    @staticmethod
+    def read_manifest(db_dir: Path) -> Optional[Dict]:
+        """Read the shard manifest, or None for a single unsharded database."""
+        manifest_path = db_dir / SHARD_MANIFEST
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path) as f:
+            return yaml.safe_load(f)
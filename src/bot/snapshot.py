@@ -0,0 +1,260 @@
+import argparse
+import hashlib
+import logging
+import shutil
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+from typing import Dict, List
+
+import yaml
+import zstandard as zstd
+
+from .generations import BUILD_INFO, CHECKPOINT_FILE, IndexGenerations, IngestCheckpoint, library_versions
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+DB_DIR = PROJECT_ROOT / "data/chromadb"
+SNAPSHOT_DIR = PROJECT_ROOT / "data/snapshots"
+
+SNAPSHOT_FORMAT = 1
+MANIFEST_NAME = "snapshot.yaml"
+INDEX_PREFIX = "index/"
+IMPORT_DIR = "importing"
+
+# Version mismatches in these make an index unreadable; others only warrant a warning
+REQUIRED_PACKAGES = ['chromadb', 'chroma-hnswlib']
+
+def file_sha256(path: Path) -> str:
+    """SHA-256 of a file, read in 1MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+def _minor_version(version: str) -> str:
+    return '.'.join((version or '').split('.')[:2])
+
+def check_compatibility(manifest: Dict, config: Dict) -> List[str]:
+    """Return reasons a snapshot cannot be served by this install (empty if it can)."""
+    from .embeddings import model_spec
+
+    problems = []
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        problems.append(f"snapshot format {manifest.get('format')} (expected {SNAPSHOT_FORMAT})")
+
+    build = manifest.get('build') or {}
+    spec = model_spec(config)
+    if build.get('embedding_model') != spec['name']:
+        problems.append(f"embedding model {build.get('embedding_model')} (this install uses {spec['name']})")
+    if build.get('document_instruction') != spec['document_instruction'] or build.get('query_instruction') != spec['query_instruction']:
+        problems.append("embedding instructions differ from this install's")
+
+    built_with = build.get('versions') or {}
+    installed = library_versions()
+    for package, version in built_with.items():
+        if _minor_version(version) == _minor_version(installed.get(package)):
+            continue
+        if package in REQUIRED_PACKAGES:
+            problems.append(f"{package} {version} (installed: {installed.get(package)})")
+        else:
+            logger.warning(f"Snapshot was built with {package} {version}, installed: {installed.get(package)}")
+    return problems
+
+def _is_safe_path(name: str) -> bool:
+    """Whether an archive path is relative and stays inside the directory it is extracted to."""
+    path = PurePosixPath(name)
+    return bool(name) and '\\' not in name and not path.is_absolute() and '..' not in path.parts
+
+def export_snapshot(index_dir: Path, dest: Path, level: int = 10, threads: int = 0, workers: int = 4) -> Dict:
+    """Write an index generation to a single zstd-compressed tar archive, return its manifest."""
+    files = sorted(p for p in index_dir.rglob('*') if p.is_file())
+
+    # Checksum every file up front so the manifest can lead the archive
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = list(pool.map(file_sha256, files))
+
+    build = None
+    if (index_dir / BUILD_INFO).exists():
+        with open(index_dir / BUILD_INFO) as f:
+            build = yaml.safe_load(f)
+    contents = None
+    if (index_dir / CHECKPOINT_FILE).exists():
+        checkpoint = IngestCheckpoint(index_dir)
+        contents = checkpoint.summary()
+        checkpoint.close()
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'created_at': datetime.now().isoformat(),
+        'generation': index_dir.name,
+        'build': build,
+        'contents': contents,
+        'files': [
+            {'path': path.relative_to(index_dir).as_posix(), 'size': path.stat().st_size, 'sha256': digest}
+            for path, digest in zip(files, digests)
+        ]
+    }
+    manifest_bytes = yaml.safe_dump(manifest, sort_keys=False).encode('utf-8')
+
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    partial = dest.with_name(dest.name + ".part")
+    compressor = zstd.ZstdCompressor(level=level, threads=threads or -1)
+    with open(partial, 'wb') as raw, compressor.stream_writer(raw) as writer:
+        with tarfile.open(fileobj=writer, mode='w|') as tar:
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(manifest_bytes)
+            info.mtime = int(time.time())
+            tar.addfile(info, BytesIO(manifest_bytes))
+            for path in files:
+                tar.add(path, arcname=INDEX_PREFIX + path.relative_to(index_dir).as_posix(), recursive=False)
+    partial.replace(dest)
+    return manifest
+
+def read_manifest(archive: Path) -> Dict:
+    """Read just the manifest at the front of an archive."""
+    with open(archive, 'rb') as raw, zstd.ZstdDecompressor().stream_reader(raw) as reader:
+        with tarfile.open(fileobj=reader, mode='r|') as tar:
+            member = tar.next()
+            if member is None or member.name != MANIFEST_NAME:
+                raise ValueError(f"{archive} is not an index snapshot")
+            return yaml.safe_load(tar.extractfile(member))
+
+def import_snapshot(archive: Path, generations: IndexGenerations, config: Dict, force: bool = False, workers: int = 4) -> Dict:
+    """Unpack, verify and promote a snapshot as the live index generation, return its manifest.
+
+    Decompression is streamed straight to disk, and each file is checksummed
+    on a worker thread as soon as it is written, while the next one unpacks.
+    """
+    import_dir = generations.root / IMPORT_DIR
+    if import_dir.exists():
+        shutil.rmtree(import_dir)
+    import_dir.mkdir(parents=True)
+    import_root = import_dir.resolve()
+
+    manifest = None
+    try:
+        with open(archive, 'rb') as raw, zstd.ZstdDecompressor().stream_reader(raw) as reader, \
+                tarfile.open(fileobj=reader, mode='r|') as tar, \
+                ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for member in tar:
+                if manifest is None:
+                    if member.name != MANIFEST_NAME:
+                        raise ValueError(f"{archive} is not an index snapshot")
+                    manifest = yaml.safe_load(tar.extractfile(member))
+                    problems = check_compatibility(manifest, config)
+                    if problems and not force:
+                        raise ValueError("Incompatible snapshot: " + "; ".join(problems))
+                    for problem in problems:
+                        logger.warning(f"Importing anyway: {problem}")
+                    expected = {entry['path']: entry for entry in manifest['files']}
+                    unsafe = [path for path in expected if not _is_safe_path(path)]
+                    if unsafe:
+                        raise ValueError(f"Snapshot manifest lists unsafe path {unsafe[0]}")
+                    continue
+
+                # Only regular files listed in the manifest are extracted
+                name = member.name[len(INDEX_PREFIX):] if member.name.startswith(INDEX_PREFIX) else None
+                if not member.isfile() or not _is_safe_path(member.name) or name not in expected:
+                    raise ValueError(f"Unexpected archive member {member.name}")
+
+                # Never write outside the import directory, whatever the archive claims
+                dest = (import_dir / name).resolve()
+                if not dest.is_relative_to(import_root):
+                    raise ValueError(f"Archive member {member.name} escapes the import directory")
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                with open(dest, 'wb') as out:
+                    shutil.copyfileobj(tar.extractfile(member), out, 1024 * 1024)
+                futures[name] = pool.submit(file_sha256, dest)
+
+            if manifest is None:
+                raise ValueError(f"{archive} is empty")
+            missing = set(expected) - set(futures)
+            if missing:
+                raise ValueError(f"Snapshot is missing {len(missing)} files, e.g. {sorted(missing)[0]}")
+            corrupt = [name for name, future in futures.items() if future.result() != expected[name]['sha256']]
+            if corrupt:
+                raise ValueError(f"Checksum mismatch in {len(corrupt)} files, e.g. {corrupt[0]}")
+    except BaseException:
+        shutil.rmtree(import_dir, ignore_errors=True)
+        raise
+
+    manifest['imported_as'] = generations.promote(import_dir)
+    return manifest
+
+def _print_manifest(manifest: Dict):
+    build = manifest.get('build') or {}
+    contents = manifest.get('contents') or {}
+    print(f"Generation: {manifest['generation']} (exported {manifest['created_at']})")
+    if contents:
+        print(f"Documents: {contents['documents']}, chunks: {contents['chunks']}")
+    if build:
+        print(f"Embedding model: {build['embedding_model']}")
+        print(f"Chunking: size {build['chunk_size']}, overlap {build['chunk_overlap']}")
+        print(f"Sharding: {build['sharding']}, quantization: {build['quantization']}")
+        versions = ', '.join(f"{package} {version}" for package, version in build['versions'].items() if version)
+        print(f"Built with: {versions}")
+    size = sum(entry['size'] for entry in manifest['files'])
+    print(f"Files: {len(manifest['files'])} ({size / 1024 / 1024:.1f}MB uncompressed)")
+
+def run_snapshot(args=None):
+    """Entry point for index snapshot export/import."""
+    if args is None:
+        # Handle direct script execution
+        parser = argparse.ArgumentParser(description="Export or import portable index snapshots")
+        parser.add_argument('action', choices=['export', 'import', 'info'], help='Snapshot action')
+        parser.add_argument('path', nargs='?', type=Path, help='Archive to write (export) or read (import/info)')
+        parser.add_argument('--force', action='store_true', help='Import even if the snapshot looks incompatible')
+        args = parser.parse_args()
+
+    with open(PROJECT_ROOT / "config.yaml") as f:
+        config = yaml.safe_load(f)
+    snapshot_config = config.get('snapshot', {}) or {}
+    workers = snapshot_config.get('verify_workers', 4)
+    generations = IndexGenerations(DB_DIR, config.get('index', {}).get('keep_generations', 2))
+
+    if args.action == 'export':
+        name = generations.current_name()
+        if not name:
+            print("No index generation to export. Run ingest first.")
+            return
+        dest = args.path or SNAPSHOT_DIR / f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.tar.zst"
+        start = time.perf_counter()
+        manifest = export_snapshot(
+            generations.root / name,
+            dest,
+            level=snapshot_config.get('compression_level', 10),
+            threads=snapshot_config.get('threads', 0),
+            workers=workers
+        )
+        print(f"\n✓ Exported {dest} ({dest.stat().st_size / 1024 / 1024:.1f}MB) in {time.perf_counter() - start:.1f}s")
+        _print_manifest(manifest)
+        return
+
+    if not args.path:
+        print(f"An archive path is required for {args.action}")
+        return
+
+    if args.action == 'info':
+        manifest = read_manifest(args.path)
+        _print_manifest(manifest)
+        problems = check_compatibility(manifest, config)
+        print("Compatible with this install" if not problems else "Incompatible: " + "; ".join(problems))
+        return
+
+    start = time.perf_counter()
+    manifest = import_snapshot(args.path, generations, config, force=args.force, workers=workers)
+    print(f"\n✓ Imported {args.path} as {manifest['imported_as']} in {time.perf_counter() - start:.1f}s")
+    _print_manifest(manifest)
+
+if __name__ == "__main__":
+    run_snapshot()
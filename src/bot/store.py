@@ -0,0 +1,278 @@
+import argparse
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+import yaml
+import zstandard as zstd
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+STORE_DIR = PROJECT_ROOT / "data/store"
+RAW_DIR = PROJECT_ROOT / "data/raw"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS documents (
+    url TEXT PRIMARY KEY,
+    hash TEXT NOT NULL REFERENCES blobs(hash),
+    content_type TEXT,
+    fetched_at TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_hash ON documents(hash);
+"""
+
+class DocumentStore:
+    """Content-addressed raw document store.
+
+    Blobs are keyed by the SHA-256 of their content, zstd-compressed and
+    appended to packed segment files. A SQLite manifest maps each URL to its
+    most recent blob, so identical content is only ever stored once.
+    """
+
+    def __init__(self, path: Path = STORE_DIR):
+        # Load config
+        with open(PROJECT_ROOT / "config.yaml") as f:
+            config = yaml.safe_load(f).get('store', {})
+
+        self.segment_size = config.get('segment_size_mb', 256) * 1024 * 1024
+        self.compression_level = config.get('compression_level', 10)
+
+        # Setup paths
+        self.path = Path(path)
+        self.segments_dir = self.path / "segments"
+        self.segments_dir.mkdir(parents=True, exist_ok=True)
+
+        # Open manifest
+        self.conn = sqlite3.connect(str(self.path / "manifest.sqlite"), check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.lock = threading.Lock()
+
+    def close(self):
+        """Close the manifest database."""
+        self.conn.close()
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.segments_dir / f"seg-{segment:06d}.pack"
+
+    def _active_segment(self) -> int:
+        """Return the segment new blobs should be appended to."""
+        row = self.conn.execute("SELECT MAX(segment) FROM blobs").fetchone()
+        segment = row[0] or 1
+        segment_path = self._segment_path(segment)
+        if segment_path.exists() and segment_path.stat().st_size >= self.segment_size:
+            segment += 1
+        return segment
+
+    def urls(self) -> Set[str]:
+        """Get set of URLs that have been stored."""
+        return {row[0] for row in self.conn.execute("SELECT url FROM documents")}
+
+    def has_url(self, url: str) -> bool:
+        """Check whether a URL has been stored."""
+        return self.conn.execute("SELECT 1 FROM documents WHERE url = ?", (url,)).fetchone() is not None
+
+    def put(self, url: str, content: bytes, content_type: str = '', fetched_at: str = None) -> Tuple[str, bool]:
+        """Store content for a URL, return (hash, whether a new blob was written)."""
+        digest = hashlib.sha256(content).hexdigest()
+        with self.lock:
+            is_new = not self._has_blob(digest)
+            if is_new:
+                compressed = zstd.ZstdCompressor(level=self.compression_level).compress(content)
+                self._append_blob(digest, compressed, len(content))
+            self._set_document(url, digest, content_type, fetched_at)
+            self.conn.commit()
+        return digest, is_new
+
+    def put_file(self, url: str, path: Path, digest: str, content_type: str = '', fetched_at: str = None) -> Tuple[str, bool]:
+        """Store a file's content for a URL by streaming compression.
+
+        The caller supplies the SHA-256 computed while downloading, so the file
+        is only read once and never held in memory.
+        """
+        with self.lock:
+            is_new = not self._has_blob(digest)
+            if is_new:
+                size = Path(path).stat().st_size
+                segment = self._active_segment()
+                with open(path, 'rb') as src, open(self._segment_path(segment), 'ab') as out:
+                    offset = out.tell()
+                    _, written = zstd.ZstdCompressor(level=self.compression_level).copy_stream(src, out, size=size)
+                self.conn.execute(
+                    "INSERT INTO blobs (hash, segment, offset, length, size) VALUES (?, ?, ?, ?, ?)",
+                    (digest, segment, offset, written, size)
+                )
+            self._set_document(url, digest, content_type, fetched_at)
+            self.conn.commit()
+        return digest, is_new
+
+    def _has_blob(self, digest: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone() is not None
+
+    def _append_blob(self, digest: str, compressed: bytes, size: int):
+        """Append a compressed blob to the active segment and record it in the manifest."""
+        segment = self._active_segment()
+        with open(self._segment_path(segment), 'ab') as f:
+            offset = f.tell()
+            f.write(compressed)
+        self.conn.execute(
+            "INSERT INTO blobs (hash, segment, offset, length, size) VALUES (?, ?, ?, ?, ?)",
+            (digest, segment, offset, len(compressed), size)
+        )
+
+    def _set_document(self, url: str, digest: str, content_type: str, fetched_at: str):
+        """Point a URL at a blob, keeping the most recently fetched version."""
+        self.conn.execute(
+            """INSERT INTO documents (url, hash, content_type, fetched_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT(url) DO UPDATE SET
+                   hash = excluded.hash,
+                   content_type = excluded.content_type,
+                   fetched_at = excluded.fetched_at
+               WHERE documents.fetched_at IS NULL OR excluded.fetched_at >= documents.fetched_at""",
+            (url, digest, content_type, fetched_at)
+        )
+
+    def _blob_location(self, digest: str) -> Tuple[int, int, int]:
+        row = self.conn.execute(
+            "SELECT segment, offset, length FROM blobs WHERE hash = ?", (digest,)
+        ).fetchone()
+        if not row:
+            raise KeyError(f"Blob {digest} not found")
+        return row
+
+    def read_blob(self, digest: str) -> bytes:
+        """Read and decompress a blob into memory."""
+        segment, offset, length = self._blob_location(digest)
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            compressed = f.read(length)
+        return zstd.ZstdDecompressor().decompress(compressed)
+
+    def export_blob(self, digest: str, dest: Path):
+        """Stream-decompress a blob to a file without holding it in memory."""
+        segment, offset, _ = self._blob_location(digest)
+        with open(self._segment_path(segment), 'rb') as src, open(dest, 'wb') as out:
+            src.seek(offset)
+            # The reader stops at the end of the blob's zstd frame
+            with zstd.ZstdDecompressor().stream_reader(src) as reader:
+                while True:
+                    data = reader.read(1024 * 1024)
+                    if not data:
+                        break
+                    out.write(data)
+
+    def get(self, url: str) -> Optional[bytes]:
+        """Get the stored content for a URL."""
+        doc = self.get_document(url)
+        return self.read_blob(doc['hash']) if doc else None
+
+    def get_document(self, url: str) -> Optional[Dict]:
+        """Get manifest entry for a URL."""
+        row = self.conn.execute(
+            """SELECT d.url, d.hash, d.content_type, d.fetched_at, b.size
+               FROM documents d JOIN blobs b ON b.hash = d.hash WHERE d.url = ?""",
+            (url,)
+        ).fetchone()
+        return self._row_to_document(row) if row else None
+
+    def iter_documents(self) -> Iterator[Dict]:
+        """Iterate over manifest entries for all stored URLs."""
+        rows = self.conn.execute(
+            """SELECT d.url, d.hash, d.content_type, d.fetched_at, b.size
+               FROM documents d JOIN blobs b ON b.hash = d.hash ORDER BY d.url"""
+        ).fetchall()
+        for row in rows:
+            yield self._row_to_document(row)
+
+    @staticmethod
+    def _row_to_document(row) -> Dict:
+        url, digest, content_type, fetched_at, size = row
+        return {
+            'url': url,
+            'hash': digest,
+            'content_type': content_type or '',
+            'fetched_at': fetched_at,
+            'size': size
+        }
+
+    def stats(self) -> Dict:
+        """Return document, blob and size totals."""
+        documents = self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        blobs, raw_size, stored_size = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(length), 0) FROM blobs"
+        ).fetchone()
+        segments = len(list(self.segments_dir.glob("seg-*.pack")))
+        return {
+            'documents': documents,
+            'blobs': blobs,
+            'segments': segments,
+            'raw_size': raw_size,
+            'stored_size': stored_size
+        }
+
+    def migrate_raw_dir(self, raw_dir: Path = RAW_DIR) -> Tuple[int, int]:
+        """Import legacy .raw/.json pairs, return (imported, skipped)."""
+        imported = skipped = 0
+        for meta_file in sorted(Path(raw_dir).glob("*.json")):
+            raw_file = meta_file.with_suffix('.raw')
+            try:
+                with open(meta_file, 'r', encoding='utf-8') as f:
+                    metadata = yaml.safe_load(f)
+                if not metadata or 'url' not in metadata or not raw_file.exists():
+                    logger.warning(f"Skipping incomplete pair {meta_file.name}")
+                    skipped += 1
+                    continue
+
+                self.put(
+                    metadata['url'],
+                    raw_file.read_bytes(),
+                    metadata.get('content_type', ''),
+                    metadata.get('timestamp')
+                )
+                imported += 1
+            except Exception as e:
+                logger.error(f"Error importing {meta_file}: {e}")
+                skipped += 1
+        return imported, skipped
+
+def run_store(args=None):
+    """Entry point for document store maintenance."""
+    if args is None:
+        # Handle direct script execution
+        parser = argparse.ArgumentParser(description="Manage the raw document store")
+        parser.add_argument('action', choices=['stats', 'migrate'], help='Store action')
+        parser.add_argument('--raw-dir', type=Path, default=RAW_DIR, help='Legacy raw directory to import')
+        args = parser.parse_args()
+
+    store = DocumentStore()
+    try:
+        if args.action == 'migrate':
+            print(f"\nImporting documents from {args.raw_dir}...")
+            imported, skipped = store.migrate_raw_dir(args.raw_dir)
+            print(f"✓ Imported {imported} documents ({skipped} skipped)")
+
+        stats = store.stats()
+        print("\n=== Document Store Statistics ===")
+        print(f"URLs: {stats['documents']}")
+        print(f"Unique blobs: {stats['blobs']}")
+        print(f"Segments: {stats['segments']}")
+        print(f"Raw size: {stats['raw_size'] / 1024 / 1024:.1f}MB")
+        print(f"Stored size: {stats['stored_size'] / 1024 / 1024:.1f}MB")
+        if stats['stored_size']:
+            print(f"Compression ratio: {stats['raw_size'] / stats['stored_size']:.2f}x")
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    run_store()
@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import heapq
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import yaml
+
+from .generations import IngestCheckpoint
+from .ingest import Ingester
+from .ratelimit import DomainPausedError, RetryableFetchError
+from .scrape import Scraper, load_urls
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+class SyncPipeline:
+    """Scrape and ingest in a single pass.
+
+    Fetch workers download URLs and persist each one to the document store
+    as usual, then hand it to a bounded queue. A single embedding thread
+    takes documents off the queue and writes them into a staged index
+    generation while the network keeps fetching. When the queue is full,
+    fetchers wait, so fetching never runs more than `queue_size` documents
+    ahead of embedding. Documents already in the store are fed through the
+    same queue, so the new generation holds the whole store. Progress is
+    checkpointed like `ingest`, and the generation is promoted once
+    everything is in.
+    """
+
+    def __init__(self, resume: bool = False):
+        with open(PROJECT_ROOT / "config.yaml") as f:
+            config = yaml.safe_load(f)
+        sync_config = config.get('sync', {}) or {}
+        self.queue_size = sync_config.get('queue_size', 32)
+        self.fetch_workers = sync_config.get('fetch_workers', 4)
+        self.resume = resume
+
+        self.scraper = Scraper()
+        self.max_retries = self.scraper.rate_config.get('max_retries', 3)
+
+        # Chroma, the model and the checkpoint's SQLite connection all live on this one thread
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sync-embed")
+        self.ingester = None
+        self.checkpoint = None
+        self.collections = {}
+        self.seen = set()
+
+        self.queue = None
+        self.retry_queue = []
+        self.in_flight = 0
+        self.stats = {'downloaded': 0, 'failed': 0, 'retries': 0, 'ingested': 0, 'chunks': 0, 'skipped': 0, 'errors': 0}
+        self.embed_time = 0.0
+        self.max_depth = 0
+
+    def _start_build(self):
+        """Load the model and open the staged generation (embedding thread)."""
+        self.ingester = Ingester(resume=self.resume)
+        self.ingester.generations.start_staging(self.resume)
+        self.ingester.write_build_info()
+        self.checkpoint = IngestCheckpoint(self.ingester.db_dir)
+        self.seen = self.checkpoint.done_hashes()
+        if self.seen:
+            logger.info(f"Resuming: {len(self.seen)} documents already ingested")
+
+    def _ingest(self, entry: Dict) -> Optional[int]:
+        """Embed one document into its staged shard, return its chunk count or None if skipped (embedding thread)."""
+        # Finished documents (on resume) and identical content under another URL are embedded once
+        if entry['hash'] in self.seen:
+            return None
+        self.seen.add(entry['hash'])
+
+        shard = self.ingester.router.shard_for(entry['url'])
+        if shard not in self.collections:
+            self.collections[shard] = self.ingester.open_staged_shard(shard, self.checkpoint)
+        return self.ingester.ingest_entry(self.collections[shard], entry, shard, self.checkpoint)
+
+    def _finish_build(self) -> str:
+        """Build derived indexes for every shard and promote the generation, return its name (embedding thread)."""
+        shards = sorted(set(self.collections) | self.checkpoint.shards())
+        for shard in shards:
+            if shard not in self.collections:
+                self.collections[shard] = self.ingester.open_staged_shard(shard, self.checkpoint)
+            self.ingester.finish_shard(shard, self.collections[shard], self.checkpoint)
+        if self.ingester.router.enabled:
+            self.ingester.router.write_manifest(self.ingester.db_dir, shards)
+        self.checkpoint.close()
+        return self.ingester.generations.promote()
+
+    async def _put(self, entry: Dict):
+        """Queue a stored document for embedding, waiting while the queue is full."""
+        await self.queue.put(entry)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    async def _feed_stored(self, entries: List[Dict]):
+        """Queue documents that were already in the store."""
+        for entry in entries:
+            await self._put(entry)
+
+    async def _fetch_worker(self):
+        """Fetch URLs from the retry queue until it is empty and no other worker may add to it."""
+        while self.retry_queue or self.in_flight:
+            if not self.retry_queue:
+                await asyncio.sleep(0.5)  # Another worker's fetch may still be retried
+                continue
+            due, order, attempt, url = heapq.heappop(self.retry_queue)
+            self.in_flight += 1
+            try:
+                wait = due - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await self._fetch_one(url, order, attempt)
+            finally:
+                self.in_flight -= 1
+
+    async def _fetch_one(self, url: str, order: int, attempt: int):
+        try:
+            result = await self.scraper._fetch_url(url)
+        except DomainPausedError as e:
+            # Nothing was sent, so this doesn't use up a retry
+            heapq.heappush(self.retry_queue, (time.monotonic() + e.retry_after, order, attempt, url))
+            print(f"↻ Deferred {e.retry_after:.0f}s: {url} ({e})")
+            return
+        except RetryableFetchError as e:
+            if attempt >= self.max_retries:
+                self.stats['failed'] += 1
+                print(f"✗ Failed: {url} ({e}, gave up after {attempt} retries)")
+                return
+            delay = self.scraper.retry_delay(attempt, e.retry_after)
+            heapq.heappush(self.retry_queue, (time.monotonic() + delay, order, attempt + 1, url))
+            self.stats['retries'] += 1
+            print(f"↻ Retrying in {delay:.0f}s: {url} ({e})")
+            return
+
+        if not result:
+            self.stats['failed'] += 1
+            print(f"✗ Failed: {url}")
+            return
+
+        # The raw document is persisted before it is embedded, as with a plain scrape
+        size_kb = self.scraper._save_content(result)
+        self.stats['downloaded'] += 1
+        print(f"✓ Downloaded: {url} ({size_kb}KB)")
+        entry = self.scraper.store.get_document(url)
+        if entry:
+            await self._put(entry)
+
+    async def _consume(self, build: asyncio.Future):
+        """Embed queued documents one at a time on the embedding thread until the end marker."""
+        loop = asyncio.get_running_loop()
+        await build
+        while True:
+            entry = await self.queue.get()
+            if entry is None:
+                return
+            start = time.perf_counter()
+            try:
+                num_chunks = await loop.run_in_executor(self.executor, self._ingest, entry)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Error processing {entry['url']}: {e}")
+                logger.debug("Full traceback:", exc_info=True)
+                continue
+            finally:
+                self.embed_time += time.perf_counter() - start
+
+            if num_chunks is None:
+                self.stats['skipped'] += 1
+            elif num_chunks:
+                self.stats['ingested'] += 1
+                self.stats['chunks'] += num_chunks
+                print(f"✓ Ingested: {entry['url']} ({num_chunks} chunks, {self.queue.qsize()} queued)")
+
+    async def run(self, urls: List[str]):
+        """Fetch and ingest urls plus everything already stored, then promote the new generation."""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+
+        # The model loads on the embedding thread while the first fetches go out
+        build = loop.run_in_executor(self.executor, self._start_build)
+
+        stored = list(self.scraper.store.iter_documents())
+        cached = {entry['url'] for entry in stored}
+        for order, url in enumerate(urls):
+            if url in cached:
+                print(f"• Cached: {url}")
+                continue
+            heapq.heappush(self.retry_queue, (0.0, order, 0, url))
+        print(f"\nSyncing {len(self.retry_queue)} new URLs and {len(stored)} stored documents...")
+
+        consumer = asyncio.create_task(self._consume(build))
+        producers = asyncio.gather(
+            self._feed_stored(stored),
+            *[self._fetch_worker() for _ in range(min(self.fetch_workers, max(len(self.retry_queue), 1)))]
+        )
+        # A failed model load or embedding crash would otherwise leave producers blocked on a full queue
+        done, _ = await asyncio.wait({consumer, producers}, return_when=asyncio.FIRST_COMPLETED)
+        if consumer in done:
+            consumer.result()
+            raise RuntimeError("Embedding stopped before all documents were queued")
+        await producers
+        await self.queue.put(None)
+        await consumer
+
+        print("\nBuilding derived indexes...")
+        generation = await loop.run_in_executor(self.executor, self._finish_build)
+
+        elapsed = time.perf_counter() - start
+        stats = self.stats
+        print(f"\nSync summary: {stats['downloaded']} downloaded, {stats['failed']} failed, {stats['retries']} retries, "
+              f"{stats['ingested']} ingested ({stats['chunks']} chunks), {stats['skipped']} skipped, {stats['errors']} errors")
+        print(f"• Embedding busy {self.embed_time / elapsed:.0%} of {elapsed:.0f}s, queue peaked at {self.max_depth}/{self.queue_size}")
+        for line in self.scraper.rate_summary():
+            print(f"• Rate control: {line}")
+        if self.scraper.render_summary():
+            print(f"• Selenium render times: {self.scraper.render_summary()}")
+        print(f"✓ Index generation {generation} is now live")
+
+    async def close(self):
+        await self.scraper.close()
+        if self.ingester:
+            self.executor.submit(self.ingester.close)
+        self.executor.shutdown(wait=True)
+
+async def run_sync(args=None):
+    """Entry point for single-pass scrape and ingest."""
+    if args is None:
+        # Handle direct script execution
+        parser = argparse.ArgumentParser(description="Scrape urls.txt and ingest documents as they arrive")
+        parser.add_argument('--resume', action='store_true', help='Continue an interrupted sync instead of starting a new build')
+        args = parser.parse_args()
+
+    urls = load_urls()
+    pipeline = SyncPipeline(resume=args.resume)
+    try:
+        await pipeline.run(urls)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("\nSync interrupted. Run `bot sync --resume` to continue")
+        raise
+    finally:
+        await pipeline.close()
+
+if __name__ == "__main__":
+    asyncio.run(run_sync())